@@ -1,9 +1,32 @@
 import os
-from main import main, get_analysis_results
-from flask import Flask, request, jsonify
+from serving import ASYNC_MODE, PING_INTERVAL, PING_TIMEOUT, EventBridge, configure_worker_pool, offload
+
+# Async serving modes must patch the standard library before anything else is imported.
+# Under gunicorn's gevent worker (see Procfile) the worker has already done this.
+if ASYNC_MODE.startswith('gevent') and __name__ == '__main__':
+    from gevent import monkey
+    monkey.patch_all()
+
+from main import (DEFAULT_DATA_LIMIT, PREDICTION_ENGINES, RESULT_FORMATS, main, columnar_code_tables,
+                  get_analysis_results, get_columnar_results, to_columnar_result)
+from bulk_analysis import analyze_profiles
+from coreset import CORESET_RESOLUTION
+from user_data_loader import UserDataLoader
+from emotion_statistics import DEFAULT_PERCENTILES, user_statistics
+from result_encoding import PAYLOAD_ENCODINGS, encode_payload
+from directory_sync import DirectorySync
+from feature_engine import rolling_schema
+from job_control import CANCELLED_JOBS, CancellationToken, JobCancelled, JobControl
+from sharding import HttpTransport, ShardCoordinator
+from profiling import JOB_ID_PATTERN
+from snapshot import SNAPSHOT_DIRECTORY, SNAPSHOT_PATH, SNAPSHOT_TOKEN, restore_snapshot, save_snapshot
+from metrics import REGISTRY, JOBS_QUEUED, JOBS_IN_FLIGHT, JOBS_TOTAL, JOB_DURATION
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO
+import hmac
 import threading
+import uuid
 
 app = Flask(__name__)
 
@@ -11,41 +34,334 @@ app = Flask(__name__)
 CORS(app, resources={r"/analyze-emotion": {"origins": ["http://localhost:3000", "https://harmonize-ai.vercel.app"]}})
 
 # Configuring CORS for SocketIO
-socketio = SocketIO(app, cors_allowed_origins=["http://localhost:3000", "https://harmonize-ai.vercel.app"])
+socketio = SocketIO(app, cors_allowed_origins=["http://localhost:3000", "https://harmonize-ai.vercel.app"],
+                    async_mode=ASYNC_MODE, ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT)
+configure_worker_pool()
+
+# Where per-request profiles are written when a client sets "profile": true
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# When set, user directories are kept resident and re-synchronized every this many seconds
+DIRECTORY_SYNC_INTERVAL = os.environ.get('DIRECTORY_SYNC_INTERVAL')
+directory_syncs = {}
+directory_syncs_lock = threading.Lock()
+
+# When set (comma-separated shard URLs), analyses are scattered to shard nodes started with
+# `python sharding.py serve` instead of loading the user directory in this process
+SHARD_URLS = [url for url in os.environ.get('SHARD_URLS', '').split(',') if url]
+shard_coordinator = ShardCoordinator([HttpTransport(url) for url in SHARD_URLS]) if SHARD_URLS else None
+# Request options the shard protocol does not carry; in shard mode a request setting one is rejected
+SHARD_UNSUPPORTED_OPTIONS = ('profile', 'rolling_window', 'deadline_seconds', 'engine', 'training_seconds', 'coreset')
+
+# Default time budget for an analysis, in seconds; a request can set its own with "deadline_seconds"
+JOB_DEADLINE_SECONDS = float(os.environ['JOB_DEADLINE_SECONDS']) if os.environ.get('JOB_DEADLINE_SECONDS') else None
 
-def analyze_and_emit(socketio, directory_path, data_limit, user_profile_dict, user_predictions_list):
+# A worker starts warm from the last snapshot; files changed since it was written are read again on first use
+if SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH):
     try:
-        # Using a structured JSON format for progress updates
-        emit_progress = lambda stage, details=None: socketio.emit('progress', {'stage': stage, 'details': details})
+        print(f"Restored snapshot: {restore_snapshot(SNAPSHOT_PATH)}")
+    except Exception as e:
+        print(f"Could not restore snapshot '{SNAPSHOT_PATH}': {e}")
+
+# Cancellation tokens of running jobs, by job id, and the job ids bound to each SocketIO session
+job_tokens = {}
+session_jobs = {}
+job_tokens_lock = threading.Lock()
+
+def register_job(job_id, sid=None):
+    """ Creates the cancellation token of a job, bound to the client session that should keep it alive """
+    token = CancellationToken()
+    with job_tokens_lock:
+        job_tokens[job_id] = token
+        if sid:
+            session_jobs.setdefault(sid, set()).add(job_id)
+    return token
+
+def unregister_job(job_id):
+    with job_tokens_lock:
+        job_tokens.pop(job_id, None)
+        for sid, job_ids in list(session_jobs.items()):
+            job_ids.discard(job_id)
+            if not job_ids:
+                del session_jobs[sid]
+
+def cancel_job(job_id, reason='cancelled'):
+    """ Cancels a running job; it stops at its next checkpoint. Returns False for unknown jobs """
+    with job_tokens_lock:
+        token = job_tokens.get(job_id)
+    if token is None:
+        return False
+    token.cancel(reason)
+    return True
+
+def get_directory_sync(directory_path):
+    """ Returns the polling DirectorySync for a directory, creating and starting it on first use """
+    with directory_syncs_lock:
+        sync = directory_syncs.get(directory_path)
+        if sync is None:
+            sync = DirectorySync(directory_path, poll_interval=float(DIRECTORY_SYNC_INTERVAL))
+            sync.scan()
+            sync.start()
+            directory_syncs[directory_path] = sync
+        return sync
+
+def positive_option(data, key, kind=float):
+    """ The request option `key` converted with `kind`, or None if it is not set """
+    raw = data.get(key)
+    if raw is None:
+        return None
+    description = 'a positive integer' if kind is int else 'a positive number'
+    try:
+        value = kind(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be {description}.")
+    if isinstance(raw, bool) or not value > 0 or value != float(raw):
+        raise ValueError(f"{key} must be {description}.")
+    return value
+
+def choice_option(data, key, choices):
+    """ The request option `key`, which must be one of `choices`; the first is the default """
+    value = data.get(key, choices[0])
+    if value not in choices:
+        raise ValueError(f"{key} must be one of {', '.join(choices)}.")
+    return value
+
+def shard_unsupported_options(data):
+    """ The options of an analysis request that a sharded analysis could not honour """
+    return [option for option in SHARD_UNSUPPORTED_OPTIONS
+            if data.get(option) and not (option == 'engine' and data[option] == 'forest')]
+
+def run_analysis_job(emit_progress, directory_path, data_limit, user_profile_dict, user_predictions_list,
+                     job_id=None, profile=False, feature_schema=None, job_control=None, emit_result=None,
+                     engine='forest', result_format='nested', training_seconds=None, coreset=None):
+    """ Runs the CPU-bound analysis; in the async modes this executes on a native worker thread """
+    JOBS_QUEUED.dec()
+    JOBS_IN_FLIGHT.inc()
+    try:
+        if shard_coordinator is not None:
+            if profile or feature_schema is not None or engine != 'forest' or training_seconds or coreset:
+                raise ValueError(f"Sharded analyses do not support {', '.join(SHARD_UNSUPPORTED_OPTIONS)}")
+            if result_format not in RESULT_FORMATS:
+                raise ValueError(f"Unknown result format '{result_format}'. Expected one of {RESULT_FORMATS}.")
+            # Shards run the whole analysis in one call: a cancellation is honoured before and after it,
+            # there are no partial results and the deadline does not degrade it
+            if job_control is not None:
+                job_control.checkpoint('shard_analysis')
+            data_limit = DEFAULT_DATA_LIMIT if data_limit is None else data_limit
+            results = shard_coordinator.analyze(user_profile_dict, user_predictions_list, data_limit,
+                                                update_progress=emit_progress)
+            if job_control is not None:
+                job_control.checkpoint('shard_analysis')
+            if result_format == 'columnar':
+                results = get_columnar_results([to_columnar_result(result) for result in results],
+                                               user_predictions_list)
+            return results
+
+        users = get_directory_sync(directory_path).users() if DIRECTORY_SYNC_INTERVAL else None
 
         # Call the main function with the emit_progress function
-        results = main(directory_path, data_limit, user_profile_dict, user_predictions_list,
-                       display_results=True, emit_progress=emit_progress)
+        return main(directory_path, data_limit, user_profile_dict, user_predictions_list,
+                    display_results=True, emit_progress=emit_progress,
+                    profile=profile, job_id=job_id, profile_dir=PROFILE_DIR, users=users,
+                    feature_schema=feature_schema, job_control=job_control, emit_result=emit_result,
+                    engine=engine, result_format=result_format, training_seconds=training_seconds,
+                    coreset=coreset)
+    finally:
+        JOBS_IN_FLIGHT.dec()
 
-        socketio.emit('completed', {'results': results})
+def analyze_and_emit(socketio, directory_path, data_limit, user_profile_dict, user_predictions_list,
+                     job_id=None, profile=False, feature_schema=None, job_control=None, engine='forest',
+                     result_format='nested', encoding='json', training_seconds=None, coreset=None):
+    bridge = EventBridge(socketio).start()
+    job_control = job_control or JobControl()
+    try:
+        # Using a structured JSON format for progress updates
+        emit_progress = lambda stage, details=None: bridge.emit('progress', {'stage': stage, 'details': details})
+        # Each user's predictions are sent as soon as that user is done, cheapest users first. Columnar
+        # codes cannot be read without the code tables, so the first result carries them too.
+        code_tables = [columnar_code_tables()] if result_format == 'columnar' else []
+
+        def emit_result(result):
+            payload = {'job_id': job_id, 'result': result}
+            if code_tables:
+                payload.update(code_tables.pop())
+            bridge.emit('partial_result', encode_payload(payload, encoding))
+
+        # Keep the analysis off the event loop so idle connections are still served
+        results = offload(run_analysis_job, emit_progress, directory_path, data_limit, user_profile_dict,
+                          user_predictions_list, job_id=job_id, profile=profile, feature_schema=feature_schema,
+                          job_control=job_control, emit_result=emit_result, engine=engine,
+                          result_format=result_format, training_seconds=training_seconds, coreset=coreset)
+
+        # The final summary repeats every result, in score order
+        bridge.emit('completed', encode_payload({'job_id': job_id, 'results': results,
+                                                 'strategy': job_control.strategy}, encoding))
+        return 'completed'
+    except JobCancelled as e:
+        CANCELLED_JOBS.inc(reason=e.reason)
+        bridge.emit('cancelled', {'job_id': job_id, 'reason': e.reason, 'stage': e.stage})
+        return 'cancelled'
     except Exception as e:
-        socketio.emit('error', {'message': str(e)})
+        bridge.emit('error', {'message': str(e)})
+        return 'error'
+    finally:
+        bridge.close()
+
+def start_analysis_task(directory_path, data_limit, user_profile_dict, user_predictions_list,
+                        job_id=None, profile=False, feature_schema=None, deadline_seconds=None, token=None,
+                        engine='forest', result_format='nested', encoding='json', training_seconds=None,
+                        coreset=None):
+    """ Function to start the analysis as a background task """
+    status = 'error'
+    try:
+        # The deadline counts from when the job starts running, not from when it was queued
+        job_control = JobControl(deadline_seconds, token=token)
+        with JOB_DURATION.time(), app.app_context():
+            status = analyze_and_emit(socketio, directory_path, data_limit, user_profile_dict, user_predictions_list,
+                                      job_id=job_id, profile=profile, feature_schema=feature_schema,
+                                      job_control=job_control, engine=engine, result_format=result_format,
+                                      encoding=encoding, training_seconds=training_seconds, coreset=coreset)
+    finally:
+        JOBS_TOTAL.inc(status=status)
+        unregister_job(job_id)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """ Exposes pipeline stage timings, loader cache and job counters in Prometheus text format """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
-def start_analysis_task(directory_path, data_limit, user_profile_dict, user_predictions_list):
-    """ Function to start the analysis in a separate thread """
-    with app.app_context():
-        analyze_and_emit(socketio, directory_path, data_limit, user_profile_dict, user_predictions_list)
+@app.route('/users/<user_id>/statistics', methods=['GET'])
+def get_user_statistics(user_id):
+    """ Per-emotion counts, means, variances and percentiles of every signal in a user's data """
+    directory_path = request.args.get('directory_path', 'sample-users')
+    try:
+        percentiles = tuple(float(p) for p in request.args['percentiles'].split(',')) \
+            if request.args.get('percentiles') else DEFAULT_PERCENTILES
+        if any(not 0 <= p <= 100 for p in percentiles):
+            raise ValueError("Percentiles must be between 0 and 100.")
+        users = get_directory_sync(directory_path).users() if DIRECTORY_SYNC_INTERVAL \
+            else UserDataLoader(directory_path).load_user_profiles()
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({'message': str(e)}), 400
+
+    user = next((user for user in users if str(user.profile.get('unique-id')) == user_id), None)
+    if user is None:
+        return jsonify({'message': 'Unknown user', 'user_id': user_id}), 404
+    # Cached per loaded data object, so repeated requests only pay for finding the user
+    return jsonify(user_statistics(user, percentiles))
 
 @app.route('/analyze-emotion', methods=['POST'])
 def analyze_emotion():
     data = request.json
     directory_path = data.get('directory_path', 'sample-users')
-    data_limit = data.get('data_limit', 30000)
+    # Without a limit, each matched user is trained on the rows the directory's tuning recommends
+    data_limit = data.get('data_limit')
     user_profile_dict = data.get('user_profile', {'age': 19, 'gender': 'male'})
     user_predictions_list = data.get('user_predictions', [
         {"heart-rate-bpm": 120, "breathing-rate-breaths-min": 24, "hrv-ms": 30, "skin-temp-c": 20, "emg-mv": 0.1, "bvp-unit": 0.2},
         {"heart-rate-bpm": 80, "breathing-rate-breaths-min": 18, "hrv-ms": 55, "skin-temp-c": 32, "emg-mv": 0.3, "bvp-unit": 0.9}])
+    profile = bool(data.get('profile', False))
+    job_id = str(data.get('job_id') or uuid.uuid4().hex)
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        # Job ids name the profile files, so they must not be able to point outside PROFILE_DIR
+        return jsonify({'message': "job_id may only contain letters, digits, '_' and '-'"}), 400
+    unsupported = shard_unsupported_options(data) if shard_coordinator is not None else []
+    if unsupported:
+        return jsonify({'message': f"Not supported by sharded analyses: {', '.join(unsupported)}"}), 400
+    try:
+        # Optional rolling-window features, e.g. {"rolling_window": 10}
+        rolling_window = positive_option(data, 'rolling_window', int)
+        # Optional time budget; as it runs out the analysis degrades to cheaper strategies, down to the prototypes
+        deadline_seconds = positive_option(data, 'deadline_seconds')
+        # Optional coreset training: true for the default grid resolution, or a resolution
+        coreset = CORESET_RESOLUTION if data.get('coreset') is True else \
+            None if data.get('coreset') is False else positive_option(data, 'coreset', int)
+        # Optional time budget per user model; forests grow until it is spent or their accuracy plateaus
+        training_seconds = positive_option(data, 'training_seconds')
+        # "columnar" sends the samples once plus an emotion code per sample and user; "gzip" compresses large events
+        result_format = choice_option(data, 'result_format', RESULT_FORMATS)
+        encoding = choice_option(data, 'encoding', PAYLOAD_ENCODINGS)
+        # "knn" predicts from the matched users' samples by nearest neighbours, without training models
+        engine = choice_option(data, 'engine', PREDICTION_ENGINES)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    feature_schema = rolling_schema(rolling_window) if rolling_window else None
+    deadline_seconds = deadline_seconds or JOB_DEADLINE_SECONDS
+    # The SocketIO session receiving the events; the job is cancelled if that client disconnects
+    token = register_job(job_id, sid=data.get('sid'))
 
     # Schedule the analysis task to start after the request has been responded to
-    threading.Thread(target=start_analysis_task, args=(directory_path, data_limit, user_profile_dict, user_predictions_list)).start()
+    JOBS_QUEUED.inc()
+    socketio.start_background_task(start_analysis_task, directory_path, data_limit, user_profile_dict,
+                                   user_predictions_list, job_id=job_id, profile=profile, feature_schema=feature_schema,
+                                   deadline_seconds=deadline_seconds, token=token, engine=engine,
+                                   result_format=result_format, encoding=encoding,
+                                   training_seconds=training_seconds, coreset=coreset)
+
+    return jsonify({'message': 'Analysis started', 'job_id': job_id}), 202
+
+@app.route('/analyze-emotion/bulk', methods=['POST'])
+def analyze_emotion_bulk():
+    """ Analyses many profiles against one user directory, training each selected model once for all of them """
+    data = request.json
+    directory_path = data.get('directory_path', 'sample-users')
+    # [{"profile_id": ..., "user_profile": {...}, "user_predictions": [...]}, ...]
+    profile_requests = data.get('profiles')
+    if not isinstance(profile_requests, list) or not profile_requests:
+        return jsonify({'message': 'Expected a non-empty list of profiles'}), 400
+    for index, profile_request in enumerate(profile_requests):
+        if not isinstance(profile_request, dict) \
+                or not isinstance(profile_request.get('user_profile', {}), (dict, type(None))) \
+                or not isinstance(profile_request.get('user_predictions', []), (list, type(None))):
+            return jsonify({'message': f"Profile {index} must be an object with a user_profile object and a "
+                                       f"user_predictions list"}), 400
+    try:
+        data_limit = positive_option(data, 'data_limit', int) or DEFAULT_DATA_LIMIT
+        result_format = choice_option(data, 'result_format', RESULT_FORMATS)
+        users = get_directory_sync(directory_path).users() if DIRECTORY_SYNC_INTERVAL \
+            else UserDataLoader(directory_path).load_user_profiles()
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({'message': str(e)}), 400
+
+    # Keep the analysis off the event loop so other connections are still served
+    results = offload(analyze_profiles, users, profile_requests, data_limit, result_format=result_format)
+    return jsonify({'results': results})
+
+@app.route('/snapshot', methods=['POST'])
+def write_snapshot():
+    """ Writes the warm state of SNAPSHOT_DIRECTORY to SNAPSHOT_PATH, for the next worker to restore at start-up """
+    if not SNAPSHOT_PATH:
+        return jsonify({'message': 'SNAPSHOT_PATH is not configured'}), 400
+    # The file written is what every new worker starts from, so only holders of the token may replace it
+    if not SNAPSHOT_TOKEN:
+        return jsonify({'message': 'SNAPSHOT_TOKEN is not configured'}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {SNAPSHOT_TOKEN}"):
+        return jsonify({'message': 'Invalid snapshot token'}), 403
+    try:
+        summary = offload(save_snapshot, SNAPSHOT_DIRECTORY, SNAPSHOT_PATH)
+    except FileNotFoundError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({'message': 'Snapshot written', 'path': SNAPSHOT_PATH, **summary})
+
+@app.route('/analyze-emotion/<job_id>/cancel', methods=['POST'])
+def cancel_analysis(job_id):
+    if not cancel_job(job_id):
+        return jsonify({'message': 'Unknown or finished job', 'job_id': job_id}), 404
+    return jsonify({'message': 'Cancellation requested', 'job_id': job_id}), 202
+
+@socketio.on('cancel')
+def handle_cancel(data):
+    cancel_job(str((data or {}).get('job_id')))
 
-    return jsonify({'message': 'Analysis started'}), 202
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    # Nobody is left to receive the results, so stop the client's jobs at their next checkpoint
+    with job_tokens_lock:
+        job_ids = list(session_jobs.get(request.sid, ()))
+    for job_id in job_ids:
+        cancel_job(job_id, 'client disconnected')
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    socketio.run(app, host='0.0.0.0', port=port, debug=True, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    # The Werkzeug reloader and debugger only apply to the threading development server
+    socketio.run(app, host='0.0.0.0', port=port, debug=ASYNC_MODE == 'threading', allow_unsafe_werkzeug=True)
\ No newline at end of file
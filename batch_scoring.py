@@ -0,0 +1,181 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+
+from emotion_analysis import EmotionAnalysis
+from main import find_most_suitable_user, find_valence_range, read_user_profile
+from physiological_data import FEATURE_DTYPE
+from user_data_loader import UserDataLoader
+from utilities import FEATURE_COLUMNS, LABEL_TO_EMOTION
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# Forests loaded once per worker process by the pool initializer
+_worker_models = None
+
+
+def iter_samples(input_path, offset=0):
+    """
+    Streams sample dicts from a JSON-lines or CSV file, skipping the first `offset` samples.
+    In JSON-lines files, blank lines and lines starting with '#' are ignored, as in read_test_samples.
+    """
+    with open(input_path, 'r', newline='') as file:
+        if input_path.endswith('.csv'):
+            samples = csv.DictReader(file)
+        else:
+            samples = (json.loads(line) for line in file if line.strip() and not line.startswith('#'))
+        yield from itertools.islice(samples, offset, None)
+
+
+def iter_chunks(samples, chunk_size):
+    """
+    Groups samples into float32 feature arrays of at most `chunk_size` rows.
+    """
+    while True:
+        chunk = list(itertools.islice(samples, chunk_size))
+        if not chunk:
+            return
+        features = np.array([[float(sample.get(column) or 0) for column in FEATURE_COLUMNS] for sample in chunk],
+                            dtype=FEATURE_DTYPE)
+        yield features
+
+
+def count_scored(output_path):
+    """
+    Counts the complete lines of an output file, dropping a trailing partial line left by an interrupted run.
+    """
+    if not os.path.exists(output_path):
+        return 0
+    count = 0
+    complete_bytes = 0
+    with open(output_path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            count += 1
+            complete_bytes += len(line)
+    if complete_bytes != os.path.getsize(output_path):
+        with open(output_path, 'r+b') as file:
+            file.truncate(complete_bytes)
+    return count
+
+
+def train_models(directory_path, user_profile_dict, data_limit, update_progress):
+    """
+    Matches users to the profile and trains their models, as main() does for a request.
+
+    Returns:
+        list: (user ID, fitted classifier) pairs, in score order.
+    """
+    users = UserDataLoader(directory_path, update_progress=update_progress).load_user_profiles()
+    if not users:
+        raise ValueError(f"No users found in '{directory_path}'.")
+    models = []
+    for user, score, data_count in find_most_suitable_user(user_profile_dict, users, data_limit, update_progress):
+        EmotionAnalysis.train_user_model(user, user.data_prefix(data_count)[:data_count], update_progress=update_progress)
+        models.append((user.profile.get('unique-id'), user.emotion_model.emotion_model))
+    return models
+
+
+def _init_worker(models_path):
+    global _worker_models
+    _worker_models = joblib.load(models_path)
+
+
+def _score_chunk(features):
+    # Label codes of every sample, one array per model
+    return [classifier.predict(features).astype(np.uint8) for _, classifier in _worker_models]
+
+
+def _format_rows(first_offset, user_ids, codes):
+    lines = []
+    for row in range(len(codes[0]) if codes else 0):
+        predictions = []
+        for user_id, user_codes in zip(user_ids, codes):
+            emotion = LABEL_TO_EMOTION.get(int(user_codes[row]), 'Undefined')
+            predictions.append({"User ID": user_id, "Predicted Emotion": emotion,
+                                "Valence Range": list(find_valence_range(emotion))})
+        lines.append(json.dumps({"Offset": first_offset + row, "Predictions": predictions}, default=str) + "\n")
+    return "".join(lines)
+
+
+def score_file(input_path, output_path, models_path, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, offset=None,
+               update_progress=None):
+    """
+    Scores every sample of an input file with saved models and appends one JSON line per sample.
+
+    Chunks are predicted on a process pool with at most two chunks per worker in flight and written
+    in input order as they complete, so memory stays bounded by the chunk size whatever the file size.
+
+    Args:
+        input_path (str): A JSON-lines or CSV file of samples.
+        output_path (str): JSON-lines output, one {"Offset", "Predictions"} object per sample.
+        models_path (str): Models saved by `train_models` and joblib.
+        offset (int, optional): Number of samples to skip; defaults to the samples already in the output,
+            so an interrupted run resumes where it stopped.
+
+    Returns:
+        int: The offset after the last scored sample.
+    """
+    update_progress = update_progress or (lambda stage, details=None: None)
+    if offset is None:
+        offset = count_scored(output_path)
+    workers = workers or os.cpu_count() or 1
+    user_ids = [user_id for user_id, _ in joblib.load(models_path)]
+
+    update_progress("Scoring Samples", {"file": "batch_scoring.py", "function": "score_file",
+                                        "offset": f"{offset}", "workers": f"{workers}"})
+    in_flight = deque()
+    next_offset = offset
+    with open(output_path, 'a') as output, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(models_path,)) as pool:
+        def write_oldest():
+            nonlocal next_offset
+            future, size = in_flight.popleft()
+            output.write(_format_rows(next_offset, user_ids, future.result()))
+            output.flush()
+            next_offset += size
+            update_progress("Chunk Scored", {"file": "batch_scoring.py", "function": "score_file",
+                                             "offset": f"{next_offset}"})
+
+        for features in iter_chunks(iter_samples(input_path, offset), chunk_size):
+            in_flight.append((pool.submit(_score_chunk, features), len(features)))
+            if len(in_flight) >= 2 * workers:
+                write_oldest()
+        while in_flight:
+            write_oldest()
+    return next_offset
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a large JSON-lines or CSV file of samples with the matched users' models.")
+    parser.add_argument("input", help="JSON-lines (.jsonl, .txt) or CSV (.csv) file of samples.")
+    parser.add_argument("output", help="JSON-lines file the predictions are appended to.")
+    parser.add_argument("--directory", default="sample-users", help="Directory containing user workbooks.")
+    parser.add_argument("--profile", default=os.path.join("test-user", "user-profile.txt"),
+                        help="User profile file to match against, in the test-user format.")
+    parser.add_argument("--data-limit", type=int, default=30000, help="Limit on the amount of data to consider.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Samples per chunk.")
+    parser.add_argument("--workers", type=int, default=None, help="Scoring processes (default: CPU count).")
+    parser.add_argument("--offset", type=int, default=None,
+                        help="Samples to skip (default: resume after the samples already in the output).")
+    parser.add_argument("--models", default=None,
+                        help="Saved models (default: <output>.models). Trained and saved if missing, "
+                             "so resumed runs score with the same models.")
+    args = parser.parse_args()
+
+    progress = lambda stage, details=None: print(f"{stage}: {details}" if details else stage)
+    models_path = args.models or f"{args.output}.models"
+    if not os.path.exists(models_path):
+        trained = train_models(args.directory, read_user_profile(args.profile), args.data_limit, progress)
+        joblib.dump(trained, models_path)
+    final_offset = score_file(args.input, args.output, models_path, chunk_size=args.chunk_size, workers=args.workers,
+                              offset=args.offset, update_progress=progress)
+    print(f"Scored samples up to offset {final_offset} into {args.output}")
@@ -0,0 +1,168 @@
+import datetime
+from collections import defaultdict
+
+import numpy as np
+
+from main import (DAY_TOLERANCE, DEFAULT_SIMILARITY_WEIGHT, INTEGER_TOLERANCE, SIMILARITY_WEIGHTS,
+                  get_columnar_results, get_user_result, pipeline_stage, score_threshold, select_suitable_users)
+from metrics import REGISTRY
+from physiological_data import FEATURE_DTYPE
+from training_coordinator import TRAINING_COORDINATOR, training_key
+from utilities import FEATURE_COLUMNS, format_data
+
+BULK_PROFILES = REGISTRY.counter('edith_bulk_profiles_total', 'Profiles analysed through the bulk endpoint.')
+BULK_MODELS = REGISTRY.counter('edith_bulk_models_total', 'Distinct models the bulk profiles needed.')
+
+_DAY_MICROSECONDS = 24 * 60 * 60 * 10 ** 6
+
+
+def _attribute_scores(profile_values, user_values):
+    """
+    Unweighted scores of one attribute for every (profile, user) pair, with the same rules as
+    calculate_similarity_score: integers and dates fall off linearly, strings match case-insensitively.
+    """
+    scores = np.zeros((len(profile_values), len(user_values)))
+
+    profile_ints = np.array([isinstance(value, int) for value in profile_values])
+    user_ints = np.array([isinstance(value, int) for value in user_values])
+    if profile_ints.any() and user_ints.any():
+        profile_numbers = np.array([value if is_int else 0 for value, is_int in zip(profile_values, profile_ints)],
+                                   dtype=np.float64)
+        user_numbers = np.array([value if is_int else 0 for value, is_int in zip(user_values, user_ints)],
+                                dtype=np.float64)
+        falloff = np.maximum(0, 1 - np.abs(profile_numbers[:, None] - user_numbers[None, :]) / INTEGER_TOLERANCE)
+        scores += np.where(profile_ints[:, None] & user_ints[None, :], falloff, 0)
+
+    # Strings are compared as codes; non-strings get codes that never match
+    codes = {}
+    profile_codes = np.array([codes.setdefault(value.lower(), len(codes)) if isinstance(value, str) else -1
+                              for value in profile_values])
+    user_codes = np.array([codes.get(value.lower(), -2) if isinstance(value, str) else -3 for value in user_values])
+    scores += profile_codes[:, None] == user_codes[None, :]
+
+    profile_dates = np.array([isinstance(value, datetime.datetime) for value in profile_values])
+    user_dates = np.array([isinstance(value, datetime.datetime) for value in user_values])
+    if profile_dates.any() and user_dates.any():
+        epoch = np.datetime64(0, 'us')
+        profile_times = np.array([np.datetime64(value, 'us') if is_date else epoch
+                                  for value, is_date in zip(profile_values, profile_dates)])
+        user_times = np.array([np.datetime64(value, 'us') if is_date else epoch
+                               for value, is_date in zip(user_values, user_dates)])
+        # Whole days, floored like timedelta.days
+        microseconds = (profile_times[:, None] - user_times[None, :]).astype(np.int64)
+        days = np.abs(np.floor_divide(microseconds, _DAY_MICROSECONDS))
+        scores += np.where(profile_dates[:, None] & user_dates[None, :], np.maximum(0, 1 - days / DAY_TOLERANCE), 0)
+    return scores
+
+
+def similarity_matrix(profiles, users):
+    """
+    Scores every profile against every user, one vectorized pass per attribute.
+
+    Returns:
+        numpy.ndarray: Shape (profiles, users); entry [i, j] equals
+            calculate_similarity_score(users[j].profile, profiles[i]).
+    """
+    total_weight = sum(SIMILARITY_WEIGHTS.values())
+    scores = np.zeros((len(profiles), len(users)))
+    for key in dict.fromkeys(key for profile in profiles for key in profile):
+        profile_values = [profile.get(key) for profile in profiles]
+        # A missing attribute scores nothing, like one with an unmatched type
+        user_values = [user.profile.get(key) for user in users]
+        scores += SIMILARITY_WEIGHTS.get(key, DEFAULT_SIMILARITY_WEIGHT) * _attribute_scores(profile_values,
+                                                                                             user_values)
+    return scores / total_weight if total_weight > 0 else scores
+
+
+def select_for_profiles(scores, users, data_limit=30000):
+    """
+    Applies select_suitable_users to every row of a similarity matrix. Only the users above the
+    threshold, or the best one if none is, are sorted and walked.
+    """
+    threshold = score_threshold(data_limit)
+    quiet = lambda stage, details=None: None
+    selections = []
+    for row in scores:
+        candidates = np.flatnonzero(row > threshold)
+        if len(candidates):
+            # A stable sort keeps ties in directory order, as find_most_suitable_user does
+            candidates = candidates[np.argsort(-row[candidates], kind='stable')]
+        elif len(row):
+            candidates = [int(np.argmax(row))]
+        selections.append(select_suitable_users([(users[j], float(row[j])) for j in candidates], data_limit,
+                                                quiet))
+    return selections
+
+
+def _sample_features(samples):
+    return np.array([format_data(sample) for sample in samples], dtype=FEATURE_DTYPE).reshape(-1, len(FEATURE_COLUMNS))
+
+
+def analyze_profiles(users, profile_requests, data_limit=30000, update_progress=None, result_format='nested'):
+    """
+    Analyses many profiles against the same users, sharing the work between them.
+
+    All profiles are scored in one matrix pass and matched as main() would match each alone. Each
+    distinct (user, row count) model the selections need is then trained once, through the
+    training coordinator, and predicts the samples of every profile that selected it in one batch.
+    The cost grows with the number of distinct models rather than the number of profiles.
+
+    Args:
+        users (list): The User objects to match against.
+        profile_requests (list): Dicts with a "user_profile", its "user_predictions" samples and an
+            optional "profile_id", as in an /analyze-emotion request.
+        data_limit (int): The limit on the amount of data to consider per profile.
+        result_format (str): 'nested' or 'columnar', as for main().
+
+    Returns:
+        list: One {"Profile ID", "Results"} dict per request, in request order, whose results are
+            those main() returns for that profile.
+    """
+    update_progress = update_progress or (lambda stage, details=None: None)
+    profiles = [profile_request.get('user_profile') or {} for profile_request in profile_requests]
+    samples = [profile_request.get('user_predictions') or [] for profile_request in profile_requests]
+    BULK_PROFILES.inc(len(profiles))
+
+    update_progress("Scoring Profiles", {"file": "bulk_analysis.py", "function": "analyze_profiles",
+                                         "profiles": f"{len(profiles)}", "users": f"{len(users)}"})
+    with pipeline_stage('profile_match'):
+        selections = select_for_profiles(similarity_matrix(profiles, users), users, data_limit)
+
+    # The profiles selecting each distinct model, in order of first use
+    model_users = {}
+    model_profiles = defaultdict(list)
+    for index, selection in enumerate(selections):
+        for user, score, data_count in selection:
+            key = training_key(user, data_count)
+            model_users.setdefault(key, (user, data_count))
+            model_profiles[key].append(index)
+    BULK_MODELS.inc(len(model_users))
+    update_progress("Distinct Models Selected", {"file": "bulk_analysis.py", "function": "analyze_profiles",
+                                                 "profiles": f"{len(profiles)}", "models": f"{len(model_users)}"})
+
+    features = [_sample_features(profile_samples) for profile_samples in samples]
+    predictions = {}
+    for key, (user, data_count) in model_users.items():
+        with pipeline_stage('train'):
+            model, _ = TRAINING_COORDINATOR.train(user, data_count, update_progress=update_progress)
+        indexes = model_profiles[key]
+        batch = np.vstack([features[index] for index in indexes])
+        with pipeline_stage('predict'):
+            emotions = model.predict_emotions(batch)
+        offset = 0
+        for index in indexes:
+            predictions[index, key] = emotions[offset:offset + len(features[index])]
+            offset += len(features[index])
+
+    results = []
+    with pipeline_stage('compile_results'):
+        for index, (profile_request, selection) in enumerate(zip(profile_requests, selections)):
+            user_results = [get_user_result(user, samples[index], profiles[index], result_format,
+                                            predictions=predictions[index, training_key(user, data_count)])
+                            for user, score, data_count in selection]
+            if result_format == 'columnar':
+                user_results = get_columnar_results(user_results, samples[index])
+            results.append({"Profile ID": profile_request.get('profile_id', index), "Results": user_results})
+    update_progress("Bulk Analysis Complete", {"file": "bulk_analysis.py", "function": "analyze_profiles",
+                                               "profiles": f"{len(profiles)}", "models": f"{len(model_users)}"})
+    return results
@@ -70,4 +70,71 @@ def test_error_handling(client):
     }
 
     response = client.post('/analyze-emotion', data=json.dumps(invalid_data), content_type='application/json')
-    assert response.status_code != 200
\ No newline at end of file
+    assert response.status_code != 200
+
+def test_metrics_endpoint(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.data.decode()
+    assert 'edith_stage_duration_seconds' in body
+    assert 'edith_jobs_in_flight' in body
+
+def test_rejects_job_ids_that_are_not_file_names(client):
+    data = {"profile": True, "job_id": "../../x", "user_profile": {"age": 21, "gender": "female"}}
+    response = client.post('/analyze-emotion', data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 400
+
+def test_sharded_analyses_reject_options_the_shards_cannot_honour(client, monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, 'shard_coordinator', object())
+    data = {"engine": "knn", "coreset": True, "user_profile": {"age": 21, "gender": "female"}}
+    response = client.post('/analyze-emotion', data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 400
+    assert 'engine, coreset' in json.loads(response.data)['message']
+
+@pytest.mark.parametrize('options', [{"rolling_window": "ten"}, {"rolling_window": 0}, {"rolling_window": -3},
+                                     {"rolling_window": 2.5}, {"deadline_seconds": "soon"},
+                                     {"deadline_seconds": 0}, {"deadline_seconds": -1}, {"coreset": "fine"},
+                                     {"coreset": 0}, {"coreset": -8}, {"training_seconds": "long"},
+                                     {"training_seconds": -2}, {"result_format": "colunmar"},
+                                     {"encoding": "zip"}, {"engine": "bogus"}])
+def test_rejects_invalid_numeric_options(client, options):
+    data = {"user_profile": {"age": 21, "gender": "female"}, **options}
+    response = client.post('/analyze-emotion', data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 400
+    assert list(options)[0] in json.loads(response.data)['message']
+
+@pytest.mark.parametrize('data', [{"profiles": [1]}, {"profiles": [{"user_profile": "male"}]},
+                                  {"profiles": [{"user_predictions": {}}]},
+                                  {"profiles": [{"user_profile": {}}], "data_limit": "x"},
+                                  {"profiles": [{"user_profile": {}}], "result_format": "table"}])
+def test_bulk_analysis_rejects_malformed_profiles(client, data):
+    response = client.post('/analyze-emotion/bulk', data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 400
+
+def test_snapshot_requires_the_configured_token(client, monkeypatch, tmp_path):
+    import app as app_module
+    monkeypatch.setattr(app_module, 'SNAPSHOT_PATH', str(tmp_path / 'warm.snapshot'))
+    monkeypatch.setattr(app_module, 'SNAPSHOT_TOKEN', None)
+    assert client.post('/snapshot').status_code == 403
+    monkeypatch.setattr(app_module, 'SNAPSHOT_TOKEN', 'secret')
+    assert client.post('/snapshot', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.post('/snapshot', json={'directory_path': '/'}).status_code == 403
+    assert not (tmp_path / 'warm.snapshot').exists()
+
+def test_first_columnar_partial_result_carries_the_code_tables(socketio_client, monkeypatch):
+    import app as app_module
+
+    def fake_job(*args, emit_result=None, **kwargs):
+        emit_result({"Emotion Codes": [1]})
+        emit_result({"Emotion Codes": [2]})
+        return {}
+
+    monkeypatch.setattr(app_module, 'offload', lambda fn, *args, **kwargs: fake_job(*args, **kwargs))
+    socketio_client.get_received()
+    app_module.analyze_and_emit(app_module.socketio, 'sample-users', None, {}, [], job_id='j1',
+                                result_format='columnar')
+    partial = [event['args'][0] for event in socketio_client.get_received() if event['name'] == 'partial_result']
+    assert [event['result'] for event in partial] == [{"Emotion Codes": [1]}, {"Emotion Codes": [2]}]
+    assert partial[0]['Emotions'][1] and len(partial[0]['Valence Ranges']) == len(partial[0]['Emotions'])
+    assert 'Emotions' not in partial[1]
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from model_registry import estimate_model_bytes
+from neighbor_index import FEATURE_SCALES
+from physiological_data import FEATURE_DTYPE, LABEL_DTYPE, PhysiologicalData
+from user_data_loader import UserDataLoader
+from user_emotion_model import UserEmotionModel
+
+# Grid cells per FEATURE_SCALES unit of each signal; higher keeps more rows and more accuracy
+CORESET_RESOLUTION = int(os.environ.get('CORESET_RESOLUTION', 16))
+
+# Coresets of each PhysiologicalData object, per (rows, resolution), dropped with the object like
+# the statistics cache in emotion_statistics.py
+_coreset_cache = weakref.WeakKeyDictionary()
+_coreset_cache_lock = threading.Lock()
+
+
+class Coreset:
+    """
+    A weighted summary of labelled samples: one row per occupied grid cell and emotion, holding
+    the mean of the samples in the cell, weighted by how many there were.
+    """
+    __slots__ = ('data', 'weights', 'source_rows')
+
+    def __init__(self, data, weights, source_rows):
+        self.data = data
+        self.weights = weights
+        self.source_rows = source_rows
+
+    def __len__(self):
+        return len(self.data)
+
+
+def build_coreset(data, resolution=CORESET_RESOLUTION):
+    """
+    Compresses samples into a Coreset by quantizing the six signals, divided by FEATURE_SCALES, to a
+    grid of `resolution` cells per unit, separately for every emotion label. Redundant samples
+    collapse into one weighted row, so the size is bounded by the occupied cells whatever the row count.
+    The grouping is one sort over the cell keys, O(n log n).
+    """
+    data = PhysiologicalData.from_samples(data)
+    if not len(data):
+        return Coreset(data, np.empty(0, dtype=np.float64), 0)
+    cells = np.floor(data.features / FEATURE_SCALES * resolution).astype(np.int64)
+    keys = np.column_stack([data.labels.astype(np.int64), cells])
+    unique_keys, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    features = np.column_stack([np.bincount(inverse, weights=data.features[:, j], minlength=len(counts))
+                                for j in range(data.features.shape[1])]) / counts[:, None]
+    compressed = PhysiologicalData(features.astype(FEATURE_DTYPE), unique_keys[:, 0].astype(LABEL_DTYPE))
+    return Coreset(compressed, counts.astype(np.float64), len(data))
+
+
+def data_coreset(data, rows=None, resolution=CORESET_RESOLUTION):
+    """
+    The coreset of the first `rows` samples of a loaded data object, built once and cached for as
+    long as the object is alive.
+    """
+    data = PhysiologicalData.from_samples(data)
+    rows = len(data) if rows is None else min(rows, len(data))
+    with _coreset_cache_lock:
+        cached = _coreset_cache.get(data, {}).get((rows, resolution))
+    if cached is not None:
+        return cached
+
+    coreset = build_coreset(data[:rows], resolution)
+    with _coreset_cache_lock:
+        _coreset_cache.setdefault(data, {})[(rows, resolution)] = coreset
+    return coreset
+
+
+def cached_coresets(data):
+    """
+    The cached coresets of a data object, by (rows, resolution).
+    """
+    with _coreset_cache_lock:
+        return dict(_coreset_cache.get(data, {}))
+
+
+def restore_coresets(data, coresets):
+    """
+    Seeds the cache with coresets built earlier from the same data, e.g. from a snapshot.
+    """
+    with _coreset_cache_lock:
+        _coreset_cache.setdefault(data, {}).update(coresets)
+
+
+def _fit(features, labels, sample_weight=None):
+    model = UserEmotionModel(None, {})
+    started = time.perf_counter()
+    model.train_model(features, labels, sample_weight=sample_weight)
+    return model, time.perf_counter() - started
+
+
+def evaluate_coreset(data, resolution=CORESET_RESOLUTION, test_fraction=0.25, seed=0):
+    """
+    Trains one model on all training rows and one on their coreset, and scores both on the same
+    held-out rows.
+
+    Returns:
+        dict: "full" and "coreset" entries with rows, training seconds, estimated model bytes and
+            held-out accuracy.
+    """
+    data = PhysiologicalData.from_samples(data)
+    order = np.random.default_rng(seed).permutation(len(data))
+    test_rows = int(len(data) * test_fraction)
+    test, train = order[:test_rows], order[test_rows:]
+    train_data = PhysiologicalData(data.features[train], data.labels[train])
+
+    coreset = build_coreset(train_data, resolution)
+    report = {"resolution": resolution, "test_rows": int(test_rows)}
+    for name, (features, labels, weights) in (("full", (train_data.features, train_data.labels, None)),
+                                               ("coreset", (coreset.data.features, coreset.data.labels,
+                                                            coreset.weights))):
+        model, seconds = _fit(features, labels, weights)
+        accuracy = float(model.emotion_model.score(data.features[test], data.labels[test])) if test_rows else None
+        report[name] = {"rows": int(len(labels)), "train_seconds": round(seconds, 3),
+                        "model_bytes": int(estimate_model_bytes(model)), "accuracy": accuracy}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare models trained on coresets with models trained on all rows.")
+    parser.add_argument("directory", nargs="?", default="sample-users", help="Directory containing user workbooks.")
+    parser.add_argument("--resolution", type=int, default=CORESET_RESOLUTION, help="Grid cells per signal scale unit.")
+    parser.add_argument("--data-limit", type=int, default=None, help="Rows of each user to use (default: all).")
+    args = parser.parse_args()
+
+    loader = UserDataLoader(args.directory)
+    for user in loader.load_user_profiles():
+        data = user.data_prefix(args.data_limit)[:args.data_limit] if args.data_limit else user.physiological_data
+        report = evaluate_coreset(data, args.resolution)
+        print(json.dumps({"User ID": user.profile.get('unique-id'), **report}))
@@ -0,0 +1,183 @@
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from physiological_data import PhysiologicalData
+from user_data_loader import UserDataLoader
+from user_emotion_model import UserEmotionModel
+
+TUNING_FILENAME = 'data-limit-tuning.json'
+TUNING_VERSION = 1
+
+# Training-set sizes measured by default; each user's full training split is always measured too
+DEFAULT_TRAINING_SIZES = (250, 500, 1000, 2000, 4000, 8000, 16000, 30000)
+
+# Accuracy a recommended size may give up against the best size measured, as a fraction
+DEFAULT_TOLERANCE = 0.01
+
+# Tuning files already read, by path, with the (mtime_ns, size) they were read at
+_tuning_cache = {}
+_tuning_cache_lock = threading.Lock()
+
+
+def default_tuning_path(directory_path):
+    return os.path.join(directory_path, TUNING_FILENAME)
+
+
+def learning_curve(data, sizes=DEFAULT_TRAINING_SIZES, test_fraction=0.25):
+    """
+    Trains a model on growing prefixes of the rows, in recorded order, and scores each on the same
+    held-out tail. The analysis trains on the first rows of a user's data the same way, so each size
+    measures the model a data limit of that size would produce.
+
+    Returns:
+        list: One {"rows", "accuracy", "fit_seconds", "predict_seconds"} dict per size, smallest first.
+    """
+    data = PhysiologicalData.from_samples(data)
+    test_rows = int(len(data) * test_fraction)
+    train_rows = len(data) - test_rows
+    if not test_rows or not train_rows:
+        return []
+    test = slice(train_rows, None)
+
+    curve = []
+    for rows in sorted({size for size in sizes if size < train_rows} | {train_rows}):
+        model = UserEmotionModel(None, {})
+        started = time.perf_counter()
+        model.train_model(data.features[:rows], data.labels[:rows])
+        fit_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        predicted = model.emotion_model.predict(data.features[test])
+        predict_seconds = time.perf_counter() - started
+        curve.append({"rows": int(rows), "accuracy": float(np.mean(predicted == data.labels[test])),
+                      "fit_seconds": round(fit_seconds, 4), "predict_seconds": round(predict_seconds, 4)})
+    return curve
+
+
+def recommend_rows(curve, tolerance=DEFAULT_TOLERANCE):
+    """
+    The smallest measured training-set size whose accuracy is within `tolerance` of the best, or
+    None for an empty curve.
+    """
+    if not curve:
+        return None
+    peak = max(point["accuracy"] for point in curve)
+    return min(point["rows"] for point in curve if point["accuracy"] >= peak - tolerance)
+
+
+def tune_directory(directory_path, sizes=DEFAULT_TRAINING_SIZES, tolerance=DEFAULT_TOLERANCE, update_progress=None):
+    """
+    Measures the learning curve of every user in a directory and recommends a training-set size
+    for each, and one for the cohort: the largest of the users' sizes, so a user without a
+    recommendation of their own is still trained on enough rows.
+
+    Returns:
+        dict: The tuning, as written by `write_tuning`.
+    """
+    update_progress = update_progress or (lambda stage, details=None: None)
+    users = {}
+    for user in UserDataLoader(directory_path, update_progress=update_progress).load_users():
+        curve = learning_curve(user.physiological_data, sizes)
+        rows = recommend_rows(curve, tolerance)
+        if rows is None:
+            continue
+        users[str(user.profile.get('unique-id'))] = {"rows": rows, "curve": curve}
+        update_progress("Learning Curve Measured", {"file": "data_limit_tuning.py", "function": "tune_directory",
+                                                    "user_id": user.profile.get('unique-id'),
+                                                    "recommended_rows": f"{rows}"})
+    return {
+        'version': TUNING_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'tolerance': tolerance,
+        'users': users,
+        'cohort': {"rows": max((entry["rows"] for entry in users.values()), default=None)},
+    }
+
+
+def write_tuning(tuning, tuning_path):
+    """
+    Writes the tuning atomically, so readers never see a partially written file.
+    """
+    temp_path = f"{tuning_path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(tuning, file, indent=1)
+    os.replace(temp_path, tuning_path)
+
+
+def read_tuning(tuning_path):
+    """
+    Reads a tuning written by `write_tuning`.
+
+    Raises:
+        ValueError: If the tuning was written by an incompatible version.
+    """
+    with open(tuning_path, 'r') as file:
+        tuning = json.load(file)
+    if tuning.get('version') != TUNING_VERSION:
+        raise ValueError(f"Unsupported tuning version {tuning.get('version')} in '{tuning_path}'.")
+    return tuning
+
+
+def directory_tuning(directory_path):
+    """
+    The tuning stored in a user directory, or None if it has none. The file is read again only
+    when it changes.
+    """
+    tuning_path = default_tuning_path(directory_path)
+    try:
+        stat = os.stat(tuning_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _tuning_cache_lock:
+        cached = _tuning_cache.get(tuning_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    tuning = read_tuning(tuning_path)
+    with _tuning_cache_lock:
+        _tuning_cache[tuning_path] = (signature, tuning)
+    return tuning
+
+
+def tuned_rows(tuning, user):
+    """
+    The recommended training-set size for a user: their own, else the cohort's, else None.
+    """
+    entry = tuning['users'].get(str(user.profile.get('unique-id')))
+    return entry["rows"] if entry is not None else tuning['cohort'].get("rows")
+
+
+def apply_tuned_rows(suitable_user_info, tuning):
+    """
+    Caps the data count of every selected user at their recommended training-set size.
+    """
+    capped = []
+    for user, score, data_count in suitable_user_info:
+        rows = tuned_rows(tuning, user)
+        capped.append((user, score, data_count if rows is None else min(data_count, rows)))
+    return capped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure learning curves and store the recommended training-set "
+                                                 "size of every user in a directory.")
+    parser.add_argument("directory", nargs="?", default="sample-users", help="Directory containing user workbooks.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_TRAINING_SIZES),
+                        help="Comma-separated training-set sizes to measure.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Accuracy the recommended size may give up against the best size.")
+    parser.add_argument("--output", default=None, help=f"Tuning path (default: <directory>/{TUNING_FILENAME}).")
+    args = parser.parse_args()
+
+    tuning = tune_directory(args.directory, [int(size) for size in args.sizes.split(',')], args.tolerance)
+    for user_id, entry in tuning['users'].items():
+        print(json.dumps({"User ID": user_id, "Recommended Rows": entry["rows"], "Curve": entry["curve"]}))
+    output_path = args.output or default_tuning_path(args.directory)
+    write_tuning(tuning, output_path)
+    print(f"Wrote recommendations for {len(tuning['users'])} users to {output_path} "
+          f"(cohort: {tuning['cohort']['rows']} rows)")
@@ -0,0 +1,182 @@
+import os
+import threading
+
+from metrics import REGISTRY
+from profile_manifest import (MANIFEST_VERSION, build_manifest_entry, decode_profile, default_manifest_path,
+                              encode_profile, file_fingerprint, read_manifest, write_manifest)
+from user import User
+from user_data_loader import UserDataLoader, evict_workbook_cache
+
+RESIDENT_USERS = REGISTRY.gauge('edith_resident_users', 'Users in the resident set kept by DirectorySync.')
+SYNC_CHANGES = REGISTRY.counter('edith_sync_changes_total', 'Workbook changes applied by DirectorySync.', ('change',))
+
+
+class DirectorySync:
+    """
+    Keeps a resident set of user profiles in step with a user directory.
+
+    Each scan stats every workbook and only re-parses files whose size or modification time changed
+    and whose SHA-256 hash differs from the one last seen. Added and modified files are parsed,
+    deleted ones dropped, and the delta is applied by swapping in a new state under a lock, so
+    readers always see either the old or the new user set. Stale loader cache entries are evicted
+    and registered listeners are told about the delta so they can update their own indexes.
+
+    Changes are detected by polling, either by calling `scan()` or with the background thread
+    started by `start()`.
+    """
+    def __init__(self, directory_path, update_progress=None, manifest_path=None, maintain_manifest=False,
+                 poll_interval=5.0):
+        self.directory_path = directory_path
+        self.update_progress = update_progress or (lambda stage, details=None: None)
+        self.manifest_path = manifest_path or default_manifest_path(directory_path)
+        self.maintain_manifest = maintain_manifest
+        self.poll_interval = poll_interval
+        self.data_loader = UserDataLoader(directory_path, update_progress=self.update_progress,
+                                          manifest_path=self.manifest_path)
+        self.version = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._listeners = []
+        self._stop_event = threading.Event()
+        self._thread = None
+        if os.path.isfile(self.manifest_path):
+            self._seed_from_manifest()
+
+    def _seed_from_manifest(self):
+        # Start from the manifest so unchanged files are not parsed again on the first scan
+        manifest = read_manifest(self.manifest_path)
+        self._entries = {entry['file']: entry for entry in manifest['users']}
+        RESIDENT_USERS.set(len(self._entries))
+
+    def add_listener(self, listener):
+        """
+        Registers `listener(added, modified, removed)`, called with file names after each applied delta.
+        """
+        self._listeners.append(listener)
+
+    def users(self):
+        """
+        Returns User stubs for the current resident set. Each call returns fresh User objects,
+        so models trained for one request are not shared with another; the parsed data is shared
+        through the loader cache.
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        users = []
+        for entry in sorted(entries, key=lambda item: item['file']):
+            file_path = os.path.join(self.directory_path, entry['file'])
+            users.append(User(decode_profile(entry['profile']),
+                              data_source=lambda nrows=None, path=file_path: self.data_loader.load_physiological_data(path, nrows),
+                              data_count=entry.get('row_count')))
+        return users
+
+    def scan(self):
+        """
+        Detects added, modified and removed workbooks and applies the delta.
+
+        Returns:
+            tuple: Lists of the added, modified and removed file names.
+        """
+        if not os.path.exists(self.directory_path):
+            raise FileNotFoundError(f"Directory '{self.directory_path}' does not exist.")
+
+        with self._scan_lock:
+            with self._lock:
+                current = dict(self._entries)
+            filenames = {filename for filename in os.listdir(self.directory_path) if filename.endswith('.xlsx')}
+
+            added, modified, touched = [], [], {}
+            updated = {}
+            for filename in sorted(filenames):
+                file_path = os.path.join(self.directory_path, filename)
+                previous = current.get(filename)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue  # Deleted between listing and stat
+                if previous is not None and (stat.st_size, stat.st_mtime_ns) == (
+                        previous['fingerprint']['size'], previous['fingerprint']['mtime_ns']):
+                    continue
+
+                fingerprint = file_fingerprint(file_path)
+                if previous is not None and fingerprint['sha256'] == previous['fingerprint']['sha256']:
+                    touched[filename] = dict(previous, fingerprint=fingerprint)  # Same content, new mtime
+                    continue
+
+                evict_workbook_cache(file_path)
+                entry = self._parse_entry(file_path, fingerprint)
+                if entry is None:
+                    self.update_progress(f"Skipping file due to missing data: {filename}")
+                    if previous is not None:
+                        filenames.discard(filename)  # Treat an unreadable update as a removal
+                    continue
+                updated[filename] = entry
+                (modified if previous is not None else added).append(filename)
+
+            removed = sorted(set(current) - filenames)
+            for filename in removed:
+                evict_workbook_cache(os.path.join(self.directory_path, filename))
+
+            if not (added or modified or removed or touched):
+                return [], [], []
+
+            new_entries = {filename: entry for filename, entry in current.items() if filename not in removed}
+            new_entries.update(touched)
+            new_entries.update(updated)
+            with self._lock:
+                self._entries = new_entries
+                self.version += 1
+
+            RESIDENT_USERS.set(len(new_entries))
+            for change, files in (('added', added), ('modified', modified), ('removed', removed)):
+                if files:
+                    SYNC_CHANGES.inc(len(files), change=change)
+            if self.maintain_manifest:
+                write_manifest({'version': MANIFEST_VERSION,
+                                'users': [new_entries[name] for name in sorted(new_entries)]}, self.manifest_path)
+
+        if added or modified or removed:
+            self.update_progress("User Directory Synchronized",
+                                 {"file": "directory_sync.py", "function": "scan", "added": f"{len(added)}",
+                                  "modified": f"{len(modified)}", "removed": f"{len(removed)}"})
+            for listener in list(self._listeners):
+                listener(added, modified, removed)
+        return added, modified, removed
+
+    def _parse_entry(self, file_path, fingerprint):
+        if self.maintain_manifest:
+            # A full manifest entry needs the data sheet for the row count and label histogram
+            entry = build_manifest_entry(file_path, self.data_loader)
+            if entry is not None:
+                entry['fingerprint'] = fingerprint
+            return entry
+        user_profile = self.data_loader.load_user_profile(file_path)
+        if user_profile is None:
+            return None
+        return {'file': os.path.basename(file_path), 'fingerprint': fingerprint,
+                'profile': encode_profile(user_profile), 'row_count': None, 'label_histogram': None}
+
+    def start(self):
+        """
+        Starts polling the directory in a background daemon thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll, name=f"directory-sync:{self.directory_path}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _poll(self):
+        while not self._stop_event.is_set():
+            try:
+                self.scan()
+            except Exception as e:
+                self.update_progress("Directory sync failed", {"file": "directory_sync.py", "error": str(e)})
+            self._stop_event.wait(self.poll_interval)
@@ -3,11 +3,12 @@ from scipy.spatial import distance
 from collections import Counter
 from user import User
 
+from model_registry import MODEL_REGISTRY
 from user_emotion_model import UserEmotionModel
 from utilities import format_data, format_label
 
-# Global dictionary for user models
-user_models = {}
+# Global registry of user models, kept within a memory budget
+user_models = MODEL_REGISTRY
 
 class Emotion:
     import numpy as np
@@ -16,14 +17,16 @@ class Emotion:
     from utilities import format_data, format_label
     from user_emotion_model import UserEmotionModel
 
-    # Global dictionary for user models
-    user_models = {}
+    # The same global registry of user models
+    user_models = MODEL_REGISTRY
 
     def get_user_model(user_id):
         # Retrieve or create a model for a specific user
-        if user_id not in user_models:
-            user_models[user_id] = UserEmotionModel(user_id)
-        return user_models[user_id]
+        user_model = user_models.get(user_id)
+        if user_model is None:
+            user_model = UserEmotionModel(user_id, {})
+            user_models[user_id] = user_model
+        return user_model
 
     class Emotion:
         # Class representing different emotions with their physiological values
@@ -44,39 +47,39 @@ class Emotion:
         def SAD(cls):
             # According to the American Heart Association, sadness (especially when associated with depression)
             # can increase heart rate and cortisol levels, which might affect heart rate variability and other factors.
-            return Emotion("Sad", heart_rate=70, breathing_rate=14, hrv=45, skin_temp=31, emg=0.3, bvp=0.7,
+            return cls("Sad", heart_rate=70, breathing_rate=14, hrv=45, skin_temp=31, emg=0.3, bvp=0.7,
                            movement_data={}, sleep_duration=9, social_activity={}, voice_features={})
 
         @classmethod
         def ANXIOUS(cls):
             # Mayo Clinic notes that anxiety causes an increased heart rate and rapid breathing.
             # This aligns with a heightened fight-or-flight response.
-            return Emotion("Anxious", heart_rate=85, breathing_rate=18, hrv=40, skin_temp=31, emg=0.4, bvp=0.9)
+            return cls("Anxious", heart_rate=85, breathing_rate=18, hrv=40, skin_temp=31, emg=0.4, bvp=0.9)
 
         @classmethod
         def CONFUSED(cls):
             # Confusion is marked by an inability to think clearly, leading to disorientation and difficulty in decision-making. It is often associated with a fast pulse rate.
-            return Emotion("Confused", heart_rate=75, breathing_rate=17, hrv=50, skin_temp=31, emg=0.3, bvp=0.8)
+            return cls("Confused", heart_rate=75, breathing_rate=17, hrv=50, skin_temp=31, emg=0.3, bvp=0.8)
 
         @classmethod
         def SURPRISED(cls):
             # Surprises can cause the body to produce excessive stress hormones like adrenaline, leading to narrowed arteries and heart rhythm changes akin to a heart attack.
-            return Emotion("Surprised", heart_rate=80, breathing_rate=19, hrv=55, skin_temp=31, emg=0.3, bvp=0.85)
+            return cls("Surprised", heart_rate=80, breathing_rate=19, hrv=55, skin_temp=31, emg=0.3, bvp=0.85)
 
         @classmethod
         def RELAXED(cls):
             # Deep breathing and relaxation techniques have been shown to effectively improve mood and reduce stress. This is often reflected in lower heart rate and cortisol levels.
-            return Emotion("Relaxed", heart_rate=55, breathing_rate=12, hrv=70, skin_temp=30, emg=0.1, bvp=0.6)
+            return cls("Relaxed", heart_rate=55, breathing_rate=12, hrv=70, skin_temp=30, emg=0.1, bvp=0.6)
 
         @classmethod
         def CALM(cls):
             # Similar to being relaxed, a calm state is likely to be associated with lower heart rate and cortisol levels, reflecting a reduction in stress and an improved mood.
-            return Emotion("Calm", heart_rate=60, breathing_rate=14, hrv=65, skin_temp=30, emg=0.2, bvp=0.7)
+            return cls("Calm", heart_rate=60, breathing_rate=14, hrv=65, skin_temp=30, emg=0.2, bvp=0.7)
 
         @classmethod
         def CONTENT(cls):
             # While specific research on contentment's physiological effects is limited, it can be assumed to be similar to other positive emotions like happiness. This would typically feature lower heart rate and cortisol levels.
-            return Emotion("Content", heart_rate=65, breathing_rate=15, hrv=60, skin_temp=30, emg=0.2, bvp=0.7)
+            return cls("Content", heart_rate=65, breathing_rate=15, hrv=60, skin_temp=30, emg=0.2, bvp=0.7)
 
         @classmethod
         def STRESSED(cls):
@@ -168,9 +171,9 @@ class Emotion:
             else:
                 formatted_data = physiological_data  # Already formatted
 
-            if user_id in user_models and user_models[user_id].is_trained:
-                predicted_label = user_models[user_id].predict_emotion(formatted_data)
-                return Emotion.map_label_to_emotion(predicted_label)
+            user_model = user_models.get(user_id)
+            if user_model is not None and user_model.is_trained:
+                return user_model.predict_emotion(formatted_data)
             else:
                 return Emotion._find_closest_emotion_generic(formatted_data)
 
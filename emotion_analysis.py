@@ -1,5 +1,7 @@
 from user_emotion_model import UserEmotionModel
 from emotion import user_models
+from feature_engine import extract_from_features, extract_from_samples
+from physiological_data import PhysiologicalData
 from utilities import format_data, format_label
 
 class EmotionAnalysis:
@@ -9,48 +11,69 @@ class EmotionAnalysis:
         if user_id not in user_models:
             raise Exception(f"User model for {user_id} not found. Available IDs: {list(user_models.keys())}")
         user_models[user_id].train_model(X_train, y_train)
+        # The trained forest is much larger than the empty model; re-measure it against the budget
+        user_models.refresh(user_id)
 
     @staticmethod
-    def train_user_model(user, limited_data=None, update_progress=None):
+    def train_user_model(user, limited_data=None, update_progress=None, feature_schema=None, time_budget=None,
+                         sample_weight=None, model=None):
+        # `model` trains a model the caller owns instead of the user's current one, which other
+        # requests sharing the User may replace or train meanwhile
         update_progress("Training Custom User Model", {"file": "main.py", "function": "train_user_model"})
         if limited_data is None:
             limited_data = user.physiological_data
+        model = model if model is not None else user.emotion_model
 
-        x_train = [format_data(sample) for sample in limited_data]
-        y_train = [sample.get('predicted-emotion', 'Undefined') for sample in limited_data]
+        # Compact data hands its float32 features and uint8 label codes over without copying
+        limited_data = PhysiologicalData.from_samples(limited_data)
+        x_train = limited_data.features
+        y_train = limited_data.labels
+        if feature_schema is not None:
+            # Windowed features are computed over the user's samples in their recorded order
+            x_train = extract_from_features(x_train, feature_schema)
+            model.feature_schema = feature_schema
 
         update_progress("Training Emotion Model", {"x_train": f'{len(x_train)}', "y_train": f'{len(y_train)}'})
-        user.train_emotion_model(x_train, y_train)
+        if time_budget is not None:
+            # Grow the forest only while the budget lasts and the out-of-bag accuracy keeps improving
+            model.train_model_anytime(x_train, y_train, time_budget=time_budget, update_progress=update_progress,
+                                      sample_weight=sample_weight)
+        else:
+            model.train_model(x_train, y_train, sample_weight=sample_weight)
+        update_progress("Emotion Model Trained", {"file": "emotion_analysis.py", "function": "train_user_model",
+                                                  "trees": f"{model.trees_built}",
+                                                  "stop_reason": f"{model.stop_reason}"})
 
     @staticmethod
-    def make_predictions_for_user(user, physiological_data_samples):
-        predictions = []
-        for sample in physiological_data_samples:
-            formatted_sample = format_data(sample)
-            predicted_emotion = user.predict_emotion(formatted_sample)
-            predictions.append(predicted_emotion)
-
-        return predictions
+    def make_predictions_for_user(user, physiological_data_samples, model=None):
+        # `model` predicts with a model the caller holds, e.g. from the training coordinator, rather
+        # than whatever model another request has since put on the shared User
+        model = model if model is not None else user.emotion_model
+        feature_schema = model.feature_schema
+        if feature_schema is not None:
+            formatted_samples = extract_from_samples(physiological_data_samples, feature_schema)
+        else:
+            formatted_samples = [format_data(sample) for sample in physiological_data_samples]
+        # One model call for all samples, logged as one batch
+        return model.predict_emotions(formatted_samples)
 
     @staticmethod
     def make_predictions(user_id, physiological_data_samples):
         # Make predictions for a specific user
-        if user_id not in user_models or not user_models[user_id].is_trained:
+        user_model = user_models.get(user_id)
+        if user_model is None or not user_model.is_trained:
             raise Exception(f"User model for {user_id} not initialized or not trained.")
-        predictions = []
-        for sample in physiological_data_samples:
-            formatted_sample = format_data(sample)
-            predicted_emotion = user_models[user_id].predict_emotion(formatted_sample)
-            predictions.append(predicted_emotion)
-        return predictions
+        return user_model.predict_emotions([format_data(sample) for sample in physiological_data_samples])
 
     @staticmethod
     def process_feedback(user_id, feedback_list):
         # Process feedback for a specific user
-        if user_id not in user_models:
+        user_model = user_models.get(user_id)
+        if user_model is None:
             raise Exception(f"User model for {user_id} not initialized.")
         for feedback_item in feedback_list:
             sample, actual_emotion, *multiplier = feedback_item
             multiplier = multiplier[0] if multiplier else 1
             formatted_sample = format_data(sample)
-            user_models[user_id].provide_feedback(formatted_sample, actual_emotion, multiplier)
\ No newline at end of file
+            user_model.process_feedback(formatted_sample, actual_emotion, weight=multiplier)
+        user_models.refresh(user_id)
\ No newline at end of file
@@ -0,0 +1,136 @@
+import threading
+import weakref
+
+import numpy as np
+
+from physiological_data import PhysiologicalData
+from utilities import FEATURE_COLUMNS, LABEL_TO_EMOTION
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Statistics of each PhysiologicalData object, per percentile set. The loader hands out the same
+# object until the workbook changes, so the object itself is the data version; entries go with it.
+_statistics_cache = weakref.WeakKeyDictionary()
+_statistics_cache_lock = threading.Lock()
+
+
+def signal_names(n_columns):
+    if n_columns == len(FEATURE_COLUMNS):
+        return list(FEATURE_COLUMNS)
+    return [f"feature-{i}" for i in range(n_columns)]
+
+
+def _weighted_percentiles(values, weights, percentiles):
+    # Interpolates each column's weighted empirical CDF, placing each sample at the middle of its weight
+    quantiles = np.empty((len(percentiles), values.shape[1]))
+    for j in range(values.shape[1]):
+        order = np.argsort(values[:, j], kind='stable')
+        cumulative = np.cumsum(weights[order])
+        positions = (cumulative - weights[order] / 2) / cumulative[-1]
+        quantiles[:, j] = np.interp(np.asarray(percentiles) / 100, positions, values[order, j])
+    return quantiles
+
+
+def compute_emotion_statistics(features, labels, percentiles=DEFAULT_PERCENTILES, signals=None, weights=None):
+    """
+    Computes per-emotion sample counts and the mean, variance and percentiles of every signal.
+
+    Counts, sums and sums of squares come from one `bincount` per signal; percentiles from a single
+    stable sort by label followed by one percentile call per emotion over its contiguous block, so
+    the cost is O(n log n) however many emotions there are.
+
+    Args:
+        features (numpy.ndarray): Samples of shape (n, signals).
+        labels (numpy.ndarray): Integer label codes of length n.
+        percentiles (tuple): Percentiles (0-100) to report for every signal.
+        signals (list, optional): Signal names; defaults to FEATURE_COLUMNS for six columns.
+        weights (numpy.ndarray, optional): How many samples each row stands for, e.g. in a coreset.
+
+    Returns:
+        dict: JSON-serializable statistics, with emotions keyed by name.
+    """
+    features = np.asarray(features)
+    labels = np.asarray(labels).astype(np.intp, copy=False)
+    n_samples, n_columns = features.shape if features.ndim == 2 else (0, len(signals or FEATURE_COLUMNS))
+    signals = signals or signal_names(n_columns)
+    row_weights = np.ones(n_samples) if weights is None else np.asarray(weights, dtype=np.float64)
+    total = float(row_weights.sum()) if n_samples else 0.0
+    statistics = {"samples": int(round(total)), "signals": signals, "percentiles": list(percentiles), "emotions": {}}
+    if n_samples == 0:
+        return statistics
+
+    minlength = max(len(LABEL_TO_EMOTION), int(labels.max()) + 1)
+    rows = np.bincount(labels, minlength=minlength)
+    counts = rows if weights is None else np.bincount(labels, weights=row_weights, minlength=minlength)
+    values = features.astype(np.float64, copy=False)
+    weighted = values * row_weights[:, None] if weights is not None else values
+    sums = np.column_stack([np.bincount(labels, weights=weighted[:, j], minlength=minlength) for j in range(n_columns)])
+    squares = np.column_stack([np.bincount(labels, weights=weighted[:, j] * values[:, j], minlength=minlength)
+                               for j in range(n_columns)])
+
+    order = np.argsort(labels, kind='stable')
+    sorted_values = values[order]
+    sorted_weights = row_weights[order]
+    bounds = np.concatenate(([0], np.cumsum(rows)))
+
+    for label in np.flatnonzero(rows):
+        count = counts[label]
+        means = sums[label] / count
+        variances = np.maximum(squares[label] / count - means * means, 0.0)
+        block = sorted_values[bounds[label]:bounds[label + 1]]
+        if not percentiles:
+            quantiles = []
+        elif weights is None:
+            quantiles = np.percentile(block, percentiles, axis=0)
+        else:
+            quantiles = _weighted_percentiles(block, sorted_weights[bounds[label]:bounds[label + 1]], percentiles)
+        statistics["emotions"][LABEL_TO_EMOTION.get(int(label), 'Undefined')] = {
+            "count": int(round(count)),
+            "share": float(count / total),
+            "mean": dict(zip(signals, means.tolist())),
+            "variance": dict(zip(signals, variances.tolist())),
+            "percentiles": {f"{p:g}": dict(zip(signals, row.tolist())) for p, row in zip(percentiles, quantiles)},
+        }
+    return statistics
+
+
+def data_statistics(data, percentiles=DEFAULT_PERCENTILES):
+    """
+    Statistics of a user's physiological data, cached for as long as the same data object is alive.
+    """
+    data = PhysiologicalData.from_samples(data if data is not None else [])
+    percentiles = tuple(percentiles)
+    with _statistics_cache_lock:
+        cached = _statistics_cache.get(data, {}).get(percentiles)
+    if cached is not None:
+        return cached
+
+    statistics = compute_emotion_statistics(data.features, data.labels, percentiles)
+    with _statistics_cache_lock:
+        _statistics_cache.setdefault(data, {})[percentiles] = statistics
+    return statistics
+
+
+def user_statistics(user, percentiles=DEFAULT_PERCENTILES):
+    """
+    Statistics of a user's physiological data, with the user's ID.
+    """
+    statistics = dict(data_statistics(user.physiological_data, percentiles))
+    statistics["user_id"] = user.profile.get('unique-id')
+    return statistics
+
+
+def print_emotion_statistics(statistics):
+    """
+    Prints the emotion shares and per-signal averages of a `compute_emotion_statistics` result.
+    """
+    if not statistics["samples"]:
+        print("No data available for statistics.")
+        return
+    print("\nEmotion Statistics:")
+    for emotion, per_emotion in statistics["emotions"].items():
+        print(f"{emotion}: {per_emotion['share'] * 100:.2f}%")
+
+    print("\nAverage Values for Each Emotion:")
+    for emotion, per_emotion in statistics["emotions"].items():
+        print(f"Emotion {emotion}: {list(per_emotion['mean'].values())}")
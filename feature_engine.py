@@ -0,0 +1,222 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from utilities import FEATURE_COLUMNS
+
+# A feature computed from one signal: its raw value, or a statistic over the last `window` samples.
+# `signal` is a sample key, e.g. 'hrv-ms'; any key can be used, not only the FEATURE_COLUMNS.
+FeatureSpec = namedtuple('FeatureSpec', ['name', 'signal', 'kind', 'window'])
+
+FEATURE_KINDS = ('raw', 'mean', 'std', 'slope', 'energy')
+
+
+def raw_schema():
+    """
+    The six raw signals, equivalent to utilities.format_data.
+    """
+    return [FeatureSpec(column, column, 'raw', 1) for column in FEATURE_COLUMNS]
+
+
+def rolling_schema(window=10):
+    """
+    The raw signals plus rolling HRV statistics, heart-rate slope and EMG energy.
+    """
+    return raw_schema() + [
+        FeatureSpec(f'hrv-mean-{window}', 'hrv-ms', 'mean', window),
+        FeatureSpec(f'hrv-std-{window}', 'hrv-ms', 'std', window),
+        FeatureSpec(f'heart-rate-slope-{window}', 'heart-rate-bpm', 'slope', window),
+        FeatureSpec(f'emg-energy-{window}', 'emg-mv', 'energy', window),
+    ]
+
+
+def validate_schema(schema):
+    names = set()
+    for spec in schema:
+        if spec.kind not in FEATURE_KINDS:
+            raise ValueError(f"Unknown feature kind '{spec.kind}' for '{spec.name}'.")
+        if spec.window < 1:
+            raise ValueError(f"Feature '{spec.name}' needs a window of at least 1.")
+        if spec.name in names:
+            raise ValueError(f"Duplicate feature name '{spec.name}'.")
+        names.add(spec.name)
+    return schema
+
+
+def schema_signals(schema):
+    """
+    Returns the distinct signals a schema reads, in first-use order.
+    """
+    return list(dict.fromkeys(spec.signal for spec in schema))
+
+
+class RollingWindow:
+    """
+    A fixed-size ring buffer that keeps running sums so the mean, standard deviation, least-squares
+    slope and energy (mean square) of the last `size` values are O(1) to update and read.
+    """
+    __slots__ = ('size', 'values', 'count', 'start', 'total', 'total_squares', 'weighted_total')
+
+    def __init__(self, size):
+        self.size = size
+        self.values = np.zeros(size, dtype=np.float64)
+        self.count = 0
+        self.start = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.weighted_total = 0.0  # Sum of j * value_j, with j the position inside the window
+
+    def push(self, value):
+        if self.count == self.size:
+            oldest = self.values[self.start]
+            self.total -= oldest
+            self.total_squares -= oldest * oldest
+            # Dropping the oldest value shifts every remaining position down by one
+            self.weighted_total -= self.total
+            self.values[self.start] = value
+            self.start = (self.start + 1) % self.size
+            position = self.size - 1
+        else:
+            self.values[(self.start + self.count) % self.size] = value
+            position = self.count
+            self.count += 1
+        self.total += value
+        self.total_squares += value * value
+        self.weighted_total += position * value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def std(self):
+        if not self.count:
+            return 0.0
+        mean = self.total / self.count
+        return math.sqrt(max(0.0, self.total_squares / self.count - mean * mean))
+
+    def energy(self):
+        return self.total_squares / self.count if self.count else 0.0
+
+    def slope(self):
+        return _slope(self.count, self.total, self.weighted_total)
+
+
+def _slope(n, total, weighted_total):
+    # Least-squares slope per sample of values at positions 0..n-1
+    sum_positions = n * (n - 1) / 2
+    sum_squared_positions = (n - 1) * n * (2 * n - 1) / 6
+    denominator = n * sum_squared_positions - sum_positions * sum_positions
+    if denominator == 0:
+        return 0.0
+    return (n * weighted_total - sum_positions * total) / denominator
+
+
+class FeatureStream:
+    """
+    Computes a schema's features for one sample at a time, updating every window in O(1).
+    Keep one stream per user or device, since windows carry state across samples.
+    """
+    def __init__(self, schema=None):
+        self.schema = validate_schema(schema or rolling_schema())
+        self._windows = {(spec.signal, spec.window): RollingWindow(spec.window)
+                         for spec in self.schema if spec.kind != 'raw'}
+
+    def update(self, sample):
+        """
+        Pushes one sample dict and returns its feature vector.
+
+        Args:
+            sample (dict): A physiological sample; missing signals read as 0, as in format_data.
+
+        Returns:
+            list: The features, in schema order.
+        """
+        for (signal, _), window in self._windows.items():
+            window.push(float(sample.get(signal, 0) or 0))
+        features = []
+        for spec in self.schema:
+            if spec.kind == 'raw':
+                features.append(float(sample.get(spec.signal, 0) or 0))
+            else:
+                features.append(getattr(self._windows[(spec.signal, spec.window)], spec.kind)())
+        return features
+
+
+def _rolling_sums(values, window):
+    # Sums over the last `window` values ending at each index, with shorter windows during warm-up
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    return cumulative[ends] - cumulative[starts], starts
+
+
+def extract_batch(signals, schema=None):
+    """
+    Computes a schema's features for a whole, time-ordered sequence of samples at once with
+    cumulative sums, giving the same values as feeding the samples through a FeatureStream.
+
+    Args:
+        signals (dict): Maps each signal in the schema to a 1-D array of its values.
+
+    Returns:
+        numpy.ndarray: A float32 array of shape (n_samples, len(schema)).
+    """
+    schema = validate_schema(schema or rolling_schema())
+    lengths = {len(values) for values in signals.values()}
+    if len(lengths) > 1:
+        raise ValueError("All signals must have the same number of samples.")
+    n_samples = lengths.pop() if lengths else 0
+    output = np.empty((n_samples, len(schema)), dtype=np.float32)
+
+    cache = {}
+    for column, spec in enumerate(schema):
+        values = np.nan_to_num(np.asarray(signals.get(spec.signal, np.zeros(n_samples)), dtype=np.float64))
+        if spec.kind == 'raw':
+            output[:, column] = values
+            continue
+
+        key = (spec.signal, spec.window)
+        if key not in cache:
+            totals, starts = _rolling_sums(values, spec.window)
+            squares, _ = _rolling_sums(values * values, spec.window)
+            counts = np.arange(1, n_samples + 1) - starts
+            # Position-weighted sums, re-based so the oldest value in each window has position 0
+            absolute, _ = _rolling_sums(np.arange(n_samples) * values, spec.window)
+            weighted = absolute - starts * totals
+            cache[key] = (totals, squares, weighted, counts)
+        totals, squares, weighted, counts = cache[key]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if spec.kind == 'mean':
+                result = totals / counts
+            elif spec.kind == 'energy':
+                result = squares / counts
+            elif spec.kind == 'std':
+                result = np.sqrt(np.maximum(squares / counts - (totals / counts) ** 2, 0.0))
+            else:
+                n = counts.astype(np.float64)
+                sum_positions = n * (n - 1) / 2
+                denominator = n * (n - 1) * n * (2 * n - 1) / 6 - sum_positions ** 2
+                result = np.where(denominator > 0, (n * weighted - sum_positions * totals) / denominator, 0.0)
+        output[:, column] = np.nan_to_num(result)
+    return output
+
+
+def extract_from_features(features, schema=None):
+    """
+    Runs `extract_batch` on a (n, 6) array laid out like format_data output, e.g.
+    PhysiologicalData.features.
+    """
+    features = np.asarray(features)
+    signals = {column: features[:, i] for i, column in enumerate(FEATURE_COLUMNS)}
+    return extract_batch(signals, schema)
+
+
+def extract_from_samples(samples, schema=None):
+    """
+    Runs `extract_batch` on a time-ordered list of sample dicts.
+    """
+    schema = schema or rolling_schema()
+    signals = {signal: np.array([float(sample.get(signal, 0) or 0) for sample in samples], dtype=np.float64)
+               for signal in schema_signals(schema)}
+    return extract_batch(signals, schema)
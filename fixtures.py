@@ -0,0 +1,26 @@
+import datetime
+import pandas as pd
+
+# Shared by the test modules that need user workbooks or analysis samples on disk
+
+SAMPLES = [{"heart-rate-bpm": 70, "breathing-rate-breaths-min": 15, "hrv-ms": 60, "skin-temp-c": 31,
+            "emg-mv": 0.2, "bvp-unit": 0.8}]
+
+
+def write_user_workbook(path, unique_id, emotions, gender='Male', nationality='Canadian', age=34):
+    profile_df = pd.DataFrame({
+        'User Profile Aspect': ['Unique ID', 'First Name', 'Date Of Birth', 'Age', 'Gender', 'Nationality'],
+        'Details': [unique_id, 'Alex', datetime.datetime(1990, 4, 15), age, gender, nationality]
+    })
+    data_df = pd.DataFrame({
+        'heart-rate-bpm': [70.0 + i for i in range(len(emotions))],
+        'breathing-rate-breaths-min': [15.0] * len(emotions),
+        'hrv-ms': [60.0] * len(emotions),
+        'skin-temp-c': [31.0] * len(emotions),
+        'emg-mv': [0.2] * len(emotions),
+        'bvp-unit': [0.8] * len(emotions),
+        'predicted-emotion': emotions,
+    })
+    with pd.ExcelWriter(path) as writer:
+        profile_df.to_excel(writer, sheet_name='user-profile', index=False)
+        data_df.to_excel(writer, sheet_name='data', index=False)
@@ -0,0 +1,177 @@
+import threading
+import time
+
+from metrics import REGISTRY
+
+# Degradation strategies, cheapest last. 'full' trains every matched user on all of their selected rows.
+STRATEGIES = ('full', 'fewer_users', 'capped_data', 'prototype')
+
+# Smallest per-user training set worth fitting a forest on; below it the generic prototypes are used
+MIN_TRAINING_ROWS = 200
+
+# Share of the remaining budget kept back for prediction and compiling results
+RESERVE_FRACTION = 0.2
+
+DEGRADED_JOBS = REGISTRY.counter('edith_degraded_jobs_total', 'Analysis jobs that ran with a cheaper strategy.',
+                                 ('strategy',))
+CANCELLED_JOBS = REGISTRY.counter('edith_cancelled_jobs_total', 'Analysis jobs stopped before completion.',
+                                  ('reason',))
+
+
+class JobCancelled(Exception):
+    """
+    Raised at a checkpoint once a job has been cancelled.
+    """
+    def __init__(self, reason='cancelled', stage=None):
+        super().__init__(f"Analysis {reason}" + (f" before stage '{stage}'" if stage else ""))
+        self.reason = reason
+        self.stage = stage
+
+
+class CancellationToken:
+    """
+    A flag shared between a job and whoever may abandon it, e.g. a client disconnect handler.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason='cancelled'):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class TrainingCostModel:
+    """
+    Running estimate of training seconds per row, shared by all jobs in the process.
+    """
+    def __init__(self, seconds_per_row=1e-4, smoothing=0.3):
+        self.seconds_per_row = seconds_per_row
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def observe(self, rows, seconds):
+        if rows <= 0:
+            return
+        with self._lock:
+            self.seconds_per_row += self.smoothing * (seconds / rows - self.seconds_per_row)
+
+    def estimate(self, rows):
+        return rows * self.seconds_per_row
+
+    def rows_within(self, seconds):
+        return int(seconds / self.seconds_per_row) if self.seconds_per_row > 0 else 0
+
+
+TRAINING_COST = TrainingCostModel()
+
+
+class JobControl:
+    """
+    Carries a job's deadline and cancellation token through the pipeline.
+
+    `checkpoint` is called between stages and between users; it raises JobCancelled once the token
+    is cancelled, so abandoned work stops at the next boundary. The deadline never cancels a job:
+    `plan` and `can_afford` pick cheaper strategies as the budget runs out, down to the generic
+    prototypes once it has passed. The strategy used ends up in `strategy`.
+
+    Args:
+        deadline_seconds (float, optional): Time budget measured from construction; None for no deadline.
+        token (CancellationToken, optional): Token to observe; a fresh one is created if omitted.
+    """
+    def __init__(self, deadline_seconds=None, token=None, cost_model=None):
+        self.token = token or CancellationToken()
+        self.cost_model = cost_model or TRAINING_COST
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + deadline_seconds if deadline_seconds is not None else None
+        self.strategy = 'full'
+
+    def remaining(self):
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def checkpoint(self, stage):
+        if self.token.cancelled:
+            raise JobCancelled(self.token.reason, stage)
+
+    def degrade(self, strategy):
+        # Strategies only ever get cheaper during a job
+        if STRATEGIES.index(strategy) > STRATEGIES.index(self.strategy):
+            self.strategy = strategy
+
+    def _training_budget(self):
+        return self.remaining() * (1 - RESERVE_FRACTION)
+
+    def time_budget(self, rows, users_left):
+        """
+        Seconds one user's fit may take if a full fit of `rows` would overrun its share of the
+        remaining budget, split evenly over the `users_left` still to train; otherwise None.
+        """
+        if self.expires_at is None:
+            return None
+        share = self._training_budget() / max(users_left, 1)
+        return share if self.cost_model.estimate(rows) > share else None
+
+    def can_afford(self, rows):
+        return self.cost_model.estimate(rows) <= self._training_budget()
+
+    def plan(self, suitable_user_info):
+        """
+        Trims the selected users to what the remaining budget can train.
+
+        Users are kept in score order while their estimated cost fits ('fewer_users'). If not even
+        the best user fits, its rows are capped to what does ('capped_data'), and if that leaves
+        fewer than MIN_TRAINING_ROWS, no user is trained and the generic prototypes are used
+        ('prototype', returned as an empty list).
+
+        Args:
+            suitable_user_info (list): Tuples of user, score and data count from find_most_suitable_user.
+
+        Returns:
+            list: The tuples to train, possibly fewer and with smaller data counts.
+        """
+        if self.expires_at is None:
+            return suitable_user_info
+
+        budget = self._training_budget()
+        planned = []
+        spent = 0.0
+        for user, score, data_count in suitable_user_info:
+            cost = 0.0 if user.emotion_model.is_trained else self.cost_model.estimate(data_count)
+            if spent + cost > budget:
+                break
+            planned.append((user, score, data_count))
+            spent += cost
+
+        if len(planned) == len(suitable_user_info):
+            return planned
+        if planned:
+            self.degrade('fewer_users')
+            return planned
+        if not suitable_user_info:
+            return planned
+
+        user, score, data_count = suitable_user_info[0]
+        capped_rows = min(data_count, self.cost_model.rows_within(budget))
+        if capped_rows >= MIN_TRAINING_ROWS:
+            self.degrade('capped_data')
+            return [(user, score, capped_rows)]
+        self.degrade('prototype')
+        return []
+
+    def record_training(self, rows, seconds):
+        self.cost_model.observe(rows, seconds)
+
+    def finish(self):
+        if self.strategy != 'full':
+            DEGRADED_JOBS.inc(strategy=self.strategy)
@@ -2,13 +2,34 @@ from user_data_loader import UserDataLoader
 from emotion_analysis import EmotionAnalysis
 from typing import Callable, Optional
 from user_emotion_model import UserEmotionModel
+from emotion import Emotion
+from neighbor_index import CohortPredictor
+from training_coordinator import TRAINING_COORDINATOR
+from data_limit_tuning import apply_tuned_rows, directory_tuning
+from job_control import JobControl
+from utilities import EMOTION_TO_LABEL, LABEL_TO_EMOTION, format_data
+from metrics import time_stage
+from profiling import RunProfiler, profile_stage
+from contextlib import contextmanager
+import argparse
 import os
 import sys
 import datetime
 import json
+import time
+import uuid
+
+@contextmanager
+def pipeline_stage(stage):
+    """
+    Wraps a pipeline stage so it is timed in the metrics registry and attributed to any active profiler.
+
+    Args:
+        stage (str): The name of the stage.
+    """
+    with time_stage(stage), profile_stage(stage):
+        yield
 
-# Global dictionary for user models
-user_models = {}
 
 def parse_user_input(user_input):
     """
@@ -38,6 +59,17 @@ def parse_user_input(user_input):
         user_profile[key] = value
     return user_profile
 
+# Weight of each profile attribute in the similarity score; attributes not listed weigh 0.01
+SIMILARITY_WEIGHTS = {
+    'age': 0.2, 'gender': 0.1, 'nationality': 0.05, 'languages-spoken': 0.05, # ... other weights
+}
+DEFAULT_SIMILARITY_WEIGHT = 0.01
+
+# Integer attributes (e.g. age) score linearly down to 0 at this distance; dates at this many days
+INTEGER_TOLERANCE = 5
+DAY_TOLERANCE = 365
+
+
 def calculate_similarity_score(user_profile, provided_user_details):
     """
     Calculates a similarity score between a user profile and provided user details.
@@ -49,32 +81,33 @@ def calculate_similarity_score(user_profile, provided_user_details):
     Returns:
         float: A normalized similarity score.
     """
-    # Define weights for different user attributes
-    weights = {
-        'age': 0.2, 'gender': 0.1, 'nationality': 0.05, 'languages-spoken': 0.05, # ... other weights
-    }
-
+    weights = SIMILARITY_WEIGHTS
     total_weight = sum(weights.values())
     score = 0
 
     for key, value in provided_user_details.items():
         if key in user_profile:
-            weight = weights.get(key, 0.01)
+            weight = weights.get(key, DEFAULT_SIMILARITY_WEIGHT)
             user_value = user_profile[key]
 
             if isinstance(value, int) and isinstance(user_value, int):
-                tolerance = 5
-                score += weight * max(0, 1 - abs(value - user_value) / tolerance)
+                score += weight * max(0, 1 - abs(value - user_value) / INTEGER_TOLERANCE)
             elif isinstance(value, str) and isinstance(user_value, str):
                 score += weight if value.lower() == user_value.lower() else 0
             elif isinstance(value, datetime.datetime) and isinstance(user_value, datetime.datetime):
-                day_tolerance = 365
                 diff_days = abs((value - user_value).days)
-                score += weight * max(0, 1 - diff_days / day_tolerance)
+                score += weight * max(0, 1 - diff_days / DAY_TOLERANCE)
 
     return score / total_weight if total_weight > 0 else 0
 
 
+def score_threshold(data_limit):
+    """
+    The similarity score a user must exceed to be selected; larger data limits are more selective.
+    """
+    return 0.5 + 0.25 * (data_limit / 30000)
+
+
 def find_most_suitable_user(provided_user_details, users, data_limit=30000, update_progress=None):
     """
     Finds the most suitable users based on provided details.
@@ -90,15 +123,31 @@ def find_most_suitable_user(provided_user_details, users, data_limit=30000, upda
     update_progress("Finding Suitable Users", {"file": "main.py", "function": "find_most_suitable_user"})
     user_scores = [(user, calculate_similarity_score(user.profile, provided_user_details)) for user in users]
     user_scores.sort(key=lambda x: x[1], reverse=True)
+    return select_suitable_users(user_scores, data_limit, update_progress)
+
+
+def select_suitable_users(user_scores, data_limit=30000, update_progress=None):
+    """
+    Selects users above the score threshold, best first, until their rows reach the data limit.
+    If none qualifies, the best-scoring user is taken as the closest match.
+
+    Args:
+        user_scores (list): Tuples of user and score, sorted by descending score.
+        data_limit (int): The limit on the amount of data to consider.
 
+    Returns:
+        list: A list of tuples containing the user, their score, and data count.
+    """
     top_users = []
     total_data_count = 0
-    data_limit_scale_factor = data_limit / 30000
-    score_threshold = 0.5 + 0.25 * data_limit_scale_factor
+    threshold = score_threshold(data_limit)
 
     for user, score in user_scores:
-        if total_data_count < data_limit and score > score_threshold:
-            user_data_count = min(len(user.physiological_data), data_limit - total_data_count)
+        if total_data_count < data_limit and score > threshold:
+            # Stubs without a known row count read no more rows than the remaining limit
+            user_data_count = user.data_count_within(data_limit - total_data_count)
+            if user_data_count == 0:
+                continue  # A lazily loaded user whose data sheet turned out to be empty or missing
             top_users.append((user, score, user_data_count))
             total_data_count += user_data_count
             # Update progress after adding each top user
@@ -108,7 +157,7 @@ def find_most_suitable_user(provided_user_details, users, data_limit=30000, upda
 
     if not top_users and user_scores:
         closest_match = user_scores[0]
-        closest_match_data_count = min(len(closest_match[0].physiological_data), data_limit)
+        closest_match_data_count = closest_match[0].data_count_within(data_limit)
         top_users.append((closest_match[0], closest_match[1], closest_match_data_count))
         # Update progress for closest match
         update_progress("Added Closest Match", {"file": "main.py", "function": "find_most_suitable_user",
@@ -152,18 +201,23 @@ def display_user_statistics(users, user_index):
     user.print_statistics()
 
 
-def test_predictions(user, test_samples, update_progress=None):
+def test_predictions(user, test_samples, update_progress=None, model=None):
     """
-    Tests and prints predictions for a given user and test samples.
+    Tests predictions for a given user and test samples. Predictions are recorded in the
+    prediction log (see prediction_log.py) rather than printed.
 
     Args:
         user (User): The user object.
         test_samples (list): A list of test samples.
+        model (UserEmotionModel, optional): The model to predict with; defaults to the user's.
+
+    Returns:
+        list: The predicted emotion of every sample.
     """
     update_progress("Testing Custom User Model", {"file": "main.py", "function": "test_predictions", "test_samples": f"{len(test_samples)}"})
-    predictions = EmotionAnalysis.make_predictions_for_user(user, test_samples)
-    for sample, prediction in zip(test_samples, predictions):
-        print(f"Test Sample: {sample}, Predicted Emotion: {prediction}")
+    with pipeline_stage('predict'):
+        predictions = EmotionAnalysis.make_predictions_for_user(user, test_samples, model=model)
+    return predictions
 
 
 def read_user_profile(file_path):
@@ -228,7 +282,106 @@ def find_valence_range(emotion):
     }
     return emotion_to_valence.get(emotion, (0.0, 1.0))  # Default range if emotion is not in the dictionary
 
-def get_analysis_results(suitable_user_info, user_predictions_list, provided_user_details, update_progress=None):
+# Result formats: "nested" repeats every input sample in each user's predictions; "columnar" sends the
+# samples once and, per user, one emotion code per sample (see get_columnar_results)
+RESULT_FORMATS = ('nested', 'columnar')
+
+
+def format_predictions(user_predictions_list, predictions, result_format='nested'):
+    """
+    Formats one user's predicted emotions in the requested result format.
+
+    Args:
+        user_predictions_list (list): A list of dictionaries containing user prediction data.
+        predictions (list): The predicted emotion name of each sample.
+        result_format (str): 'nested' or 'columnar'.
+
+    Returns:
+        dict: {"Predictions": [...]} with a copy of each sample plus its emotion and valence range, or
+            {"Emotion Codes": [...]} with each emotion's code from utilities.EMOTION_TO_LABEL.
+    """
+    if result_format == 'columnar':
+        return {"Emotion Codes": [EMOTION_TO_LABEL.get(prediction, 0) for prediction in predictions]}
+
+    formatted = []
+    for sample, prediction in zip(user_predictions_list, predictions):
+        sample_with_prediction = sample.copy()
+        sample_with_prediction["Predicted Emotion"] = prediction
+        valence_low, valence_high = find_valence_range(prediction)
+        sample_with_prediction["Valence Range"] = [valence_low, valence_high]
+        formatted.append(sample_with_prediction)
+    return {"Predictions": formatted}
+
+
+def to_columnar_result(user_result):
+    """
+    Converts a nested per-user result, e.g. from a shard, to the columnar format.
+    """
+    columnar_result = {key: value for key, value in user_result.items() if key != "Predictions"}
+    columnar_result.update(format_predictions(None, [prediction["Predicted Emotion"]
+                                                     for prediction in user_result["Predictions"]], 'columnar'))
+    return columnar_result
+
+
+def columnar_code_tables():
+    """
+    The emotion name and valence range of every emotion code, indexed by code.
+    """
+    emotions = [LABEL_TO_EMOTION[code] for code in range(len(LABEL_TO_EMOTION))]
+    return {"Emotions": emotions, "Valence Ranges": [list(find_valence_range(emotion)) for emotion in emotions]}
+
+
+def get_columnar_results(user_results, user_predictions_list):
+    """
+    Wraps columnar per-user results with the samples and the shared code tables.
+
+    Args:
+        user_results (list): Results built with result_format='columnar'.
+        user_predictions_list (list): A list of dictionaries containing user prediction data.
+
+    Returns:
+        dict: The samples once, the emotion name and valence range of every code, and the users.
+    """
+    return {
+        "Format": "columnar",
+        "Samples": user_predictions_list,
+        **columnar_code_tables(),
+        "Users": user_results
+    }
+
+
+def get_user_result(user, user_predictions_list, provided_user_details, result_format='nested', predictions=None):
+    """
+    Predicts the samples with one user's model and formats that user's result.
+
+    Args:
+        user (User): A user with a trained model.
+        user_predictions_list (list): A list of dictionaries containing user prediction data.
+        provided_user_details (dict): The user details that were used for matching.
+        result_format (str): 'nested' or 'columnar', see format_predictions.
+        predictions (list, optional): Emotions already predicted for the samples, e.g. in a batch
+            shared with other requests; the user's model is not called then.
+
+    Returns:
+        dict: The user's ID, matched features and predictions with valence ranges.
+    """
+    matched_features = {k: user.profile[k] for k in provided_user_details if k in user.profile}
+
+    user_result = {
+        "User ID": user.profile.get('unique-id'),
+        "Matched Features": matched_features,
+    }
+
+    if predictions is None:
+        with pipeline_stage('predict'):
+            predictions = EmotionAnalysis.make_predictions_for_user(user, user_predictions_list)
+    user_result.update(format_predictions(user_predictions_list, predictions, result_format))
+
+    return user_result
+
+
+def get_analysis_results(suitable_user_info, user_predictions_list, provided_user_details, update_progress=None,
+                         result_format='nested'):
     """
     Gathers and formats the results of the analysis for frontend display.
 
@@ -241,44 +394,122 @@ def get_analysis_results(suitable_user_info, user_predictions_list, provided_use
         list: A list of dictionaries with formatted results for each user.
     """
     update_progress("Compiling Results", {"file": "main.py", "function": "get_analysis_results"})
-    results = []
+    return [get_user_result(user, user_predictions_list, provided_user_details, result_format)
+            for user, score, data_count in suitable_user_info]
+
+
+def expected_training_cost(user_info, feature_schema=None, coreset=None):
+    """
+    Sort key putting users whose results are cheapest to produce first: models the training
+    coordinator already holds for this request, then the smallest training sets.
+    """
+    user, score, data_count = user_info
+    ready = TRAINING_COORDINATOR.is_ready(user, data_count, feature_schema=feature_schema, coreset=coreset)
+    return 0 if ready else data_count
+
+
+def get_prototype_results(user_predictions_list, update_progress=None, result_format='nested'):
+    """
+    Formats results from the generic emotion prototypes, used when there is no time to train a user model.
+
+    Args:
+        user_predictions_list (list): A list of dictionaries containing user prediction data.
+
+    Returns:
+        list: A single result, with no user ID or matched features.
+    """
+    update_progress("Compiling Prototype Results", {"file": "main.py", "function": "get_prototype_results"})
+    predictions = [Emotion.Emotion._find_closest_emotion_generic([format_data(sample)])
+                   for sample in user_predictions_list]
+    user_result = {"User ID": None, "Matched Features": {}}
+    user_result.update(format_predictions(user_predictions_list, predictions, result_format))
+    return [user_result]
+
+
+def get_cohort_results(suitable_user_info, user_predictions_list, update_progress=None, job_control=None,
+                       result_format='nested'):
+    """
+    Predicts with weighted k-nearest neighbours over the matched users' samples instead of trained models.
+
+    Args:
+        suitable_user_info (list): List of tuples containing the user, their score, and data count.
+        user_predictions_list (list): A list of dictionaries containing user prediction data.
+
+    Returns:
+        list: A single result for the whole cohort, with the matched user IDs under "Cohort".
+    """
+    update_progress("Indexing Cohort Samples", {"file": "main.py", "function": "get_cohort_results",
+                                                "users": f"{len(suitable_user_info)}"})
+    indexes = []
     for user, score, data_count in suitable_user_info:
-        matched_features = {k: user.profile[k] for k in provided_user_details if k in user.profile}
+        if job_control is not None:
+            job_control.checkpoint('index')
+        with pipeline_stage('index'):
+            indexes.append(user.sample_index(data_count))
 
-        user_result = {
-            "User ID": user.profile.get('unique-id'),
-            "Matched Features": matched_features,
-            "Predictions": []
-        }
+    if job_control is not None:
+        job_control.checkpoint('predict')
+    with pipeline_stage('predict'):
+        predictions = CohortPredictor(indexes).predict(user_predictions_list)
 
-        predictions = EmotionAnalysis.make_predictions_for_user(user, user_predictions_list)
-        for sample, prediction in zip(user_predictions_list, predictions):
-            sample_with_prediction = sample.copy()
-            sample_with_prediction["Predicted Emotion"] = prediction
-            valence_low, valence_high = find_valence_range(prediction)
-            sample_with_prediction["Valence Range"] = [valence_low, valence_high]
-            user_result["Predictions"].append(sample_with_prediction)
+    user_result = {"User ID": None, "Cohort": [user.profile.get('unique-id') for user, _, _ in suitable_user_info],
+                   "Matched Features": {}}
+    user_result.update(format_predictions(user_predictions_list, predictions, result_format))
+    return [user_result]
 
-        results.append(user_result)
 
-    return results
+# Data limit of a request that sets none and of directories without a data_limit_tuning.py tuning
+DEFAULT_DATA_LIMIT = 30000
 
 
-def main(directory_path, data_limit=30000, user_profile_dict=None, user_predictions_list=None,
-         display_results=False, emit_progress: Optional[Callable[[str], None]] = None):
+# Prediction engines: per-user random forests, or k-nearest neighbours over the cohort's samples
+PREDICTION_ENGINES = ('forest', 'knn')
+
+
+def main(directory_path, data_limit=None, user_profile_dict=None, user_predictions_list=None,
+         display_results=False, emit_progress: Optional[Callable[[str], None]] = None,
+         profile=False, job_id=None, profile_dir='profiles', users=None, feature_schema=None,
+         job_control=None, emit_result: Optional[Callable[[dict], None]] = None, engine='forest',
+         result_format='nested', training_seconds=None, coreset=None):
     """
     Main function to execute the application logic.
 
     Args:
         directory_path (str): Path to the directory containing user data.
-        data_limit (int): Limit on the amount of data to consider.
+        data_limit (int, optional): Limit on the amount of data to consider. If not given,
+            DEFAULT_DATA_LIMIT is used, and if the directory has a tuning written by
+            data_limit_tuning.py, each matched user is trained on no more than their recommended rows.
         user_profile_dict (dict, optional): A dictionary containing the user profile.
         user_predictions_list (list, optional): A list of dictionaries containing user prediction data.
+        profile (bool): Whether to profile this run's CPU time and per-stage memory.
+        job_id (str, optional): Identifier used to name the profile files.
+        profile_dir (str): Directory the profile files are written to.
+        users (list, optional): Pre-loaded User objects, e.g. from a DirectorySync, used instead of
+            loading the directory.
+        feature_schema (list, optional): A feature_engine schema to train and predict on instead of
+            the six raw signals.
+        job_control (JobControl, optional): Deadline and cancellation token checked between stages and
+            between users. Raises JobCancelled when the job's token is cancelled. As the deadline
+            runs out the analysis trains fewer users, caps their rows or falls back to the prototypes;
+            the degradation strategy used is left in `job_control.strategy`.
+        emit_result (callable, optional): Called with each user's result as soon as that user is done.
+            Users are then processed in order of expected training cost, smallest first; the returned
+            results stay in score order.
+        engine (str): 'forest' to train a model per matched user, or 'knn' to skip training and
+            predict by nearest neighbours over the matched users' samples. 'knn' uses the raw signals.
+        result_format (str): 'nested' returns a list of per-user results with a copy of every sample;
+            'columnar' returns get_columnar_results, with the samples once and emotion codes per user.
+        training_seconds (float, optional): Time budget for each user's model. Forests are then grown
+            in increments until the budget is spent or their out-of-bag accuracy plateaus. Under a
+            deadline, a user whose full fit would overrun its share of the time left is trained the
+            same way within that share.
+        coreset (int, optional): Train on a weighted coreset of each user's rows, quantized at this
+            resolution (see coreset.py), instead of on every row. Not supported with a feature schema.
     """
     def update_progress(stage: str, details: dict = None):
         if emit_progress:
             try:
-                print(f"{stage}: {details}")
+                # Progress goes to the client only; console writes would serialize the request threads
                 emit_progress(stage, details)
             except Exception as e:
                 print(f"Error in emit_progress: {e}")
@@ -287,12 +518,40 @@ def main(directory_path, data_limit=30000, user_profile_dict=None, user_predicti
             detail_str = ", ".join([f"{key}: {value}" for key, value in details.items()]) if details else ""
             print(f"{stage}" + (f" - {detail_str}" if detail_str else ""))
 
+    if profile:
+        profiler = RunProfiler(job_id or uuid.uuid4().hex, output_dir=profile_dir)
+        with profiler:
+            results = main(directory_path, data_limit, user_profile_dict, user_predictions_list,
+                           display_results=display_results, emit_progress=emit_progress, users=users,
+                           feature_schema=feature_schema, job_control=job_control, emit_result=emit_result,
+                           engine=engine, result_format=result_format, training_seconds=training_seconds,
+                           coreset=coreset)
+        update_progress("Profile Saved", {"file": "main.py", "function": "main", "job_id": profiler.job_id,
+                                          **profiler.paths})
+        return results
+
+    if engine not in PREDICTION_ENGINES:
+        raise ValueError(f"Unknown prediction engine '{engine}'. Expected one of {PREDICTION_ENGINES}.")
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f"Unknown result format '{result_format}'. Expected one of {RESULT_FORMATS}.")
+    if engine == 'knn' and feature_schema is not None:
+        raise ValueError("The knn engine predicts on the raw signals and does not support a feature schema.")
+    if coreset is not None and feature_schema is not None:
+        raise ValueError("Coresets summarize the raw signals and do not support a feature schema.")
+    job_control = job_control or JobControl()
+    # Only requests without a data limit of their own follow the directory's tuning
+    tuning = directory_tuning(directory_path) if data_limit is None else None
+    data_limit = DEFAULT_DATA_LIMIT if data_limit is None else data_limit
+
     # Emitting a progress update at the start of the analysis.
     update_progress("Initializing Analysis", {"file": "main.py", "function": "main"})
 
-    # Loading user data from the provided directory path.
-    data_loader = UserDataLoader(directory_path, update_progress=update_progress)
-    users = data_loader.load_users()
+    # Loading user profiles from the provided directory path; data sheets are read later, only for matched users.
+    job_control.checkpoint('load_users')
+    if users is None:
+        data_loader = UserDataLoader(directory_path, update_progress=update_progress)
+        with pipeline_stage('load_users'):
+            users = data_loader.load_user_profiles()
 
     # Handling the case where no users are found in the directory.
     if not users:
@@ -313,7 +572,15 @@ def main(directory_path, data_limit=30000, user_profile_dict=None, user_predicti
             return
 
     # Finding the most suitable users based on the provided profile.
-    suitable_user_info = find_most_suitable_user(user_profile_dict, users, data_limit, update_progress=update_progress)
+    job_control.checkpoint('profile_match')
+    with pipeline_stage('profile_match'):
+        suitable_user_info = find_most_suitable_user(user_profile_dict, users, data_limit, update_progress=update_progress)
+    if tuning is not None:
+        # Rows past the point where accuracy plateaus cost training time for no gain
+        suitable_user_info = apply_tuned_rows(suitable_user_info, tuning)
+        update_progress("Applied Tuned Data Counts", {"file": "main.py", "function": "main",
+                                                      "data_counts": [data_count for _, _, data_count
+                                                                      in suitable_user_info]})
 
     # Reading user predictions, if not provided.
     if user_predictions_list is None:
@@ -328,29 +595,128 @@ def main(directory_path, data_limit=30000, user_profile_dict=None, user_predicti
             update_progress("Error decoding JSON", {"file": test_samples_path})
             return
 
-    # Processing suitable users and making predictions based on the data.
-    for user, score, data_count in suitable_user_info:
-        if not user.emotion_model.is_trained:
-            limited_data = user.physiological_data[:data_count]
-            EmotionAnalysis.train_user_model(user, limited_data, update_progress=update_progress)
-            test_predictions(user, user_predictions_list, update_progress=update_progress)
-
-    # Compiling the results for display if required.
+    # Nearest-neighbour prediction needs no training, only an index per matched user.
+    if engine == 'knn':
+        results = get_cohort_results(suitable_user_info, user_predictions_list, update_progress=update_progress,
+                                     job_control=job_control, result_format=result_format)
+        if emit_result:
+            emit_result(results[0])
+        if display_results:
+            if emit_progress is None:
+                for result in results:
+                    print(json.dumps(result, indent=4))  # Pretty print the results
+            if result_format == 'columnar':
+                results = get_columnar_results(results, user_predictions_list)
+        job_control.finish()
+        update_progress("Analysis Complete", {"file": "main.py", "function": "main", "strategy": job_control.strategy})
+        return results if display_results else None
+
+    # Trimming the selection to what the remaining time budget can train.
+    job_control.checkpoint('train')
+    planned_user_info = job_control.plan(suitable_user_info)
+    if job_control.strategy != 'full':
+        update_progress("Degrading Analysis", {"file": "main.py", "function": "main", "strategy": job_control.strategy,
+                                               "remaining_seconds": f"{job_control.remaining():.2f}"})
+
+    # Processing suitable users and making predictions based on the data. When results are streamed,
+    # the cheapest users go first so the first result arrives as early as possible.
+    if emit_result:
+        planned_user_info = sorted(planned_user_info,
+                                   key=lambda user_info: expected_training_cost(user_info, feature_schema, coreset))
+    trained_user_info = []
+    user_results = {}
+    for position, (user, score, data_count) in enumerate(planned_user_info):
+        job_control.checkpoint('train')
+        # Every request goes through the coordinator, whose key covers the row count, feature schema and
+        # coreset planned here; a model it already holds for that key costs nothing against the budget
+        ready = TRAINING_COORDINATOR.is_ready(user, data_count, feature_schema=feature_schema, coreset=coreset)
+        if not ready and (trained_user_info or job_control.expired) and not job_control.can_afford(data_count):
+            # Training ran slower than estimated; keep the users trained so far, or fall back to
+            # the prototypes if the deadline passed before any was trained
+            job_control.degrade('fewer_users')
+            update_progress("Degrading Analysis", {"file": "main.py", "function": "main",
+                                                   "strategy": job_control.strategy,
+                                                   "remaining_seconds": f"{job_control.remaining():.2f}"})
+            break
+        with pipeline_stage('load_user_data'):
+            # Only the rows this request trains on are read
+            user.data_prefix(data_count)
+        time_budget = job_control.time_budget(data_count, len(planned_user_info) - position)
+        if training_seconds is not None:
+            time_budget = training_seconds if time_budget is None else min(training_seconds, time_budget)
+        started = time.perf_counter()
+        with pipeline_stage('train'):
+            # Concurrent requests for the same user and row count share one fit
+            model, trained_here = TRAINING_COORDINATOR.train(
+                user, data_count, feature_schema=feature_schema, update_progress=update_progress,
+                checkpoint=lambda: job_control.checkpoint('train'), time_budget=time_budget, coreset=coreset)
+        if trained_here and model.stop_reason == 'complete':
+            # Fits cut short would make training look cheaper than it is
+            job_control.record_training(user.data_count_within(data_count), time.perf_counter() - started)
+        job_control.checkpoint('predict')
+        predictions = test_predictions(user, user_predictions_list, update_progress=update_progress, model=model)
+        trained_user_info.append((user, score, data_count))
+
+        if emit_result or display_results:
+            with pipeline_stage('compile_results'):
+                user_results[id(user)] = get_user_result(user, user_predictions_list, user_profile_dict,
+                                                         result_format, predictions=predictions)
+            if emit_result:
+                emit_result(user_results[id(user)])
+
+    if suitable_user_info and not trained_user_info:
+        job_control.degrade('prototype')
+        if emit_result or display_results:
+            job_control.checkpoint('compile_results')
+            with pipeline_stage('compile_results'):
+                prototype_results = get_prototype_results(user_predictions_list, update_progress=update_progress,
+                                                          result_format=result_format)
+            if emit_result:
+                emit_result(prototype_results[0])
+
+    # Compiling the results for display if required, in score order.
     if display_results:
-        results = get_analysis_results(suitable_user_info, user_predictions_list, user_profile_dict, update_progress=update_progress)
-        for result in results:
-            print(json.dumps(result, indent=4))  # Pretty print the results
+        update_progress("Compiling Results", {"file": "main.py", "function": "main"})
+        if trained_user_info:
+            trained_users = {id(user) for user, score, data_count in trained_user_info}
+            results = [user_results[id(user)] for user, score, data_count in suitable_user_info
+                       if id(user) in trained_users]
+        else:
+            results = prototype_results
+        if emit_progress is None:
+            # Served requests return the results instead; only console runs print them
+            for result in results:
+                print(json.dumps(result, indent=4))  # Pretty print the results
+        if result_format == 'columnar':
+            results = get_columnar_results(results, user_predictions_list)
 
     # Indicating the completion of the analysis process.
-    update_progress("Analysis Complete", {"file": "main.py", "function": "main"})
+    job_control.finish()
+    update_progress("Analysis Complete", {"file": "main.py", "function": "main", "strategy": job_control.strategy})
     return results if display_results else None
 
 if __name__ == "__main__":
-    directory_path = "sample-users"
-    custom_data_limit = 100000
+    parser = argparse.ArgumentParser(description="Run the emotion analysis on the sample users.")
+    parser.add_argument("--directory", default="sample-users", help="Directory containing user workbooks.")
+    parser.add_argument("--data-limit", type=int, default=None,
+                        help="Limit on the amount of data to consider (default: the directory's tuning, "
+                             "see data_limit_tuning.py, within 30000 rows).")
+    parser.add_argument("--profile", action="store_true", help="Profile CPU time and per-stage memory of the run.")
+    parser.add_argument("--job-id", default=None, help="Identifier used to name the profile files.")
+    parser.add_argument("--profile-dir", default="profiles", help="Directory the profile files are written to.")
+    parser.add_argument("--training-seconds", type=float, default=None,
+                        help="Time budget per user model; forests are grown until it is spent or accuracy plateaus.")
+    parser.add_argument("--coreset-resolution", type=int, default=None,
+                        help="Train on weighted coresets at this grid resolution instead of every row.")
+    args = parser.parse_args()
+
+    directory_path = args.directory
+    custom_data_limit = args.data_limit
     user_profile = {'age': 19, 'gender': 'female', 'nationality': 'Indian','smoking-habits': 'none','ethnicity':'Indian','sleep-patterns':'regular'}
     user_predictions = [{"heart-rate-bpm": 60, "breathing-rate-breaths-min": 20, "hrv-ms": 30, "skin-temp-c": 20, "emg-mv": 0.1, "bvp-unit": 0.2},
                         {"heart-rate-bpm": 80, "breathing-rate-breaths-min": 18, "hrv-ms": 55, "skin-temp-c": 32, "emg-mv": 0.3, "bvp-unit": 0.9}]
     results = main(directory_path, data_limit=custom_data_limit, user_profile_dict=user_profile,
-                   user_predictions_list=user_predictions, display_results=False)
+                   user_predictions_list=user_predictions, display_results=False,
+                   profile=args.profile, job_id=args.job_id, profile_dir=args.profile_dir,
+                   training_seconds=args.training_seconds, coreset=args.coreset_resolution)
     # print(results)
@@ -0,0 +1,203 @@
+import os
+import threading
+from collections import OrderedDict
+
+import joblib
+
+from metrics import REGISTRY
+
+# Byte budget of the process-wide registry, its eviction policy ('lru' or 'cost') and where
+# evicted models are spilled to; without a spill directory evicted models are dropped.
+MODEL_REGISTRY_MAX_BYTES = int(os.environ.get('MODEL_REGISTRY_MAX_BYTES', 512 * 1024 * 1024))
+MODEL_REGISTRY_POLICY = os.environ.get('MODEL_REGISTRY_POLICY', 'lru')
+MODEL_SPILL_DIR = os.environ.get('MODEL_SPILL_DIR')
+
+EVICTION_POLICIES = ('lru', 'cost')
+
+REGISTRY_BYTES = REGISTRY.gauge('edith_model_registry_bytes', 'Estimated bytes of the models held in memory.')
+REGISTRY_MODELS = REGISTRY.gauge('edith_model_registry_models', 'Models held in memory.')
+MODEL_EVICTIONS = REGISTRY.counter('edith_model_evictions_total', 'Models evicted from the registry.', ('outcome',))
+MODEL_RELOADS = REGISTRY.counter('edith_model_reloads_total', 'Evicted models reloaded from the spill directory.')
+
+# Fixed per-node arrays of a fitted sklearn tree: children, feature, threshold, impurity, sample counts
+_TREE_NODE_BYTES = 7 * 8
+
+# Rough footprint of a model's Python objects, so even untrained models count against the budget
+_MODEL_OVERHEAD_BYTES = 1024
+
+
+def estimate_model_bytes(model):
+    """
+    Estimates the memory held by a UserEmotionModel: its training arrays plus its fitted trees.
+    """
+    size = _MODEL_OVERHEAD_BYTES
+    for array in (model.X, model.y, model.sample_weight):
+        if array is not None:
+            size += array.nbytes
+    for estimator in getattr(model.emotion_model, 'estimators_', ()):
+        tree = estimator.tree_
+        size += tree.node_count * _TREE_NODE_BYTES + tree.value.nbytes
+    return size
+
+
+def _training_cost(model):
+    # Rows the model was fitted on, a proxy for what it costs to train again
+    return len(model.y) if model.y is not None else 0
+
+
+class ModelRegistry:
+    """
+    A dict-like store of UserEmotionModels, keyed by user ID, kept within a byte budget.
+
+    Each model's size is estimated when it is stored and again on `refresh`, e.g. after training.
+    When the total exceeds `max_bytes`, models are evicted either in least-recently-used order
+    ('lru') or by GreedyDual-Size ('cost'), which evicts the model with the least training cost
+    per byte, aged so that models left unused long enough are evicted regardless. With a
+    `spill_dir`, evicted models are written there and reloaded transparently on their next access.
+
+    Args:
+        max_bytes (int): The memory budget for the models held in memory.
+        policy (str): 'lru' or 'cost'.
+        spill_dir (str, optional): Directory evicted models are spilled to.
+    """
+    def __init__(self, max_bytes=MODEL_REGISTRY_MAX_BYTES, policy=MODEL_REGISTRY_POLICY, spill_dir=MODEL_SPILL_DIR):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy '{policy}'. Expected one of {EVICTION_POLICIES}.")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.spill_dir = spill_dir
+        self.total_bytes = 0
+        self._models = OrderedDict()  # Least recently used first
+        self._sizes = {}
+        self._priorities = {}
+        self._inflation = 0.0  # GreedyDual-Size aging value
+        self._spilled = set()
+        self._lock = threading.RLock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{joblib.hash(key)}.joblib")
+
+    def _account(self, key, model):
+        size = estimate_model_bytes(model)
+        self.total_bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self._priorities[key] = self._inflation + _training_cost(model) / max(size, 1)
+
+    def _touch(self, key):
+        self._models.move_to_end(key)
+        if self.policy == 'cost':
+            model = self._models[key]
+            self._priorities[key] = self._inflation + _training_cost(model) / max(self._sizes[key], 1)
+
+    def _publish(self):
+        REGISTRY_BYTES.set(self.total_bytes)
+        REGISTRY_MODELS.set(len(self._models))
+
+    def _evict(self, keep=None):
+        while self.total_bytes > self.max_bytes and len(self._models) > (1 if keep in self._models else 0):
+            candidates = [key for key in self._models if key != keep]
+            if self.policy == 'lru':
+                victim = candidates[0]
+            else:
+                victim = min(candidates, key=self._priorities.__getitem__)
+                self._inflation = self._priorities[victim]
+            model = self._models.pop(victim)
+            self.total_bytes -= self._sizes.pop(victim)
+            self._priorities.pop(victim)
+            if self.spill_dir:
+                joblib.dump(model, self._spill_path(victim))
+                self._spilled.add(victim)
+                MODEL_EVICTIONS.inc(outcome='spilled')
+            else:
+                MODEL_EVICTIONS.inc(outcome='dropped')
+
+    def _reload(self, key):
+        model = joblib.load(self._spill_path(key))
+        self._spilled.discard(key)
+        os.remove(self._spill_path(key))
+        MODEL_RELOADS.inc()
+        return model
+
+    def __setitem__(self, key, model):
+        with self._lock:
+            if key in self._spilled:
+                self._spilled.discard(key)
+                os.remove(self._spill_path(key))
+            self._models[key] = model
+            self._models.move_to_end(key)
+            self._account(key, model)
+            self._evict(keep=key)
+            self._publish()
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key in self._models:
+                self._touch(key)
+                return self._models[key]
+            if key in self._spilled:
+                model = self._reload(key)
+                self._models[key] = model
+                self._account(key, model)
+                self._evict(keep=key)
+                self._publish()
+                return model
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._models or key in self._spilled
+
+    def __len__(self):
+        with self._lock:
+            return len(self._models) + len(self._spilled)
+
+    def keys(self):
+        with self._lock:
+            return list(self._models) + sorted(self._spilled - set(self._models), key=str)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def pop(self, key, *default):
+        with self._lock:
+            if key in self._models:
+                model = self._models.pop(key)
+                self.total_bytes -= self._sizes.pop(key)
+                self._priorities.pop(key)
+                self._publish()
+                return model
+            if key in self._spilled:
+                return self._reload(key)
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def refresh(self, key):
+        """
+        Re-measures a model after it changed in place, e.g. was trained, and evicts if over budget.
+        """
+        with self._lock:
+            if key in self._models:
+                self._account(key, self._models[key])
+                self._touch(key)
+                self._evict(keep=key)
+                self._publish()
+
+    def is_resident(self, key):
+        with self._lock:
+            return key in self._models
+
+
+# The process-wide registry behind emotion.user_models
+MODEL_REGISTRY = ModelRegistry()
@@ -0,0 +1,112 @@
+import threading
+import weakref
+
+import numpy as np
+from sklearn.neighbors import KDTree
+
+from physiological_data import FEATURE_DTYPE, PhysiologicalData
+from utilities import EMOTION_TO_LABEL, LABEL_TO_EMOTION, format_data
+
+# Typical maximum of each signal in FEATURE_COLUMNS order, as used by the generic emotion prototypes.
+# Dividing by them puts heart rate and EMG on comparable scales before measuring distances.
+FEATURE_SCALES = np.array([120, 25, 120, 37, 1, 2], dtype=FEATURE_DTYPE)
+
+DEFAULT_NEIGHBORS = 7
+
+# SampleIndexes of each loaded PhysiologicalData object, per row count, dropped with the object
+_index_cache = weakref.WeakKeyDictionary()
+_index_cache_lock = threading.Lock()
+
+
+class SampleIndex:
+    """
+    A KD-tree over one user's labelled samples, with features divided by FEATURE_SCALES.
+    Building it is O(n log n) and each query O(log n), with no model fitting.
+    """
+    __slots__ = ('tree', 'labels')
+
+    def __init__(self, data, leaf_size=40):
+        data = PhysiologicalData.from_samples(data)
+        self.labels = data.labels
+        self.tree = KDTree(data.features / FEATURE_SCALES, leaf_size=leaf_size) if len(data) else None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def query(self, scaled_points, k):
+        """
+        Returns the distances and label codes of the k nearest samples to each scaled point.
+        """
+        k = min(k, len(self))
+        if k == 0:
+            empty = np.empty((len(scaled_points), 0))
+            return empty, empty.astype(self.labels.dtype)
+        distances, indices = self.tree.query(scaled_points, k=k)
+        return distances, self.labels[indices]
+
+
+def data_sample_index(data, rows):
+    """
+    A SampleIndex over the first `rows` samples of a data object. Indexes of PhysiologicalData
+    objects are cached for as long as the object is alive.
+    """
+    if not isinstance(data, PhysiologicalData):
+        return SampleIndex(data[:rows])
+    with _index_cache_lock:
+        index = _index_cache.get(data, {}).get(rows)
+    if index is None:
+        index = SampleIndex(data[:rows])
+        with _index_cache_lock:
+            _index_cache.setdefault(data, {})[rows] = index
+    return index
+
+
+def cached_sample_indexes(data):
+    """
+    The cached indexes of a data object, by row count.
+    """
+    with _index_cache_lock:
+        return dict(_index_cache.get(data, {}))
+
+
+def restore_sample_indexes(data, indexes):
+    """
+    Seeds the cache with indexes built earlier over the same data, e.g. from a snapshot.
+    """
+    with _index_cache_lock:
+        _index_cache.setdefault(data, {}).update(indexes)
+
+
+class CohortPredictor:
+    """
+    Weighted k-nearest-neighbour prediction over the union of several users' SampleIndexes.
+
+    Each index returns its k nearest samples, the k nearest of all of them vote, and every vote is
+    weighted by the inverse of its distance, so the cost per query is O(users * log n).
+    """
+    def __init__(self, indexes, k=DEFAULT_NEIGHBORS):
+        self.indexes = [index for index in indexes if len(index)]
+        self.k = k
+
+    def predict(self, physiological_data_samples):
+        """
+        Predicts an emotion name for each sample dict.
+        """
+        if not physiological_data_samples:
+            return []
+        if not self.indexes:
+            return ['Undefined'] * len(physiological_data_samples)
+        points = np.array([format_data(sample) for sample in physiological_data_samples],
+                          dtype=FEATURE_DTYPE) / FEATURE_SCALES
+
+        results = [index.query(points, self.k) for index in self.indexes]
+        distances = np.hstack([distances for distances, _ in results])
+        labels = np.hstack([labels for _, labels in results])
+        nearest = np.argsort(distances, axis=1, kind='stable')[:, :self.k]
+        distances = np.take_along_axis(distances, nearest, axis=1)
+        labels = np.take_along_axis(labels, nearest, axis=1)
+
+        weights = 1.0 / (distances + 1e-6)
+        votes = np.zeros((len(points), len(EMOTION_TO_LABEL)))
+        np.add.at(votes, (np.arange(len(points))[:, None], labels), weights)
+        return [LABEL_TO_EMOTION.get(label, 'Undefined') for label in votes.argmax(axis=1)]
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from utilities import FEATURE_COLUMNS, EMOTION_TO_LABEL, LABEL_TO_EMOTION, format_data, format_label
+
+FEATURE_DTYPE = np.float32
+LABEL_DTYPE = np.uint8
+
+
+class PhysiologicalData:
+    """
+    Compact, columnar storage of a user's physiological samples.
+
+    Features are kept as one float32 array of shape (n, len(FEATURE_COLUMNS)) and emotions as uint8
+    label codes from the shared `format_label` mapping. Slicing returns views onto the same arrays,
+    so trimming to `data_count` rows or handing the arrays to a model copies nothing.
+
+    Indexing with an integer or iterating yields sample dicts, for code written against the
+    list-of-dicts representation.
+    """
+    __slots__ = ('features', 'labels', '__weakref__')
+
+    def __init__(self, features, labels):
+        self.features = np.asarray(features, dtype=FEATURE_DTYPE).reshape(-1, len(FEATURE_COLUMNS))
+        self.labels = np.asarray(labels, dtype=LABEL_DTYPE)
+        if len(self.features) != len(self.labels):
+            raise ValueError(f"Got {len(self.features)} feature rows but {len(self.labels)} labels.")
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty((0, len(FEATURE_COLUMNS)), dtype=FEATURE_DTYPE), np.empty(0, dtype=LABEL_DTYPE))
+
+    @classmethod
+    def from_dataframe(cls, data_df):
+        """
+        Builds the arrays from a `data` sheet in one vectorized pass. Fully empty rows are dropped
+        and missing values read as 0, as format_data does for missing keys.
+        """
+        data_df = data_df.dropna(how='all')
+        features = np.zeros((len(data_df), len(FEATURE_COLUMNS)), dtype=FEATURE_DTYPE)
+        for i, column in enumerate(FEATURE_COLUMNS):
+            if column in data_df.columns:
+                values = pd.to_numeric(data_df[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                features[:, i] = np.nan_to_num(values, nan=0.0)
+        if 'predicted-emotion' in data_df.columns:
+            labels = data_df['predicted-emotion'].map(EMOTION_TO_LABEL).fillna(0).to_numpy(dtype=LABEL_DTYPE)
+        else:
+            labels = np.zeros(len(data_df), dtype=LABEL_DTYPE)
+        return cls(features, labels)
+
+    @classmethod
+    def from_samples(cls, samples):
+        """
+        Converts a list of sample dicts to the compact form. PhysiologicalData is returned unchanged.
+        """
+        if isinstance(samples, cls):
+            return samples
+        if not samples:
+            return cls.empty()
+        features = [format_data(sample) for sample in samples]
+        labels = [format_label(sample.get('predicted-emotion', 'Undefined')) for sample in samples]
+        return cls(features, labels)
+
+    @property
+    def nbytes(self):
+        return self.features.nbytes + self.labels.nbytes
+
+    def emotions(self):
+        return [LABEL_TO_EMOTION.get(int(label), 'Undefined') for label in self.labels]
+
+    def label_histogram(self):
+        """
+        Returns the number of samples per emotion name.
+        """
+        counts = np.bincount(self.labels, minlength=len(LABEL_TO_EMOTION))
+        return {LABEL_TO_EMOTION.get(label, 'Undefined'): int(count) for label, count in enumerate(counts) if count}
+
+    def sample(self, index):
+        sample = {column: float(value) for column, value in zip(FEATURE_COLUMNS, self.features[index])}
+        sample['predicted-emotion'] = LABEL_TO_EMOTION.get(int(self.labels[index]), 'Undefined')
+        return sample
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PhysiologicalData(self.features[index], self.labels[index])
+        return self.sample(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.sample(index)
+
+    def __repr__(self):
+        return f"PhysiologicalData(samples={len(self)}, nbytes={self.nbytes})"
@@ -0,0 +1,300 @@
+import argparse
+import atexit
+import datetime
+import json
+import os
+import struct
+import time
+import zlib
+import _thread
+from collections import deque
+
+import numpy as np
+
+from metrics import REGISTRY
+from physiological_data import FEATURE_DTYPE, LABEL_DTYPE
+from utilities import EMOTION_TO_LABEL, LABEL_TO_EMOTION
+
+# When set, every prediction is appended to rotating binary files in this directory
+PREDICTION_LOG_DIR = os.environ.get('PREDICTION_LOG_DIR')
+
+# A file is closed and a new one started once it grows past this size
+PREDICTION_LOG_MAX_BYTES = int(os.environ.get('PREDICTION_LOG_MAX_BYTES', 64 * 1024 * 1024))
+
+# Closed files beyond this many are deleted, oldest first
+PREDICTION_LOG_MAX_FILES = int(os.environ.get('PREDICTION_LOG_MAX_FILES', 20))
+
+# Seconds between flushes of the background writer
+PREDICTION_LOG_FLUSH_INTERVAL = float(os.environ.get('PREDICTION_LOG_FLUSH_INTERVAL', 1.0))
+
+LOG_FILE_PREFIX = 'predictions-'
+LOG_FILE_SUFFIX = '.bin'
+
+# Frame header: magic, rows, feature columns, bytes of the user ID table, CRC32 of the body
+_FRAME_MAGIC = b'EPL1'
+_FRAME_HEADER = struct.Struct('<4sIIII')
+
+PREDICTIONS_LOGGED = REGISTRY.counter('edith_predictions_logged_total', 'Predictions written to the prediction log.')
+PREDICTIONS_DROPPED = REGISTRY.counter('edith_predictions_dropped_total',
+                                       'Predictions dropped because the prediction log writer fell behind.')
+
+
+def _native_threading():
+    """
+    The unpatched start_new_thread and allocate_lock. Under gevent's monkey patching, threads
+    would be greenlets on the hub of whichever thread starts them, and the hub of a threadpool
+    worker never runs; even unpatched threading classes start threads through the patched module.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return _thread.start_new_thread, _thread.allocate_lock
+    return tuple(monkey.get_original('_thread', ['start_new_thread', 'allocate_lock']))
+
+
+def encode_frame(timestamps, user_ids, model_versions, features, labels):
+    """
+    Encodes a batch of predictions as one self-delimiting frame: a header followed by one
+    little-endian array per column and the distinct user IDs, which rows refer to by index.
+    """
+    rows = len(labels)
+    features = np.asarray(features, dtype=FEATURE_DTYPE).reshape(rows, -1)
+    user_table, user_codes = np.unique(np.asarray([str(user_id) for user_id in user_ids]), return_inverse=True)
+    names = "\n".join(user_table.tolist()).encode('utf-8')
+    body = b"".join([
+        np.asarray(timestamps, dtype='<i8').tobytes(),
+        np.asarray(model_versions, dtype='<i8').tobytes(),
+        np.asarray(user_codes.ravel(), dtype='<u4').tobytes(),
+        np.asarray(labels, dtype=LABEL_DTYPE).tobytes(),
+        features.astype('<f4', copy=False).tobytes(),
+        names,
+    ])
+    return _FRAME_HEADER.pack(_FRAME_MAGIC, rows, features.shape[1], len(names), zlib.crc32(body)) + body
+
+
+def decode_frames(data):
+    """
+    Yields the batches of a log file's bytes as dicts of column arrays. A torn or corrupt frame,
+    e.g. the last one of a process that was killed mid-write, ends the file.
+    """
+    offset = 0
+    while offset + _FRAME_HEADER.size <= len(data):
+        magic, rows, columns, names_size, checksum = _FRAME_HEADER.unpack_from(data, offset)
+        body_size = rows * (8 + 8 + 4 + 1 + 4 * columns) + names_size
+        start = offset + _FRAME_HEADER.size
+        body = data[start:start + body_size]
+        if magic != _FRAME_MAGIC or len(body) < body_size or zlib.crc32(body) != checksum:
+            return
+        arrays = {}
+        position = 0
+        for name, dtype, shape in (('timestamp', '<i8', (rows,)), ('model_version', '<i8', (rows,)),
+                                   ('user_code', '<u4', (rows,)), ('label', 'u1', (rows,)),
+                                   ('features', '<f4', (rows, columns))):
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(body, dtype=dtype, count=count, offset=position).reshape(shape)
+            position += count * np.dtype(dtype).itemsize
+        names = bytes(body[position:]).decode('utf-8').split("\n") if names_size else []
+        arrays['user_id'] = np.asarray(names, dtype=object)[arrays.pop('user_code')] if rows else np.empty(0, object)
+        yield arrays
+        offset = start + body_size
+
+
+class PredictionLog:
+    """
+    Append-only, batched binary log of predictions.
+
+    `log` only appends the batch to a deque (safe without locks, as in serving.EventBridge), so
+    the threads making predictions never wait on the disk or the console. A daemon OS thread,
+    started with the log, drains the deque every `flush_interval` seconds, writes one columnar
+    frame per feature width and flushes. Files are rotated at `max_bytes` and the oldest beyond `max_files` are deleted.
+    When more than `max_pending` batches are waiting, new batches are dropped and counted.
+    """
+    def __init__(self, directory_path, max_bytes=PREDICTION_LOG_MAX_BYTES, max_files=PREDICTION_LOG_MAX_FILES,
+                 flush_interval=PREDICTION_LOG_FLUSH_INTERVAL, max_pending=10000):
+        self.directory_path = directory_path
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = deque()
+        start_new_thread, allocate_lock = _native_threading()
+        self._write_lock = allocate_lock()
+        self._file = None
+        # Held until close(); the writer waits on it between flushes
+        self._stop_lock = allocate_lock()
+        self._stop_lock.acquire()
+        # Held by the writer while it runs, so close() can wait for it to finish
+        self._running_lock = allocate_lock()
+        self._running_lock.acquire()
+        self._closed = False
+        # An OS thread from the start, so disk writes never run on the event loop or wait for a predicting thread
+        start_new_thread(self._run, ())
+
+    def log(self, user_id, model_version, features, labels):
+        """
+        Queues the predictions of one model call for the writer.
+
+        Args:
+            features (numpy.ndarray): The rows the model predicted, one per label.
+            labels (numpy.ndarray): The predicted label codes.
+        """
+        if len(self._pending) >= self.max_pending:
+            PREDICTIONS_DROPPED.inc(len(labels))
+            return
+        self._pending.append((time.time_ns(), user_id, model_version or 0, features, labels))
+
+    def _run(self):
+        try:
+            while not self._stop_lock.acquire(timeout=self.flush_interval):
+                self.flush()
+        finally:
+            self._running_lock.release()
+
+    def flush(self):
+        """
+        Writes every queued batch and flushes the file.
+        """
+        with self._write_lock:
+            # Batches are merged into one frame per feature width, e.g. raw signals and each feature schema
+            by_width = {}
+            while self._pending:
+                timestamp, user_id, model_version, features, labels = self._pending.popleft()
+                rows = len(labels)
+                if rows:
+                    features = np.asarray(features, dtype=FEATURE_DTYPE).reshape(rows, -1)
+                    by_width.setdefault(features.shape[1], []).append(
+                        (np.full(rows, timestamp), [user_id] * rows, np.full(rows, model_version), features, labels))
+            if not by_width:
+                return
+            frames = []
+            for batches in by_width.values():
+                timestamps, user_ids, model_versions, features, labels = zip(*batches)
+                frames.append(encode_frame(np.concatenate(timestamps), [user_id for ids in user_ids for user_id in ids],
+                                           np.concatenate(model_versions), np.vstack(features),
+                                           np.concatenate(labels)))
+                PREDICTIONS_LOGGED.inc(sum(len(batch_labels) for batch_labels in labels))
+            log_file = self._current_file()
+            log_file.write(b"".join(frames))
+            log_file.flush()
+            if log_file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _current_file(self):
+        if self._file is None:
+            os.makedirs(self.directory_path, exist_ok=True)
+            name = f"{LOG_FILE_PREFIX}{time.time_ns():020d}{LOG_FILE_SUFFIX}"
+            self._file = open(os.path.join(self.directory_path, name), 'ab')
+        return self._file
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for path in log_files(self.directory_path)[:-self.max_files or None]:
+            os.remove(path)
+
+    def close(self, timeout=None):
+        """
+        Stops the writer, writes what is still queued and closes the file.
+        """
+        if not self._closed:
+            self._closed = True
+            self._stop_lock.release()
+            self._running_lock.acquire(timeout=-1 if timeout is None else timeout)
+        self.flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def log_files(directory_path):
+    """
+    The log files in a directory, oldest first.
+    """
+    if not os.path.isdir(directory_path):
+        return []
+    return [os.path.join(directory_path, name) for name in sorted(os.listdir(directory_path))
+            if name.startswith(LOG_FILE_PREFIX) and name.endswith(LOG_FILE_SUFFIX)]
+
+
+def read_predictions(directory_path, user_id=None, since=None, until=None, emotion=None):
+    """
+    Yields the logged predictions matching every given filter as batches of column arrays:
+    "timestamp" (nanoseconds since the epoch), "user_id", "model_version", "label" and "features".
+
+    Args:
+        since, until (datetime.datetime, optional): Bounds on the prediction time, inclusive.
+        emotion (str, optional): Only predictions of this emotion.
+    """
+    since_ns = int(since.timestamp() * 1e9) if since is not None else None
+    until_ns = int(until.timestamp() * 1e9) if until is not None else None
+    label = EMOTION_TO_LABEL.get(emotion) if emotion is not None else None
+    for path in log_files(directory_path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        for batch in decode_frames(data):
+            keep = np.ones(len(batch['label']), dtype=bool)
+            if user_id is not None:
+                keep &= batch['user_id'] == str(user_id)
+            if since_ns is not None:
+                keep &= batch['timestamp'] >= since_ns
+            if until_ns is not None:
+                keep &= batch['timestamp'] <= until_ns
+            if emotion is not None:
+                keep &= batch['label'] == label
+            if keep.any():
+                yield {name: column[keep] for name, column in batch.items()}
+
+
+def _parse_time(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+# The process-wide log the models write to, if PREDICTION_LOG_DIR is set
+PREDICTION_LOG = PredictionLog(PREDICTION_LOG_DIR) if PREDICTION_LOG_DIR else None
+if PREDICTION_LOG is not None:
+    atexit.register(PREDICTION_LOG.close)
+
+
+def log_predictions(user_id, model_version, features, labels):
+    """
+    Queues predictions on the process-wide log; does nothing if PREDICTION_LOG_DIR is not set.
+    """
+    if PREDICTION_LOG is not None:
+        PREDICTION_LOG.log(user_id, model_version, features, labels)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a prediction log written with PREDICTION_LOG_DIR.")
+    parser.add_argument("directory", nargs="?", default=PREDICTION_LOG_DIR or "prediction-log",
+                        help="Directory of prediction log files.")
+    parser.add_argument("--user-id", default=None, help="Only predictions of this user's model.")
+    parser.add_argument("--since", default=None, help="Only predictions at or after this ISO time.")
+    parser.add_argument("--until", default=None, help="Only predictions at or before this ISO time.")
+    parser.add_argument("--emotion", default=None, help="Only predictions of this emotion.")
+    parser.add_argument("--limit", type=int, default=None, help="Print at most this many predictions.")
+    parser.add_argument("--summary", action="store_true", help="Print counts per user and emotion instead.")
+    args = parser.parse_args()
+
+    batches = read_predictions(args.directory, args.user_id, _parse_time(args.since), _parse_time(args.until),
+                               args.emotion)
+    if args.summary:
+        counts = {}
+        for batch in batches:
+            for user_id, label in zip(batch['user_id'], batch['label']):
+                emotions = counts.setdefault(user_id, {})
+                emotion = LABEL_TO_EMOTION.get(int(label), 'Undefined')
+                emotions[emotion] = emotions.get(emotion, 0) + 1
+        print(json.dumps(counts, indent=2))
+    else:
+        printed = 0
+        for batch in batches:
+            for row in range(len(batch['label'])):
+                if args.limit is not None and printed >= args.limit:
+                    break
+                timestamp = datetime.datetime.fromtimestamp(batch['timestamp'][row] / 1e9, datetime.timezone.utc)
+                print(json.dumps({"Timestamp": timestamp.isoformat(), "User ID": batch['user_id'][row],
+                                  "Model Version": int(batch['model_version'][row]),
+                                  "Predicted Emotion": LABEL_TO_EMOTION.get(int(batch['label'][row]), 'Undefined'),
+                                  "Features": batch['features'][row].tolist()}))
+                printed += 1
@@ -0,0 +1,164 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import numpy as np
+
+from physiological_data import PhysiologicalData
+
+MANIFEST_FILENAME = 'user-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def default_manifest_path(directory_path):
+    return os.path.join(directory_path, MANIFEST_FILENAME)
+
+
+def file_fingerprint(file_path, chunk_size=1 << 20):
+    """
+    Returns the size, modification time and SHA-256 hash of a file.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        dict: The fingerprint with 'size', 'mtime_ns' and 'sha256' keys.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and '__datetime__' in value:
+        return datetime.datetime.fromisoformat(value['__datetime__'])
+    return value
+
+
+def encode_profile(profile):
+    return {key: _encode_value(value) for key, value in profile.items()}
+
+
+def decode_profile(profile):
+    return {key: _decode_value(value) for key, value in profile.items()}
+
+
+def build_manifest_entry(file_path, data_loader):
+    """
+    Parses one workbook into its manifest entry, or returns None if a required sheet is missing.
+    """
+    parsed = data_loader._load_workbook(file_path)
+    if parsed is None:
+        return None
+    user_profile, physiological_data = parsed
+    label_histogram = PhysiologicalData.from_samples(physiological_data).label_histogram()
+    return {
+        'file': os.path.basename(file_path),
+        'fingerprint': file_fingerprint(file_path),
+        'profile': encode_profile(user_profile),
+        'row_count': len(physiological_data),
+        'label_histogram': dict(sorted(label_histogram.items())),
+    }
+
+
+def build_manifest(directory_path, update_progress=None):
+    """
+    Scans a user directory once and builds the manifest of every user's parsed profile,
+    row count, label histogram and source-file fingerprint.
+
+    Args:
+        directory_path (str): Path to the directory containing user workbooks.
+
+    Returns:
+        dict: The manifest.
+    """
+    if not os.path.exists(directory_path):
+        raise FileNotFoundError(f"Directory '{directory_path}' does not exist.")
+    from user_data_loader import UserDataLoader
+
+    update_progress = update_progress or (lambda stage, details=None: None)
+    data_loader = UserDataLoader(directory_path, update_progress=update_progress)
+
+    entries = []
+    update_progress("Building User Manifest", {"file": "profile_manifest.py", "function": "build_manifest"})
+    for filename in sorted(os.listdir(directory_path)):
+        if not filename.endswith('.xlsx'):
+            continue
+        entry = build_manifest_entry(os.path.join(directory_path, filename), data_loader)
+        if entry is None:
+            update_progress(f"Skipping file due to missing data: {filename}")
+            continue
+        entries.append(entry)
+        update_progress(f"Indexed file: {filename}", {"file": "profile_manifest.py", "function": "build_manifest",
+                                                      "data_points": f"{entry['row_count']}"})
+
+    return {
+        'version': MANIFEST_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'users': entries,
+    }
+
+
+def write_manifest(manifest, manifest_path):
+    """
+    Writes the manifest atomically, so readers never see a partially written file.
+    """
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file, separators=(',', ':'))
+    os.replace(temp_path, manifest_path)
+
+
+def read_manifest(manifest_path):
+    """
+    Reads a manifest written by `write_manifest`.
+
+    Raises:
+        ValueError: If the manifest was written by an incompatible version.
+    """
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version {manifest.get('version')} in '{manifest_path}'.")
+    return manifest
+
+
+def stale_entries(manifest, directory_path):
+    """
+    Returns the files that were added, modified or removed since the manifest was built,
+    judged by size and modification time.
+    """
+    indexed = {entry['file']: entry['fingerprint'] for entry in manifest['users']}
+    current = {filename for filename in os.listdir(directory_path) if filename.endswith('.xlsx')}
+    stale = sorted(current - set(indexed)) + sorted(set(indexed) - current)
+    for filename in sorted(current & set(indexed)):
+        stat = os.stat(os.path.join(directory_path, filename))
+        if (stat.st_size, stat.st_mtime_ns) != (indexed[filename]['size'], indexed[filename]['mtime_ns']):
+            stale.append(filename)
+    return stale
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the profile manifest for a user directory.")
+    parser.add_argument("directory", nargs="?", default="sample-users", help="Directory containing user workbooks.")
+    parser.add_argument("--output", default=None, help=f"Manifest path (default: <directory>/{MANIFEST_FILENAME}).")
+    args = parser.parse_args()
+
+    output_path = args.output or default_manifest_path(args.directory)
+    manifest = build_manifest(args.directory, update_progress=lambda stage, details=None: print(stage))
+    write_manifest(manifest, output_path)
+    print(f"Wrote {len(manifest['users'])} users to {output_path}")
@@ -0,0 +1,171 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# The profiler active on the current thread, if any; stages on other threads are not attributed
+_local = threading.local()
+
+# Job ids name the report files, so they may not contain path separators or dots
+JOB_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+
+# tracemalloc is process-wide: a second profiled run would reset the first's peaks and stop its tracing
+_active_run = threading.Lock()
+
+
+def current_profiler():
+    return getattr(_local, 'profiler', None)
+
+
+class RunProfiler:
+    """
+    Profiles a single analysis run with cProfile and per-stage tracemalloc measurements.
+
+    On exit it writes, into `output_dir`:
+        <job_id>.prof         cProfile stats, loadable with pstats or snakeviz
+        <job_id>-cpu.txt      The top functions by cumulative time
+        <job_id>-memory.json  Peak and net traced memory for each pipeline stage
+
+    tracemalloc is process-wide, so only one run is profiled at a time and entering a second
+    raises RuntimeError. Memory figures still include allocations made by concurrently running,
+    unprofiled jobs.
+
+    Raises:
+        ValueError: If the job id is not made of letters, digits, '_' and '-'.
+    """
+    def __init__(self, job_id, output_dir='profiles', top_allocations=10, top_functions=40):
+        self.job_id = str(job_id)
+        if not JOB_ID_PATTERN.fullmatch(self.job_id):
+            raise ValueError(f"Invalid job id '{self.job_id}': use letters, digits, '_' and '-' only.")
+        self.output_dir = output_dir
+        self.top_allocations = top_allocations
+        self.top_functions = top_functions
+        self.stages = []
+        self.paths = {}
+        self._stack = []
+        self._cpu_profiler = None
+        self._started_tracemalloc = False
+        self._start_time = None
+
+    def __enter__(self):
+        if current_profiler() is not None:
+            raise RuntimeError("A profiler is already active on this thread.")
+        if not _active_run.acquire(blocking=False):
+            raise RuntimeError("Another run is being profiled; only one profiled run is allowed at a time.")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        _local.profiler = self
+        self._start_time = time.perf_counter()
+        self._cpu_profiler = cProfile.Profile()
+        self._cpu_profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cpu_profiler.disable()
+        duration = time.perf_counter() - self._start_time
+        _, peak = tracemalloc.get_traced_memory()
+        _local.profiler = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        try:
+            self._write_reports(duration, peak, failed=exc_type is not None)
+        finally:
+            _active_run.release()
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        if self._stack:
+            # Fold the parent's peak so far in before resetting it for this stage
+            self._stack[-1]['peak_bytes'] = max(self._stack[-1]['peak_bytes'], tracemalloc.get_traced_memory()[1])
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        entry = {'stage': name, 'start_bytes': current, 'peak_bytes': current, 'start': time.perf_counter()}
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self._stack.pop()
+            entry['peak_bytes'] = max(entry['peak_bytes'], peak)
+            if self._stack:
+                self._stack[-1]['peak_bytes'] = max(self._stack[-1]['peak_bytes'], entry['peak_bytes'])
+            self.stages.append({
+                'stage': name,
+                'duration_seconds': time.perf_counter() - entry['start'],
+                'peak_bytes': entry['peak_bytes'],
+                'peak_above_start_bytes': entry['peak_bytes'] - entry['start_bytes'],
+                'net_bytes': current - entry['start_bytes'],
+                'top_allocations': self._top_allocations(),
+            })
+
+    def _top_allocations(self):
+        if not self.top_allocations:
+            return []
+        # Keep the snapshot's own cost out of the CPU profile
+        self._cpu_profiler.disable()
+        try:
+            statistics = tracemalloc.take_snapshot().statistics('lineno')
+        finally:
+            self._cpu_profiler.enable()
+        return [{'location': str(stat.traceback), 'size_bytes': stat.size, 'count': stat.count}
+                for stat in statistics[:self.top_allocations]]
+
+    def peak_by_stage(self):
+        """
+        Returns the highest peak memory seen for each stage name across all of its invocations.
+        """
+        summary = {}
+        for record in self.stages:
+            item = summary.setdefault(record['stage'], {'calls': 0, 'duration_seconds': 0.0, 'peak_bytes': 0})
+            item['calls'] += 1
+            item['duration_seconds'] += record['duration_seconds']
+            item['peak_bytes'] = max(item['peak_bytes'], record['peak_bytes'])
+        return summary
+
+    def _write_reports(self, duration, peak, failed):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, self.job_id)
+
+        self.paths['cpu_profile'] = f"{base}.prof"
+        self._cpu_profiler.dump_stats(self.paths['cpu_profile'])
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self._cpu_profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.top_functions)
+        self.paths['cpu_report'] = f"{base}-cpu.txt"
+        with open(self.paths['cpu_report'], 'w') as file:
+            file.write(stream.getvalue())
+
+        self.paths['memory_report'] = f"{base}-memory.json"
+        report = {
+            'job_id': self.job_id,
+            'failed': failed,
+            'duration_seconds': duration,
+            'peak_bytes': peak,
+            'peak_by_stage': self.peak_by_stage(),
+            'stages': self.stages,
+        }
+        with open(self.paths['memory_report'], 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+@contextmanager
+def profile_stage(name):
+    """
+    Attributes a pipeline stage to the profiler active on this thread. A no-op otherwise.
+    """
+    profiler = current_profiler()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
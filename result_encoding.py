@@ -0,0 +1,42 @@
+import gzip
+import json
+import os
+
+# "json" emits payloads as they are; "gzip" sends large payloads as one compressed binary attachment
+PAYLOAD_ENCODINGS = ('json', 'gzip')
+
+# Payloads smaller than this are sent uncompressed even with "gzip", where compression would not pay off
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 16 * 1024))
+
+
+def encode_payload(payload, encoding='json', min_bytes=COMPRESSION_MIN_BYTES):
+    """
+    Encodes a SocketIO event payload.
+
+    With "gzip", a payload whose compact JSON is at least `min_bytes` long is replaced by
+    {"encoding": "gzip", "data": <bytes>}, which SocketIO sends as a binary attachment instead of text.
+
+    Args:
+        payload (dict): The event payload.
+        encoding (str): One of PAYLOAD_ENCODINGS.
+
+    Returns:
+        dict: The payload to emit.
+    """
+    if encoding not in PAYLOAD_ENCODINGS:
+        raise ValueError(f"Unknown payload encoding '{encoding}'. Expected one of {PAYLOAD_ENCODINGS}.")
+    if encoding == 'json':
+        return payload
+    body = json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+    if len(body) < min_bytes:
+        return payload
+    return {'encoding': 'gzip', 'data': gzip.compress(body, compresslevel=6)}
+
+
+def decode_payload(message):
+    """
+    Reverses `encode_payload` on the receiving side.
+    """
+    if isinstance(message, dict) and message.get('encoding') == 'gzip':
+        return json.loads(gzip.decompress(message['data']).decode('utf-8'))
+    return message
@@ -0,0 +1,97 @@
+import os
+from collections import deque
+
+# SocketIO transport model: 'threading' for local development, 'gevent' for production, where every
+# connection is a greenlet and idle dashboards cost a few kilobytes instead of an OS thread.
+ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+
+# Native threads available to CPU-bound analysis jobs in the async modes
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', os.cpu_count() or 1))
+
+# Engine.IO heartbeat settings; longer intervals make idle connections cheaper to keep open
+PING_INTERVAL = int(os.environ.get('SOCKETIO_PING_INTERVAL', 25))
+PING_TIMEOUT = int(os.environ.get('SOCKETIO_PING_TIMEOUT', 20))
+
+
+def is_async_mode(async_mode=None):
+    return (async_mode or ASYNC_MODE) != 'threading'
+
+
+def configure_worker_pool(async_mode=None, workers=None):
+    """
+    Sizes the native thread pool that `offload` runs analysis jobs on.
+    """
+    async_mode = async_mode or ASYNC_MODE
+    workers = workers or ANALYSIS_WORKERS
+    if async_mode.startswith('gevent'):
+        import gevent
+        gevent.get_hub().threadpool.maxsize = workers
+    elif async_mode == 'eventlet':
+        os.environ.setdefault('EVENTLET_THREADPOOL_SIZE', str(workers))
+
+
+def offload(func, *args, async_mode=None, **kwargs):
+    """
+    Runs CPU-bound work off the event loop and returns its result.
+
+    In the gevent and eventlet modes the call runs on a native thread from the hub's thread pool
+    while only the calling greenlet waits, so the loop keeps serving other connections. In the
+    threading mode the caller is already a native thread and the function is called directly.
+    """
+    async_mode = async_mode or ASYNC_MODE
+    if async_mode.startswith('gevent'):
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
+class EventBridge:
+    """
+    Forwards SocketIO events produced on a native worker thread to the event loop.
+
+    Greenlet-based servers must not be driven from native threads, so in the async modes `emit`
+    only appends to a deque (safe without locks) and a background task on the loop drains it.
+    In the threading mode events are emitted directly.
+    """
+    def __init__(self, socketio, async_mode=None, poll_interval=0.05):
+        self.socketio = socketio
+        self.async_mode = async_mode or ASYNC_MODE
+        self.poll_interval = poll_interval
+        self._events = deque()
+        self._closed = False
+        self._task = None
+
+    def start(self):
+        if is_async_mode(self.async_mode):
+            self._task = self.socketio.start_background_task(self._drain)
+        return self
+
+    def emit(self, event, payload):
+        if is_async_mode(self.async_mode):
+            self._events.append((event, payload))
+        else:
+            self.socketio.emit(event, payload)
+
+    def _flush(self):
+        while self._events:
+            event, payload = self._events.popleft()
+            self.socketio.emit(event, payload)
+
+    def _drain(self):
+        while not self._closed:
+            self._flush()
+            self.socketio.sleep(self.poll_interval)
+        self._flush()
+
+    def close(self):
+        """
+        Stops the drain task once every queued event has been emitted. Call it from the loop.
+        """
+        self._closed = True
+        if self._task is not None:
+            self._task.join()
+            self._task = None
+        self._flush()
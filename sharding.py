@@ -0,0 +1,374 @@
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import pickle
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from emotion_analysis import EmotionAnalysis
+from main import calculate_similarity_score, find_valence_range, pipeline_stage, score_threshold
+from profile_manifest import decode_profile, default_manifest_path, encode_profile, read_manifest
+from user import User
+from user_data_loader import UserDataLoader
+from training_coordinator import TRAINING_COORDINATOR
+
+
+def shard_for(filename, shard_count):
+    """
+    Assigns a user workbook to a shard by a stable hash of its file name.
+    """
+    return zlib.crc32(filename.encode('utf-8')) % shard_count
+
+
+class Shard:
+    """
+    Holds the users of one partition of a user directory and answers coordinator requests.
+
+    Requests and responses are plain dicts of JSON-compatible values, so the same protocol works
+    in-process, over a pipe to a worker process or over HTTP to another node:
+
+        {'op': 'info'}
+        {'op': 'score', 'profile': {...}, 'offset': 0, 'limit': 32}
+        {'op': 'count', 'file': ..., 'limit': ...}
+        {'op': 'train_predict', 'file': ..., 'data_count': ..., 'samples': [...], 'matched_keys': [...]}
+    """
+    def __init__(self, directory_path, shard_index=0, shard_count=1, update_progress=None):
+        self.directory_path = directory_path
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.update_progress = update_progress or (lambda stage, details=None: None)
+        self.data_loader = UserDataLoader(directory_path, update_progress=self.update_progress)
+        self.users = self._load_users()
+        self._score_cache = (None, None)
+        self._lock = threading.Lock()
+
+    def _owns(self, filename):
+        return shard_for(filename, self.shard_count) == self.shard_index
+
+    def _load_users(self):
+        users = {}
+        manifest_path = default_manifest_path(self.directory_path)
+        if os.path.isfile(manifest_path):
+            for entry in read_manifest(manifest_path)['users']:
+                if self._owns(entry['file']):
+                    file_path = os.path.join(self.directory_path, entry['file'])
+                    users[entry['file']] = User(decode_profile(entry['profile']),
+                                                data_source=lambda nrows=None, path=file_path: self.data_loader.load_physiological_data(path, nrows),
+                                                data_count=entry['row_count'])
+            return users
+
+        for filename in sorted(os.listdir(self.directory_path)):
+            if filename.endswith('.xlsx') and self._owns(filename):
+                file_path = os.path.join(self.directory_path, filename)
+                user_profile = self.data_loader.load_user_profile(file_path)
+                if user_profile is not None:
+                    users[filename] = User(user_profile,
+                                           data_source=lambda nrows=None, path=file_path: self.data_loader.load_physiological_data(path, nrows))
+        return users
+
+    def handle(self, request):
+        op = request.get('op')
+        if op == 'info':
+            return {'shard_index': self.shard_index, 'shard_count': self.shard_count, 'users': len(self.users)}
+        if op == 'score':
+            return self._score(request['profile'], request.get('offset', 0), request.get('limit', 32))
+        if op == 'count':
+            user = self.users[request['file']]
+            limit = request.get('limit')
+            return {'data_count': user.data_count if limit is None else user.data_count_within(limit)}
+        if op == 'train_predict':
+            return self._train_predict(request['file'], request['data_count'], request['samples'],
+                                       request.get('matched_keys', []))
+        raise ValueError(f"Unknown shard operation '{op}'.")
+
+    def _ranked(self, profile):
+        key = json.dumps(profile, sort_keys=True, default=str)
+        with self._lock:
+            cached_key, ranked = self._score_cache
+            if cached_key == key:
+                return ranked
+        # Ties are broken by file name, the order a single process loads users in
+        ranked = sorted(((calculate_similarity_score(user.profile, profile), filename)
+                         for filename, user in self.users.items()), key=lambda item: (-item[0], item[1]))
+        with self._lock:
+            self._score_cache = (key, ranked)
+        return ranked
+
+    def _score(self, profile, offset, limit):
+        """
+        Returns one page of this shard's users ranked by similarity to the profile.
+        """
+        ranked = self._ranked(profile)
+        page = ranked[offset:offset + limit]
+        candidates = []
+        for score, filename in page:
+            user = self.users[filename]
+            # Row counts are sent when known without loading data; otherwise the coordinator asks with 'count'
+            candidates.append({'file': filename, 'user_id': user.profile.get('unique-id'), 'score': score,
+                               'data_count': user.known_data_count})
+        return {'candidates': candidates, 'exhausted': offset + limit >= len(ranked)}
+
+    def _train_predict(self, filename, data_count, samples, matched_keys):
+        user = self.users[filename]
+        # A model trained on a different number of rows is replaced, not extended, and concurrent
+        # requests for the same rows share one fit
+        model, _ = TRAINING_COORDINATOR.train(user, data_count, update_progress=self.update_progress)
+        # The returned model, since a concurrent request may have put another on the shared User
+        predictions = EmotionAnalysis.make_predictions_for_user(user, samples, model=model)
+        matched_features = {k: user.profile[k] for k in matched_keys if k in user.profile}
+        return {'user_id': user.profile.get('unique-id'), 'matched_features': encode_profile(matched_features),
+                'predictions': predictions}
+
+
+class LocalTransport:
+    """
+    In-process stand-in for a remote shard. Requests and responses are round-tripped through pickle
+    so tests exercise the same serialization boundary as the process and HTTP transports.
+    """
+    def __init__(self, shard):
+        self.shard = shard
+
+    def request(self, message):
+        response = self.shard.handle(pickle.loads(pickle.dumps(message)))
+        return pickle.loads(pickle.dumps(response))
+
+    def close(self):
+        pass
+
+
+def _shard_process(connection, directory_path, shard_index, shard_count):
+    shard = Shard(directory_path, shard_index, shard_count)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        try:
+            connection.send({'ok': True, 'response': shard.handle(message)})
+        except Exception as e:
+            connection.send({'ok': False, 'error': str(e)})
+    connection.close()
+
+
+class ProcessTransport:
+    """
+    Runs a shard in a dedicated worker process and talks to it over a pipe.
+    """
+    def __init__(self, directory_path, shard_index, shard_count):
+        context = multiprocessing.get_context('spawn')
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_shard_process,
+                                        args=(child_connection, directory_path, shard_index, shard_count),
+                                        daemon=True)
+        self._process.start()
+        self._lock = threading.Lock()
+
+    def request(self, message):
+        with self._lock:
+            self._connection.send(message)
+            reply = self._connection.recv()
+        if not reply['ok']:
+            raise RuntimeError(f"Shard request failed: {reply['error']}")
+        return reply['response']
+
+    def close(self):
+        with self._lock:
+            self._connection.send(None)
+        self._process.join(timeout=5)
+
+
+class HttpTransport:
+    """
+    Talks to a shard served on another node by `python sharding.py serve`.
+    """
+    def __init__(self, url, timeout=300):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, message):
+        import requests
+        response = requests.post(f"{self.url}/shard", json=message, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        pass
+
+
+class ShardCoordinator:
+    """
+    Scatters a request to every shard and gathers the results.
+
+    Matching merges the shards' ranked pages lazily, fetching further pages only from shards whose
+    page ran out, and walks the merged order with the same threshold and data limit rules as
+    find_most_suitable_user. Training and prediction then run on the shards owning the selected users.
+    """
+    def __init__(self, transports, page_size=32):
+        self.transports = list(transports)
+        self.page_size = page_size
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.transports)))
+
+    def _scatter(self, make_request):
+        futures = [self._executor.submit(transport.request, make_request(index))
+                   for index, transport in enumerate(self.transports)]
+        return [future.result() for future in futures]
+
+    def _merged_candidates(self, profile):
+        # Yields (score, file, shard index) in global rank order, paging each shard on demand
+        offsets = [0] * len(self.transports)
+        pages = self._scatter(lambda index: {'op': 'score', 'profile': profile, 'offset': 0, 'limit': self.page_size})
+        heap = []
+        buffers = []
+        for index, page in enumerate(pages):
+            buffers.append((list(page['candidates']), page['exhausted']))
+            offsets[index] = len(page['candidates'])
+            if page['candidates']:
+                first = page['candidates'][0]
+                heapq.heappush(heap, (-first['score'], first['file'], index))
+
+        positions = [0] * len(self.transports)
+        while heap:
+            _, _, index = heapq.heappop(heap)
+            candidates, exhausted = buffers[index]
+            candidate = candidates[positions[index]]
+            positions[index] += 1
+            yield candidate, index
+
+            if positions[index] == len(candidates) and not exhausted:
+                page = self.transports[index].request({'op': 'score', 'profile': profile,
+                                                       'offset': offsets[index], 'limit': self.page_size})
+                candidates, exhausted = list(page['candidates']), page['exhausted']
+                buffers[index] = (candidates, exhausted)
+                positions[index] = 0
+                offsets[index] += len(candidates)
+            if positions[index] < len(candidates):
+                following = candidates[positions[index]]
+                heapq.heappush(heap, (-following['score'], following['file'], index))
+
+    def find_most_suitable_users(self, provided_user_details, data_limit=30000, update_progress=None):
+        """
+        Reproduces find_most_suitable_user's global selection across the shards.
+
+        Returns:
+            list: Tuples of (shard index, candidate dict, score, data count).
+        """
+        update_progress = update_progress or (lambda stage, details=None: None)
+        threshold = score_threshold(data_limit)
+        update_progress("Finding Suitable Users", {"file": "sharding.py", "function": "find_most_suitable_users",
+                                                   "shards": len(self.transports)})
+
+        top_users = []
+        total_data_count = 0
+        first = None
+        for candidate, index in self._merged_candidates(provided_user_details):
+            if first is None:
+                first = (candidate, index)
+            if total_data_count >= data_limit or candidate['score'] <= threshold:
+                break
+            row_count = candidate.get('data_count')
+            if row_count is None:
+                row_count = self._row_count(index, candidate['file'], data_limit - total_data_count)
+            if row_count == 0:
+                continue
+            user_data_count = min(row_count, data_limit - total_data_count)
+            top_users.append((index, candidate, candidate['score'], user_data_count))
+            total_data_count += user_data_count
+            update_progress("Added Top User", {"file": "sharding.py", "function": "find_most_suitable_users",
+                                               "user_id": candidate['user_id'], "score": candidate['score'],
+                                               "data_count": user_data_count, "shard": index})
+
+        if not top_users and first is not None:
+            candidate, index = first
+            row_count = candidate.get('data_count')
+            if row_count is None:
+                row_count = self._row_count(index, candidate['file'], data_limit)
+            top_users.append((index, candidate, candidate['score'], min(row_count, data_limit)))
+            update_progress("Added Closest Match", {"file": "sharding.py", "function": "find_most_suitable_users",
+                                                    "user_id": candidate['user_id'], "score": candidate['score'],
+                                                    "shard": index})
+
+        update_progress("Suitable Users Found", {"file": "sharding.py", "function": "find_most_suitable_users",
+                                                 "total_suitable_users": len(top_users)})
+        return top_users
+
+    def _row_count(self, shard_index, filename, limit=None):
+        # With a limit, the shard reads at most that many rows to count them
+        return self.transports[shard_index].request({'op': 'count', 'file': filename, 'limit': limit})['data_count']
+
+    def analyze(self, provided_user_details, user_predictions_list, data_limit=30000, update_progress=None):
+        """
+        Runs the full analysis across the shards and returns results shaped like get_analysis_results.
+        """
+        update_progress = update_progress or (lambda stage, details=None: None)
+        with pipeline_stage('profile_match'):
+            selected = self.find_most_suitable_users(provided_user_details, data_limit, update_progress=update_progress)
+
+        with pipeline_stage('shard_train_predict'):
+            futures = [self._executor.submit(self.transports[index].request, {
+                'op': 'train_predict', 'file': candidate['file'], 'data_count': data_count,
+                'samples': user_predictions_list, 'matched_keys': list(provided_user_details)})
+                for index, candidate, score, data_count in selected]
+            responses = [future.result() for future in futures]
+
+        results = []
+        for response in responses:
+            user_result = {"User ID": response['user_id'],
+                           "Matched Features": decode_profile(response['matched_features']),
+                           "Predictions": []}
+            for sample, prediction in zip(user_predictions_list, response['predictions']):
+                sample_with_prediction = dict(sample)
+                sample_with_prediction["Predicted Emotion"] = prediction
+                sample_with_prediction["Valence Range"] = list(find_valence_range(prediction))
+                user_result["Predictions"].append(sample_with_prediction)
+            results.append(user_result)
+        update_progress("Analysis Complete", {"file": "sharding.py", "function": "analyze"})
+        return results
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+        self._executor.shutdown(wait=False)
+
+
+def local_coordinator(directory_path, shard_count, processes=False, page_size=32):
+    """
+    Builds a coordinator over `shard_count` shards of a directory, in-process or one process per shard.
+    """
+    if processes:
+        transports = [ProcessTransport(directory_path, index, shard_count) for index in range(shard_count)]
+    else:
+        transports = [LocalTransport(Shard(directory_path, index, shard_count)) for index in range(shard_count)]
+    return ShardCoordinator(transports, page_size=page_size)
+
+
+def create_shard_app(shard):
+    """
+    Wraps a shard in a Flask app exposing the protocol at POST /shard.
+    """
+    from flask import Flask, jsonify, request
+
+    shard_app = Flask(__name__)
+
+    @shard_app.route('/shard', methods=['POST'])
+    def handle_shard_request():
+        try:
+            return jsonify(shard.handle(request.json))
+        except (KeyError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+    return shard_app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve one shard of a user directory.")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--directory", default="sample-users", help="Directory containing user workbooks.")
+    parser.add_argument("--shard-index", type=int, required=True)
+    parser.add_argument("--shard-count", type=int, required=True)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5100)
+    args = parser.parse_args()
+
+    create_shard_app(Shard(args.directory, args.shard_index, args.shard_count)).run(host=args.host, port=args.port)
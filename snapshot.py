@@ -0,0 +1,174 @@
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+import joblib
+import sklearn
+
+from coreset import cached_coresets, restore_coresets
+from metrics import REGISTRY
+from neighbor_index import cached_sample_indexes, restore_sample_indexes
+from physiological_data import PhysiologicalData
+from training_coordinator import TRAINING_COORDINATOR
+from user_data_loader import UserDataLoader, cached_sheets, restore_sheet
+
+# Bumped whenever the layout of the snapshot state changes; other versions are refused
+SNAPSHOT_VERSION = 2
+
+# Where the server restores its warm state from at start-up and writes it to on POST /snapshot
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH')
+
+# The user directory POST /snapshot writes, and the bearer token a client must present to trigger it;
+# without a token the endpoint is refused
+SNAPSHOT_DIRECTORY = os.environ.get('SNAPSHOT_DIRECTORY', 'sample-users')
+SNAPSHOT_TOKEN = os.environ.get('SNAPSHOT_TOKEN')
+
+SNAPSHOT_RESTORES = REGISTRY.counter('edith_snapshot_restores_total', 'Snapshot restores by outcome.', ('outcome',))
+
+
+def directory_fingerprint(directory_path):
+    """
+    The (mtime_ns, size) of every workbook in a directory, by file name, as the loader cache validates them.
+    """
+    fingerprint = {}
+    for filename in sorted(os.listdir(directory_path)):
+        if filename.endswith('.xlsx'):
+            stat = os.stat(os.path.join(directory_path, filename))
+            fingerprint[filename] = (stat.st_mtime_ns, stat.st_size)
+    return fingerprint
+
+
+def _pack(value):
+    # Objects pickled by scikit-learn are kept as bytes, so they are only unpickled once its version is checked
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def save_snapshot(directory_path, snapshot_path, coordinator=TRAINING_COORDINATOR):
+    """
+    Writes the warm state of a user directory to one file: the cached profile and data sheets, the
+    KD-tree indexes and coresets derived from that data, and the trained models fitted on it.
+
+    The file is an uncompressed joblib pickle, so its arrays can be memory-mapped on restore. The
+    models and KD-tree indexes are stored in it as separately pickled bytes. It is written to a
+    temporary file of its own first and moved into place, so readers never see a partial one and
+    concurrent writers do not interleave.
+
+    Returns:
+        dict: How many sheets, data sets and models were written.
+    """
+    datasets = []
+    dataset_ids = {}
+
+    def dataset_index(data):
+        if id(data) not in dataset_ids:
+            dataset_ids[id(data)] = len(datasets)
+            datasets.append({'features': data.features, 'labels': data.labels,
+                             'indexes': _pack(cached_sample_indexes(data)), 'coresets': cached_coresets(data)})
+        return dataset_ids[id(data)]
+
+    sheets = []
+    for filename, kind, signature, value in cached_sheets(directory_path):
+        sheet = {'file': filename, 'kind': kind, 'signature': tuple(signature)}
+        if isinstance(value, PhysiologicalData):
+            sheet['dataset'] = dataset_index(value)
+        else:
+            sheet['value'] = value
+        sheets.append(sheet)
+
+    # Only models fitted on data in the snapshot can be matched to it again
+    models = [{'key': key, 'model': _pack(model), 'dataset': dataset_ids[id(data)]}
+              for key, model, data in coordinator.trained_models() if id(data) in dataset_ids]
+
+    state = {
+        'version': SNAPSHOT_VERSION,
+        'sklearn_version': sklearn.__version__,
+        'created': time.time(),
+        'directory': os.path.abspath(directory_path),
+        'fingerprint': directory_fingerprint(directory_path),
+        'datasets': datasets,
+        'sheets': sheets,
+        'models': models,
+    }
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(snapshot_path)),
+                                                  prefix=f"{os.path.basename(snapshot_path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            joblib.dump(state, file)
+        os.replace(temporary_path, snapshot_path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return {'sheets': len(sheets), 'datasets': len(datasets), 'models': len(models)}
+
+
+def restore_snapshot(snapshot_path, directory_path=None, coordinator=TRAINING_COORDINATOR):
+    """
+    Restores a snapshot written by `save_snapshot` into the loader cache, the index and coreset
+    caches and the training coordinator.
+
+    Arrays are memory-mapped rather than read, so restoring costs little more than unpickling the
+    models. Every workbook is checked against the current directory: sheets and models of files
+    whose modification time or size changed since the snapshot are skipped and read again from the
+    workbook on first use. Models and indexes pickled by another scikit-learn version are skipped
+    without being unpickled, and built again when needed.
+
+    Args:
+        directory_path (str, optional): The directory to restore for; defaults to the one snapshotted.
+
+    Returns:
+        dict: The restored and stale files, the number of models restored and the seconds taken.
+    """
+    started = time.perf_counter()
+    state = joblib.load(snapshot_path, mmap_mode='r')
+    if not isinstance(state, dict) or state.get('version') != SNAPSHOT_VERSION:
+        SNAPSHOT_RESTORES.inc(outcome='incompatible')
+        raise ValueError(f"Snapshot '{snapshot_path}' is not a version {SNAPSHOT_VERSION} snapshot.")
+    directory_path = directory_path or state['directory']
+    current = directory_fingerprint(directory_path)
+    stale = {filename for filename, signature in state['fingerprint'].items() if current.get(filename) != signature}
+
+    datasets = [PhysiologicalData(dataset['features'], dataset['labels']) for dataset in state['datasets']]
+    restored = set()
+    live_datasets = set()
+    for sheet in state['sheets']:
+        if sheet['file'] in stale:
+            continue
+        value = datasets[sheet['dataset']] if 'dataset' in sheet else sheet['value']
+        restore_sheet(os.path.join(directory_path, sheet['file']), sheet['kind'], sheet['signature'], value)
+        restored.add(sheet['file'])
+        if 'dataset' in sheet:
+            live_datasets.add(sheet['dataset'])
+
+    compatible = state['sklearn_version'] == sklearn.__version__
+    for index in live_datasets:
+        if compatible:
+            restore_sample_indexes(datasets[index], pickle.loads(state['datasets'][index]['indexes']))
+        restore_coresets(datasets[index], state['datasets'][index]['coresets'])
+
+    models = 0
+    if compatible:
+        for entry in state['models']:
+            if entry['dataset'] in live_datasets:
+                coordinator.restore(entry['key'], pickle.loads(entry['model']), datasets[entry['dataset']])
+                models += 1
+
+    SNAPSHOT_RESTORES.inc(outcome='stale' if stale else 'fresh')
+    return {'restored_files': sorted(restored), 'stale_files': sorted(stale), 'models': models,
+            'seconds': round(time.perf_counter() - started, 4)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write or restore a snapshot of a user directory's warm state.")
+    parser.add_argument("command", choices=("save", "restore"))
+    parser.add_argument("snapshot", help="Snapshot file.")
+    parser.add_argument("--directory", default="sample-users", help="Directory containing user workbooks.")
+    args = parser.parse_args()
+
+    if args.command == "save":
+        # A fresh process has nothing cached yet; read every workbook so the snapshot holds them all
+        UserDataLoader(args.directory).load_users()
+        print(save_snapshot(args.directory, args.snapshot))
+    else:
+        print(restore_snapshot(args.snapshot, args.directory))
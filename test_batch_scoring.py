@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import unittest
+import joblib
+import numpy as np
+from batch_scoring import count_scored, iter_chunks, iter_samples, score_file, train_models
+from fixtures import write_user_workbook
+from user_data_loader import clear_workbook_cache
+from utilities import FEATURE_COLUMNS, LABEL_TO_EMOTION
+
+
+class TestBatchScoring(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, 'users')
+        os.makedirs(self.directory)
+        for i in range(2):
+            write_user_workbook(os.path.join(self.directory, f'U{i}.xlsx'), 100 + i,
+                                ['Happy', 'Sad', 'Calm', 'Angry'] * 10, gender='Female', age=30)
+
+        rng = np.random.default_rng(0)
+        self.features = rng.uniform(0, 100, (25, 6)).astype(np.float32)
+        self.input_path = os.path.join(self.temp_dir.name, 'samples.jsonl')
+        with open(self.input_path, 'w') as file:
+            file.write("# Archive export\n")
+            for row in self.features:
+                file.write(json.dumps(dict(zip(FEATURE_COLUMNS, row.tolist()))) + "\n")
+
+        self.models_path = os.path.join(self.temp_dir.name, 'models')
+        joblib.dump(train_models(self.directory, {'age': 30, 'gender': 'female'}, 30000,
+                                 lambda stage, details=None: None), self.models_path)
+        self.output_path = os.path.join(self.temp_dir.name, 'scores.jsonl')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read_output(self):
+        with open(self.output_path) as file:
+            return [json.loads(line) for line in file]
+
+    def test_streams_samples_in_chunks(self):
+        chunks = list(iter_chunks(iter_samples(self.input_path, offset=3), 10))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 2])
+        np.testing.assert_array_equal(chunks[0][0], self.features[3])
+
+        csv_path = os.path.join(self.temp_dir.name, 'samples.csv')
+        with open(csv_path, 'w') as file:
+            file.write(",".join(FEATURE_COLUMNS) + "\n1,2,3,4,5,6\n7,8,,10,11,12\n")
+        chunk, = iter_chunks(iter_samples(csv_path), 10)
+        np.testing.assert_array_equal(chunk[1], [7, 8, 0, 10, 11, 12])
+
+    def test_scores_every_sample_in_order(self):
+        self.assertEqual(score_file(self.input_path, self.output_path, self.models_path, chunk_size=4, workers=2), 25)
+        rows = self.read_output()
+        self.assertEqual([row["Offset"] for row in rows], list(range(25)))
+
+        models = joblib.load(self.models_path)
+        for (user_id, classifier), position in zip(models, range(2)):
+            expected = [LABEL_TO_EMOTION[label] for label in classifier.predict(self.features)]
+            self.assertEqual([row["Predictions"][position]["Predicted Emotion"] for row in rows], expected)
+            self.assertEqual(rows[0]["Predictions"][position]["User ID"], user_id)
+
+    def test_resumes_after_an_interrupted_run(self):
+        score_file(self.input_path, self.output_path, self.models_path, chunk_size=4, workers=1)
+        complete = self.read_output()
+        with open(self.output_path, 'r+') as file:
+            lines = file.readlines()
+            file.seek(0)
+            file.writelines(lines[:10])
+            file.write(lines[10][:15])  # Partial line, as left by a crash mid-write
+            file.truncate()
+
+        self.assertEqual(count_scored(self.output_path), 10)
+        self.assertEqual(score_file(self.input_path, self.output_path, self.models_path, chunk_size=4, workers=1), 25)
+        self.assertEqual(self.read_output(), complete)
+
+
+if __name__ == '__main__':
+    unittest.main()
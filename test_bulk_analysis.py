@@ -0,0 +1,81 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+from bulk_analysis import analyze_profiles, similarity_matrix
+from emotion_analysis import EmotionAnalysis
+from main import calculate_similarity_score, find_most_suitable_user
+from fixtures import write_user_workbook
+from user import User
+from user_data_loader import UserDataLoader, clear_workbook_cache
+
+SAMPLES = [{"heart-rate-bpm": 70, "breathing-rate-breaths-min": 15, "hrv-ms": 60, "skin-temp-c": 31,
+            "emg-mv": 0.2, "bvp-unit": 0.8},
+           {"heart-rate-bpm": 75, "breathing-rate-breaths-min": 15, "hrv-ms": 60, "skin-temp-c": 31,
+            "emg-mv": 0.2, "bvp-unit": 0.8}]
+
+
+class TestSimilarityMatrix(unittest.TestCase):
+    def test_matches_pairwise_scores(self):
+        users = [User({'unique-id': 1, 'age': 30, 'gender': 'Female', 'nationality': 'Canadian',
+                       'date-of-birth': datetime.datetime(1994, 3, 1)}),
+                 User({'unique-id': 2, 'age': 33, 'gender': 'male', 'nationality': None}),
+                 User({'unique-id': 3, 'age': '30', 'gender': 'FEMALE', 'smoking-habits': 'none'})]
+        profiles = [{'age': 30, 'gender': 'female', 'nationality': 'canadian'},
+                    {'age': 35, 'date-of-birth': datetime.datetime(1994, 9, 1, 12), 'smoking-habits': 'None'},
+                    {'gender': 7},
+                    {}]
+        scores = similarity_matrix(profiles, users)
+        self.assertEqual(scores.shape, (4, 3))
+        for i, profile in enumerate(profiles):
+            for j, user in enumerate(users):
+                self.assertAlmostEqual(scores[i, j], calculate_similarity_score(user.profile, profile))
+
+
+class TestAnalyzeProfiles(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        emotions = ['Happy', 'Sad', 'Calm', 'Angry'] * 60
+        write_user_workbook(os.path.join(self.temp_dir.name, 'A1.xlsx'), 4501, emotions, gender='Female', age=30)
+        write_user_workbook(os.path.join(self.temp_dir.name, 'B2.xlsx'), 4502, emotions, gender='Female', age=31)
+        write_user_workbook(os.path.join(self.temp_dir.name, 'C3.xlsx'), 4503, emotions, gender='Male', age=60)
+        self.users = UserDataLoader(self.temp_dir.name).load_user_profiles()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        clear_workbook_cache()
+
+    def test_selects_like_main_and_trains_each_model_once(self):
+        profile = {'age': 30, 'gender': 'female', 'nationality': 'Canadian'}
+        requests = [{'profile_id': 'a', 'user_profile': profile, 'user_predictions': SAMPLES},
+                    {'profile_id': 'b', 'user_profile': dict(profile), 'user_predictions': SAMPLES[:1]},
+                    {'user_profile': {'age': 60, 'gender': 'male'}, 'user_predictions': SAMPLES}]
+        original_train = EmotionAnalysis.train_user_model
+        with mock.patch.object(EmotionAnalysis, 'train_user_model', side_effect=original_train) as train:
+            results = analyze_profiles(self.users, requests, data_limit=1000)
+
+        quiet = lambda stage, details=None: None
+        distinct_models = set()
+        for request, result in zip(requests, results):
+            expected = find_most_suitable_user(request['user_profile'], self.users, 1000, quiet)
+            self.assertEqual([user_result['User ID'] for user_result in result['Results']],
+                             [user.profile['unique-id'] for user, score, data_count in expected])
+            distinct_models.update((user.profile['unique-id'], data_count) for user, score, data_count in expected)
+            for user_result in result['Results']:
+                self.assertEqual(len(user_result['Predictions']), len(request['user_predictions']))
+        self.assertEqual([result['Profile ID'] for result in results], ['a', 'b', 2])
+        fitted = [call.args[0].profile['unique-id'] for call in train.call_args_list]
+        self.assertEqual(len([user_id for user_id in fitted if user_id in (4501, 4502, 4503)]), len(distinct_models))
+        self.assertLess(len(distinct_models), sum(len(result['Results']) for result in results))
+
+    def test_columnar_results(self):
+        results = analyze_profiles(self.users, [{'user_profile': {'age': 30, 'gender': 'female'},
+                                                 'user_predictions': SAMPLES}], result_format='columnar')
+        self.assertEqual(results[0]['Results']['Format'], 'columnar')
+        self.assertEqual(len(results[0]['Results']['Users'][0]['Emotion Codes']), len(SAMPLES))
+
+
+if __name__ == '__main__':
+    unittest.main()
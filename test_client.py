@@ -14,6 +14,10 @@ def connect():
 def progress(data):
     print("Progress Update:", data)
 
+@sio.event
+def partial_result(data):
+    print("Partial Result:", data)
+
 @sio.event
 def completed(data):
     global analysis_completed
@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+from coreset import build_coreset, data_coreset, evaluate_coreset
+from emotion_statistics import compute_emotion_statistics
+from physiological_data import PhysiologicalData
+from user import User
+from training_coordinator import TrainingCoordinator
+from model_registry import ModelRegistry
+
+
+def make_redundant_data(rows=4000, seed=0):
+    # Few distinct states per emotion with small jitter, like long recordings of steady signals
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(1, 5, rows)
+    centres = np.array([[60, 12, 40, 30, 0.2, 0.6], [80, 16, 55, 32, 0.4, 0.9],
+                        [100, 20, 70, 34, 0.6, 1.2], [70, 22, 35, 31, 0.3, 1.0]])
+    features = centres[labels - 1] + rng.normal(0, 0.5, (rows, 6)) * [1, 0.2, 1, 0.1, 0.005, 0.01]
+    return PhysiologicalData(features, labels)
+
+
+class TestCoreset(unittest.TestCase):
+    def test_weights_preserve_counts_and_means(self):
+        data = make_redundant_data()
+        coreset = build_coreset(data)
+        self.assertLess(len(coreset) * 10, len(data))
+        self.assertEqual(coreset.weights.sum(), len(data))
+        self.assertEqual(coreset.source_rows, len(data))
+
+        full = compute_emotion_statistics(data.features, data.labels, percentiles=())
+        compressed = compute_emotion_statistics(coreset.data.features, coreset.data.labels, percentiles=(),
+                                                weights=coreset.weights)
+        self.assertEqual(compressed["samples"], full["samples"])
+        for emotion, statistics in full["emotions"].items():
+            self.assertEqual(compressed["emotions"][emotion]["count"], statistics["count"])
+            for signal, mean in statistics["mean"].items():
+                self.assertAlmostEqual(compressed["emotions"][emotion]["mean"][signal], mean, places=3)
+
+    def test_cached_per_data_object_and_row_count(self):
+        data = make_redundant_data()
+        self.assertIs(data_coreset(data, 1000), data_coreset(data, 1000))
+        self.assertEqual(data_coreset(data, 1000).source_rows, 1000)
+
+    def test_evaluation_reports_both_models(self):
+        report = evaluate_coreset(make_redundant_data())
+        self.assertLess(report["coreset"]["rows"] * 10, report["full"]["rows"])
+        self.assertLess(report["coreset"]["model_bytes"], report["full"]["model_bytes"])
+        self.assertGreater(report["coreset"]["accuracy"], report["full"]["accuracy"] - 0.05)
+
+    def test_coordinator_trains_weighted_model_separately(self):
+        coordinator = TrainingCoordinator(ModelRegistry(max_bytes=10 ** 9))
+        user = User({'unique-id': 46}, make_redundant_data())
+        quiet = lambda stage, details=None: None
+        full, _ = coordinator.train(user, 2000, update_progress=quiet)
+        compressed, trained_here = coordinator.train(user, 2000, update_progress=quiet, coreset=8)
+        self.assertTrue(trained_here)
+        self.assertIsNot(full, compressed)
+        self.assertLess(len(compressed.y), len(full.y))
+        self.assertEqual(sum(compressed.emotion_counter.values()), 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from data_limit_tuning import (default_tuning_path, learning_curve, read_tuning, recommend_rows, tune_directory,
+                               write_tuning)
+from main import main
+from physiological_data import PhysiologicalData
+from fixtures import SAMPLES, write_user_workbook
+from training_coordinator import TRAINING_COORDINATOR
+from user_data_loader import clear_workbook_cache
+
+
+class TestLearningCurve(unittest.TestCase):
+    def test_recommends_smallest_size_within_tolerance(self):
+        curve = [{"rows": 500, "accuracy": 0.70}, {"rows": 1000, "accuracy": 0.895},
+                 {"rows": 2000, "accuracy": 0.90}, {"rows": 4000, "accuracy": 0.899}]
+        self.assertEqual(recommend_rows(curve, tolerance=0.01), 1000)
+        self.assertEqual(recommend_rows(curve, tolerance=0.0), 2000)
+        self.assertIsNone(recommend_rows([]))
+
+    def test_curve_measures_every_size_up_to_the_training_split(self):
+        rng = np.random.default_rng(0)
+        labels = rng.integers(1, 4, 800)
+        features = labels[:, None] * 10 + rng.normal(0, 1, (800, 6))
+        curve = learning_curve(PhysiologicalData(features, labels), sizes=(100, 200, 5000))
+        self.assertEqual([point["rows"] for point in curve], [100, 200, 600])
+        for point in curve:
+            self.assertGreater(point["accuracy"], 0.9)
+            self.assertGreaterEqual(point["fit_seconds"], 0)
+
+    def test_curve_trains_on_prefixes_in_recorded_order(self):
+        features = np.arange(80, dtype=np.float32).repeat(6).reshape(80, 6)
+        labels = np.array([1, 2] * 40)
+        data = PhysiologicalData(features, labels)
+        with patch('data_limit_tuning.UserEmotionModel.train_model', autospec=True,
+                   side_effect=lambda model, X, y: model.emotion_model.fit(X, y)) as train_model:
+            learning_curve(data, sizes=(20,))
+        trained = [call.args[1] for call in train_model.call_args_list]
+        np.testing.assert_array_equal(trained[0], features[:20])
+        np.testing.assert_array_equal(trained[1], features[:60])
+
+
+class TestTunedDataLimit(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        for i in range(2):
+            write_user_workbook(os.path.join(self.temp_dir.name, f'U{i}.xlsx'), 480 + i,
+                                ['Happy', 'Sad', 'Calm', 'Angry'] * 10, gender='Female', age=30)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        clear_workbook_cache()
+
+    def trained_data_counts(self, data_limit):
+        with patch.object(TRAINING_COORDINATOR, 'train', wraps=TRAINING_COORDINATOR.train) as train:
+            main(self.temp_dir.name, data_limit, {'age': 30, 'gender': 'female'}, SAMPLES,
+                 emit_progress=lambda stage, details=None: None)
+        return sorted(call.args[1] for call in train.call_args_list)
+
+    def test_main_follows_the_tuning_only_without_a_data_limit(self):
+        tuning = tune_directory(self.temp_dir.name, sizes=(10, 20))
+        self.assertEqual(set(tuning['users']), {'480', '481'})
+        tuning['users']['480']['rows'] = 10
+        tuning['users'].pop('481')
+        tuning['cohort']['rows'] = 20
+        write_tuning(tuning, default_tuning_path(self.temp_dir.name))
+        self.assertEqual(read_tuning(default_tuning_path(self.temp_dir.name))['users']['480']['rows'], 10)
+
+        self.assertEqual(self.trained_data_counts(None), [10, 20])
+        self.assertEqual(self.trained_data_counts(30000), [40, 40])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import time
+import unittest
+from directory_sync import DirectorySync
+from profile_manifest import read_manifest
+from fixtures import write_user_workbook
+from user_data_loader import clear_workbook_cache
+
+
+class TestDirectorySync(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.temp_dir.name
+        write_user_workbook(os.path.join(self.directory, 'A1.xlsx'), 111, ['Happy', 'Sad'])
+        write_user_workbook(os.path.join(self.directory, 'B2.xlsx'), 222, ['Calm'])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_scan_applies_added_modified_and_removed_files(self):
+        sync = DirectorySync(self.directory)
+        self.assertEqual(sync.scan(), (['A1.xlsx', 'B2.xlsx'], [], []))
+        self.assertEqual(sync.scan(), ([], [], []))
+
+        write_user_workbook(os.path.join(self.directory, 'B2.xlsx'), 333, ['Angry', 'Calm', 'Sad'])
+        os.utime(os.path.join(self.directory, 'B2.xlsx'), ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        os.remove(os.path.join(self.directory, 'A1.xlsx'))
+        write_user_workbook(os.path.join(self.directory, 'C3.xlsx'), 444, ['Joyful'])
+
+        deltas = []
+        sync.add_listener(lambda added, modified, removed: deltas.append((added, modified, removed)))
+        self.assertEqual(sync.scan(), (['C3.xlsx'], ['B2.xlsx'], ['A1.xlsx']))
+        self.assertEqual(deltas, [(['C3.xlsx'], ['B2.xlsx'], ['A1.xlsx'])])
+
+        users = {user.profile['unique-id']: user for user in sync.users()}
+        self.assertEqual(set(users), {333, 444})
+        self.assertEqual(users[333].data_count, 3)
+
+    def test_touched_file_with_same_content_is_not_reparsed(self):
+        sync = DirectorySync(self.directory)
+        sync.scan()
+        version = sync.version
+        path = os.path.join(self.directory, 'A1.xlsx')
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+
+        self.assertEqual(sync.scan(), ([], [], []))
+        self.assertEqual(sync.version, version + 1)  # Only the fingerprint was refreshed
+        self.assertEqual(sync.scan(), ([], [], []))
+        self.assertEqual(sync.version, version + 1)
+
+    def test_maintained_manifest_tracks_changes(self):
+        sync = DirectorySync(self.directory, maintain_manifest=True)
+        sync.scan()
+        os.remove(os.path.join(self.directory, 'A1.xlsx'))
+        sync.scan()
+
+        manifest = read_manifest(sync.manifest_path)
+        self.assertEqual([entry['file'] for entry in manifest['users']], ['B2.xlsx'])
+        self.assertEqual(manifest['users'][0]['row_count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
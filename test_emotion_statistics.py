@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+import pandas as pd
+from emotion_statistics import compute_emotion_statistics, data_statistics, user_statistics
+from physiological_data import PhysiologicalData
+from user import User
+from utilities import FEATURE_COLUMNS, LABEL_TO_EMOTION
+
+
+class TestEmotionStatistics(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.data = PhysiologicalData(rng.normal(50, 10, (5000, 6)), rng.choice([1, 2, 6, 12], 5000))
+
+    def test_matches_a_pandas_groupby(self):
+        statistics = compute_emotion_statistics(self.data.features, self.data.labels, percentiles=(10, 50, 90))
+        frame = pd.DataFrame(self.data.features.astype(np.float64), columns=FEATURE_COLUMNS)
+        grouped = frame.groupby(self.data.labels)
+
+        self.assertEqual(statistics["samples"], 5000)
+        self.assertEqual(sorted(statistics["emotions"]), sorted(LABEL_TO_EMOTION[label] for label in (1, 2, 6, 12)))
+        for label, group in grouped:
+            emotion = statistics["emotions"][LABEL_TO_EMOTION[label]]
+            self.assertEqual(emotion["count"], len(group))
+            for column in FEATURE_COLUMNS:
+                self.assertAlmostEqual(emotion["mean"][column], group[column].mean(), places=6)
+                self.assertAlmostEqual(emotion["variance"][column], group[column].var(ddof=0), places=4)
+                self.assertAlmostEqual(emotion["percentiles"]["90"][column], group[column].quantile(0.9), places=6)
+
+    def test_empty_data(self):
+        statistics = data_statistics(PhysiologicalData.empty())
+        self.assertEqual((statistics["samples"], statistics["emotions"]), (0, {}))
+
+    def test_cached_per_data_object(self):
+        user = User({'unique-id': 42}, self.data)
+        first = user_statistics(user)
+        self.assertIs(data_statistics(self.data), data_statistics(self.data))
+        self.assertEqual(first["user_id"], 42)
+
+        user.physiological_data = self.data[:100]  # New data, new version
+        self.assertEqual(user_statistics(user)["samples"], 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import numpy as np
+from feature_engine import FeatureSpec, FeatureStream, RollingWindow, extract_from_samples, raw_schema, rolling_schema
+from utilities import format_data
+
+
+class TestFeatureEngine(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.samples = [{'heart-rate-bpm': float(70 + i + rng.normal()), 'breathing-rate-breaths-min': 15.0,
+                         'hrv-ms': float(rng.uniform(30, 70)), 'skin-temp-c': 31.0,
+                         'emg-mv': float(rng.uniform(0, 1)), 'bvp-unit': 0.8} for i in range(40)]
+
+    def test_rolling_window_matches_direct_statistics(self):
+        values = [3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0]
+        window = RollingWindow(4)
+        for value in values:
+            window.push(value)
+        last = np.array(values[-4:])
+        self.assertAlmostEqual(window.mean(), last.mean())
+        self.assertAlmostEqual(window.std(), last.std())
+        self.assertAlmostEqual(window.energy(), np.mean(last ** 2))
+        self.assertAlmostEqual(window.slope(), np.polyfit(np.arange(4), last, 1)[0])
+
+    def test_stream_and_batch_agree(self):
+        schema = rolling_schema(window=8)
+        stream = FeatureStream(schema)
+        streamed = np.array([stream.update(sample) for sample in self.samples], dtype=np.float32)
+        batch = extract_from_samples(self.samples, schema)
+        np.testing.assert_allclose(streamed, batch, rtol=1e-4, atol=1e-4)
+
+    def test_raw_schema_matches_format_data(self):
+        batch = extract_from_samples(self.samples[:3], raw_schema())
+        np.testing.assert_allclose(batch, np.array([format_data(s) for s in self.samples[:3]], dtype=np.float32))
+
+    def test_unknown_kind_is_rejected(self):
+        with self.assertRaises(ValueError):
+            FeatureStream([FeatureSpec('x', 'hrv-ms', 'median', 5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
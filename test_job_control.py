@@ -0,0 +1,129 @@
+import os
+import tempfile
+import time
+import unittest
+from job_control import CancellationToken, JobCancelled, JobControl, TrainingCostModel
+from main import main
+from fixtures import SAMPLES, write_user_workbook
+from user import User
+from user_data_loader import clear_workbook_cache
+
+
+def stub_users(count):
+    return [User({'unique-id': i}, data_source=lambda: None, data_count=1000) for i in range(count)]
+
+
+class TestJobControl(unittest.TestCase):
+    def test_checkpoint_raises_once_cancelled(self):
+        control = JobControl()
+        control.checkpoint('train')
+        control.token.cancel('client disconnected')
+        with self.assertRaises(JobCancelled) as raised:
+            control.checkpoint('train')
+        self.assertEqual((raised.exception.reason, raised.exception.stage), ('client disconnected', 'train'))
+
+    def test_checkpoint_does_not_raise_after_deadline(self):
+        control = JobControl(deadline_seconds=0)
+        control.checkpoint('predict')
+        self.assertTrue(control.expired)
+
+    def test_plan_keeps_everything_without_deadline(self):
+        info = [(user, 1.0, 1000) for user in stub_users(3)]
+        control = JobControl()
+        self.assertEqual(control.plan(info), info)
+        self.assertEqual(control.strategy, 'full')
+
+    def test_plan_degrades_to_cheaper_strategies(self):
+        info = [(user, 1.0, 1000) for user in stub_users(3)]
+        cost_model = TrainingCostModel(seconds_per_row=0.001)  # One second per user
+
+        control = JobControl(deadline_seconds=2.8, cost_model=cost_model)
+        self.assertEqual(len(control.plan(info)), 2)
+        self.assertEqual(control.strategy, 'fewer_users')
+
+        control = JobControl(deadline_seconds=0.5, cost_model=cost_model)
+        planned = control.plan(info)
+        self.assertEqual(control.strategy, 'capped_data')
+        self.assertEqual(len(planned), 1)
+        self.assertLess(planned[0][2], 400)
+
+        control = JobControl(deadline_seconds=0.1, cost_model=cost_model)
+        self.assertEqual(control.plan(info), [])
+        self.assertEqual(control.strategy, 'prototype')
+
+    def test_time_budget_only_when_a_full_fit_overruns_its_share(self):
+        cost_model = TrainingCostModel(seconds_per_row=0.001)  # One second per 1000 rows
+        self.assertIsNone(JobControl(cost_model=cost_model).time_budget(1000, 1))
+        self.assertIsNone(JobControl(deadline_seconds=10, cost_model=cost_model).time_budget(1000, 2))
+        budget = JobControl(deadline_seconds=2, cost_model=cost_model).time_budget(1000, 2)
+        self.assertAlmostEqual(budget, 0.8, places=2)
+
+
+class TestMainWithJobControl(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        for i in range(2):
+            write_user_workbook(os.path.join(self.temp_dir.name, f'U{i}.xlsx'), 100 + i,
+                                ['Happy', 'Sad', 'Calm', 'Angry'] * 10, gender='Female', age=30)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_main(self, job_control):
+        return main(self.temp_dir.name, 30000, {'age': 30, 'gender': 'female'}, SAMPLES, display_results=True,
+                    emit_progress=lambda stage, details=None: None, job_control=job_control)
+
+    def test_cancelled_job_stops_before_loading(self):
+        token = CancellationToken()
+        token.cancel()
+        with self.assertRaises(JobCancelled) as raised:
+            self.run_main(JobControl(token=token))
+        self.assertEqual(raised.exception.stage, 'load_users')
+
+    def test_prototype_fallback_when_no_time_to_train(self):
+        control = JobControl(deadline_seconds=30, cost_model=TrainingCostModel(seconds_per_row=10))
+        results = self.run_main(control)
+        self.assertEqual(control.strategy, 'prototype')
+        self.assertEqual(len(results), 1)
+        self.assertIsNone(results[0]['User ID'])
+        self.assertEqual(len(results[0]['Predictions']), 1)
+
+    def test_results_stream_cheapest_user_first(self):
+        write_user_workbook(os.path.join(self.temp_dir.name, 'U0.xlsx'), 100,
+                            ['Happy', 'Sad', 'Calm', 'Angry'] * 20, gender='Female', age=30)
+        streamed = []
+        results = main(self.temp_dir.name, 30000, {'age': 30, 'gender': 'female'}, SAMPLES, display_results=True,
+                       emit_progress=lambda stage, details=None: None, emit_result=streamed.append)
+        self.assertEqual([result['User ID'] for result in streamed], [101, 100])
+        self.assertEqual([result['User ID'] for result in results], [100, 101])
+        self.assertEqual(streamed[0], results[1])
+
+    def test_deadline_passing_mid_training_keeps_the_users_trained_so_far(self):
+        control = JobControl(deadline_seconds=60, cost_model=TrainingCostModel(seconds_per_row=1e-6))
+
+        def expire_after_first_fit(stage, details=None):
+            if stage == "Emotion Model Trained":
+                control.expires_at = time.monotonic() - 1
+
+        results = main(self.temp_dir.name, 30000, {'age': 30, 'gender': 'female'}, SAMPLES, display_results=True,
+                       emit_progress=expire_after_first_fit, job_control=control)
+        self.assertEqual(control.strategy, 'fewer_users')
+        self.assertEqual([result['User ID'] for result in results], [100])
+        self.assertFalse(control.token.cancelled)
+
+    def test_deadline_passed_before_training_falls_back_to_prototypes(self):
+        control = JobControl(deadline_seconds=0)
+        results = self.run_main(control)
+        self.assertEqual(control.strategy, 'prototype')
+        self.assertIsNone(results[0]['User ID'])
+
+    def test_full_strategy_trains_every_user(self):
+        control = JobControl(deadline_seconds=60, cost_model=TrainingCostModel(seconds_per_row=1e-6))
+        results = self.run_main(control)
+        self.assertEqual(control.strategy, 'full')
+        self.assertEqual([result['User ID'] for result in results], [100, 101])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from metrics import MetricsRegistry, STAGE_DURATION, time_stage
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_and_gauge_render(self):
+        hits = self.registry.counter('cache_hits_total', 'Cache hits.')
+        in_flight = self.registry.gauge('jobs_in_flight', 'Jobs running.')
+        hits.inc()
+        hits.inc(2)
+        in_flight.inc()
+        in_flight.inc()
+        in_flight.dec()
+
+        output = self.registry.render()
+        self.assertIn('# TYPE cache_hits_total counter', output)
+        self.assertIn('cache_hits_total 3', output)
+        self.assertIn('jobs_in_flight 1', output)
+
+    def test_histogram_buckets_are_cumulative(self):
+        durations = self.registry.histogram('stage_seconds', 'Stage durations.', ('stage',), buckets=(0.1, 1.0))
+        durations.observe(0.05, stage='train')
+        durations.observe(0.5, stage='train')
+        durations.observe(5, stage='train')
+
+        output = self.registry.render()
+        self.assertIn('stage_seconds_bucket{stage="train",le="0.1"} 1', output)
+        self.assertIn('stage_seconds_bucket{stage="train",le="1"} 2', output)
+        self.assertIn('stage_seconds_bucket{stage="train",le="+Inf"} 3', output)
+        self.assertIn('stage_seconds_count{stage="train"} 3', output)
+
+    def test_labels_must_match(self):
+        durations = self.registry.histogram('stage_seconds', 'Stage durations.', ('stage',))
+        with self.assertRaises(ValueError):
+            durations.observe(1.0)
+
+    def test_time_stage_records_failures(self):
+        before = STAGE_DURATION.count(stage='unit-test')
+        with self.assertRaises(RuntimeError):
+            with time_stage('unit-test'):
+                raise RuntimeError("boom")
+        self.assertEqual(STAGE_DURATION.count(stage='unit-test'), before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import tempfile
+import unittest
+import numpy as np
+from model_registry import ModelRegistry, estimate_model_bytes
+from user_emotion_model import UserEmotionModel
+
+
+def trained_model(user_id, rows):
+    rng = np.random.default_rng(rows)
+    model = UserEmotionModel(user_id, {})
+    model.emotion_model.set_params(n_estimators=5)
+    model.train_model(rng.random((rows, 6)), rng.integers(1, 4, rows))
+    return model
+
+
+class TestModelRegistry(unittest.TestCase):
+    def test_estimate_grows_with_training(self):
+        model = UserEmotionModel('a', {})
+        untrained = estimate_model_bytes(model)
+        model.emotion_model.set_params(n_estimators=5)
+        model.train_model(np.random.random((100, 6)), np.random.randint(1, 4, 100))
+        self.assertGreater(estimate_model_bytes(model), untrained + model.X.nbytes)
+
+    def test_lru_eviction_keeps_recently_used_models(self):
+        models = {user_id: trained_model(user_id, 200) for user_id in 'abc'}
+        size = max(estimate_model_bytes(model) for model in models.values())
+        registry = ModelRegistry(max_bytes=int(size * 2.5), policy='lru')
+        registry['a'] = models['a']
+        registry['b'] = models['b']
+        registry['a']  # 'b' is now the least recently used
+        registry['c'] = models['c']
+
+        self.assertEqual(sorted(registry.keys()), ['a', 'c'])
+        self.assertLessEqual(registry.total_bytes, registry.max_bytes)
+
+    def test_cost_policy_evicts_cheapest_to_retrain_per_byte(self):
+        costly = trained_model('costly', 300)
+        registry = ModelRegistry(max_bytes=estimate_model_bytes(costly) + 1536, policy='cost')
+        registry['costly'] = costly
+        registry['cheap'] = UserEmotionModel('cheap', {})  # Least recently used is now 'costly'
+        registry['new'] = UserEmotionModel('new', {})
+        self.assertEqual(sorted(registry.keys()), ['costly', 'new'])
+
+    def test_refresh_measures_models_trained_in_place(self):
+        registry = ModelRegistry(max_bytes=10 ** 9)
+        registry['a'] = UserEmotionModel('a', {})
+        before = registry.total_bytes
+        registry['a'].train_model(np.random.random((100, 6)), np.random.randint(1, 4, 100))
+        registry.refresh('a')
+        self.assertGreater(registry.total_bytes, before)
+
+    def test_spilled_models_reload_on_access(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            registry = ModelRegistry(max_bytes=1, spill_dir=spill_dir)
+            registry['a'] = trained_model('a', 100)
+            registry['b'] = trained_model('b', 100)
+            self.assertFalse(registry.is_resident('a'))
+            self.assertIn('a', registry)
+
+            sample = np.random.random(6).astype(np.float32)
+            expected = registry['b'].emotion_model.predict([sample])
+            reloaded = registry['a']
+            self.assertTrue(reloaded.is_trained)
+            self.assertEqual(len(reloaded.y), 100)
+            self.assertFalse(registry.is_resident('b'))
+            np.testing.assert_array_equal(registry['b'].emotion_model.predict([sample]), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from main import main
+from neighbor_index import CohortPredictor, SampleIndex
+from physiological_data import PhysiologicalData
+from fixtures import write_user_workbook
+from user import User
+from user_data_loader import UserDataLoader, clear_workbook_cache
+from utilities import EMOTION_TO_LABEL
+
+HAPPY = {"heart-rate-bpm": 65, "breathing-rate-breaths-min": 16, "hrv-ms": 65, "skin-temp-c": 32,
+         "emg-mv": 0.2, "bvp-unit": 0.8}
+ANGRY = {"heart-rate-bpm": 95, "breathing-rate-breaths-min": 21, "hrv-ms": 42, "skin-temp-c": 33,
+         "emg-mv": 0.5, "bvp-unit": 1.0}
+
+
+def clustered_data(centres, per_centre, seed):
+    rng = np.random.default_rng(seed)
+    features, labels = [], []
+    for emotion, sample in centres.items():
+        centre = np.array(list(sample.values()), dtype=np.float32)
+        features.append(centre * (1 + 0.02 * rng.standard_normal((per_centre, 6))))
+        labels.append(np.full(per_centre, EMOTION_TO_LABEL[emotion]))
+    return PhysiologicalData(np.vstack(features), np.concatenate(labels))
+
+
+class TestNeighborIndex(unittest.TestCase):
+    def test_predicts_the_nearest_cluster_across_users(self):
+        happy_user = SampleIndex(clustered_data({'Happy': HAPPY}, 50, seed=1))
+        angry_user = SampleIndex(clustered_data({'Angry': ANGRY}, 50, seed=2))
+        predictor = CohortPredictor([happy_user, angry_user])
+        self.assertEqual(predictor.predict([ANGRY, HAPPY]), ['Angry', 'Happy'])
+
+    def test_small_and_empty_indexes(self):
+        tiny = SampleIndex(clustered_data({'Happy': HAPPY}, 2, seed=3))
+        empty = SampleIndex(PhysiologicalData.empty())
+        self.assertEqual(CohortPredictor([tiny, empty], k=7).predict([ANGRY]), ['Happy'])
+        self.assertEqual(CohortPredictor([empty]).predict([ANGRY]), ['Undefined'])
+
+    def test_user_caches_its_index(self):
+        user = User({'unique-id': 1}, clustered_data({'Happy': HAPPY, 'Angry': ANGRY}, 20, seed=4))
+        index = user.sample_index(30)
+        self.assertIs(user.sample_index(30), index)
+        self.assertEqual(len(index), 30)
+        self.assertEqual(len(user.sample_index()), 40)
+
+    def test_user_stubs_of_each_request_share_the_index_of_the_loaded_data(self):
+        clear_workbook_cache()
+        with tempfile.TemporaryDirectory() as directory:
+            write_user_workbook(os.path.join(directory, 'U0.xlsx'), 100, ['Happy', 'Sad'] * 10)
+            first, = UserDataLoader(directory).load_user_profiles()
+            second, = UserDataLoader(directory).load_user_profiles()
+            self.assertIsNot(first, second)
+            self.assertIs(first.sample_index(), second.sample_index())
+        clear_workbook_cache()
+
+    def test_main_with_knn_engine_trains_nothing(self):
+        clear_workbook_cache()
+        with tempfile.TemporaryDirectory() as directory:
+            write_user_workbook(os.path.join(directory, 'U0.xlsx'), 100, ['Happy', 'Sad'] * 10, gender='Female', age=30)
+            write_user_workbook(os.path.join(directory, 'U1.xlsx'), 101, ['Calm'] * 10, gender='Female', age=30)
+            results = main(directory, 30000, {'age': 30, 'gender': 'female'}, [HAPPY], display_results=True,
+                           emit_progress=lambda stage, details=None: None, engine='knn')
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['Cohort'], [100, 101])
+        self.assertIn(results[0]['Predictions'][0]['Predicted Emotion'], ['Happy', 'Sad', 'Calm'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+import pandas as pd
+from physiological_data import PhysiologicalData
+from user import User
+from emotion_analysis import EmotionAnalysis
+
+
+class TestPhysiologicalData(unittest.TestCase):
+    def setUp(self):
+        self.data_df = pd.DataFrame({
+            'heart-rate-bpm': [85.3447, None, None],
+            'breathing-rate-breaths-min': [18.5971, 12.2553, None],
+            'hrv-ms': [58.3913, 62.8153, None],
+            'skin-temp-c': [33.7697, 30.4123, None],
+            'emg-mv': [0.4739, 0.1398, None],
+            'bvp-unit': [0.8963, 0.8710, None],
+            'predicted-emotion': ['Surprised', 'Unknown', None]
+        })
+
+    def test_from_dataframe_uses_compact_dtypes(self):
+        data = PhysiologicalData.from_dataframe(self.data_df)
+
+        self.assertEqual(len(data), 2)  # The fully empty row is dropped
+        self.assertEqual(data.features.dtype, np.float32)
+        self.assertEqual(data.labels.dtype, np.uint8)
+        self.assertEqual(data.features[1, 0], 0)  # Missing values read as 0, like format_data
+        self.assertEqual(list(data.labels), [11, 0])
+        self.assertEqual(data[0]['predicted-emotion'], 'Surprised')
+
+    def test_slices_and_training_share_memory(self):
+        data = PhysiologicalData.from_dataframe(self.data_df)
+        limited = data[:1]
+        self.assertTrue(np.shares_memory(limited.features, data.features))
+
+        user = User({'unique-id': 1}, data)
+        EmotionAnalysis.train_user_model(user, limited, update_progress=lambda stage, details=None: None)
+        self.assertTrue(np.shares_memory(user.emotion_model.X, data.features))
+        self.assertTrue(np.shares_memory(user.emotion_model.y, data.labels))
+
+    def test_from_samples_matches_format_data(self):
+        samples = [{'heart-rate-bpm': 60, 'hrv-ms': 30, 'predicted-emotion': 'Calm'}]
+        data = PhysiologicalData.from_samples(samples)
+        self.assertEqual(data.features.tolist(), [[60, 0, 30, 0, 0, 0]])
+        self.assertEqual(data.label_histogram(), {'Calm': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
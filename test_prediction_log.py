@@ -0,0 +1,92 @@
+import contextlib
+import datetime
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import prediction_log
+from prediction_log import PredictionLog, decode_frames, encode_frame, log_files, read_predictions
+from user_emotion_model import UserEmotionModel
+from utilities import EMOTION_TO_LABEL
+
+
+class TestPredictionLog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, 'log')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_frames_round_trip_and_stop_at_a_torn_frame(self):
+        features = np.arange(18, dtype=np.float32).reshape(3, 6)
+        frame = encode_frame([1, 2, 3], [7, 'b', 7], [10, 10, 11], features, np.array([1, 2, 3], dtype=np.uint8))
+        batches = list(decode_frames(frame + frame[:-4]))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0]['user_id'].tolist(), ['7', 'b', '7'])
+        self.assertEqual(batches[0]['model_version'].tolist(), [10, 10, 11])
+        self.assertEqual(batches[0]['label'].tolist(), [1, 2, 3])
+        np.testing.assert_array_equal(batches[0]['features'], features)
+
+    def test_batches_are_written_by_flush_and_queried(self):
+        log = PredictionLog(self.directory, flush_interval=60)
+        happy, sad = EMOTION_TO_LABEL['Happy'], EMOTION_TO_LABEL['Sad']
+        log.log(1, 100, np.ones((2, 6)), np.array([happy, sad], dtype=np.uint8))
+        log.log(2, 200, np.zeros((1, 6)), np.array([sad], dtype=np.uint8))
+        self.assertEqual(log_files(self.directory), [])
+        log.close()
+
+        batches = list(read_predictions(self.directory))
+        self.assertEqual(sum(len(batch['label']) for batch in batches), 3)
+        only_sad = list(read_predictions(self.directory, emotion='Sad'))
+        self.assertEqual(sorted(user_id for batch in only_sad for user_id in batch['user_id']), ['1', '2'])
+        user_two = list(read_predictions(self.directory, user_id=2))
+        self.assertEqual(user_two[0]['model_version'].tolist(), [200])
+        later = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        self.assertEqual(list(read_predictions(self.directory, since=later)), [])
+
+    def test_writer_flushes_on_its_own_and_close_is_idempotent(self):
+        log = PredictionLog(self.directory, flush_interval=0.05)
+        log.log(1, 1, np.ones((1, 6)), np.array([1], dtype=np.uint8))
+        deadline = time.monotonic() + 5
+        while not log_files(self.directory) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(log_files(self.directory)), 1)
+        log.close()
+        log.close()
+
+    def test_rotation_keeps_the_newest_files(self):
+        log = PredictionLog(self.directory, max_bytes=1, max_files=2, flush_interval=60)
+        for i in range(4):
+            log.log(i, 1, np.ones((1, 6)), np.array([1], dtype=np.uint8))
+            log.flush()
+        log.close()
+        files = log_files(self.directory)
+        self.assertEqual(len(files), 2)
+        self.assertEqual([batch['user_id'].tolist() for batch in read_predictions(self.directory)], [['2'], ['3']])
+
+    def test_model_predictions_are_logged_without_console_output(self):
+        X = np.random.default_rng(0).normal(size=(40, 6))
+        y = np.array([1, 2] * 20, dtype=np.uint8)
+        model = UserEmotionModel(49, {})
+        model.train_model(X, y)
+        log = PredictionLog(self.directory, flush_interval=60)
+        stdout = io.StringIO()
+        with patch.object(prediction_log, 'PREDICTION_LOG', log), contextlib.redirect_stdout(stdout):
+            emotions = model.predict_emotions(X[:5])
+        log.close()
+        self.assertEqual(stdout.getvalue(), '')
+
+        batch, = read_predictions(self.directory)
+        self.assertEqual(batch['user_id'].tolist(), ['49'] * 5)
+        self.assertEqual(batch['model_version'].tolist(), [model.version] * 5)
+        self.assertEqual([model.map_label_to_emotion(label) for label in batch['label']], emotions)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from profile_manifest import build_manifest, write_manifest, read_manifest, stale_entries, default_manifest_path
+from user_data_loader import UserDataLoader, clear_workbook_cache
+from fixtures import write_user_workbook
+
+
+class TestProfileManifest(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.temp_dir.name
+        write_user_workbook(os.path.join(self.directory, 'A1.xlsx'), 111, ['Happy', 'Sad', 'Happy'])
+        write_user_workbook(os.path.join(self.directory, 'B2.xlsx'), 222, ['Calm'])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_build_manifest_records_counts_and_histograms(self):
+        manifest = build_manifest(self.directory)
+        entries = {entry['file']: entry for entry in manifest['users']}
+
+        self.assertEqual(set(entries), {'A1.xlsx', 'B2.xlsx'})
+        self.assertEqual(entries['A1.xlsx']['row_count'], 3)
+        self.assertEqual(entries['A1.xlsx']['label_histogram'], {'Happy': 2, 'Sad': 1})
+        self.assertEqual(len(entries['A1.xlsx']['fingerprint']['sha256']), 64)
+
+    def test_loader_starts_from_manifest_without_opening_workbooks(self):
+        write_manifest(build_manifest(self.directory), default_manifest_path(self.directory))
+        clear_workbook_cache()
+
+        with patch('pandas.read_excel') as mock_read_excel:
+            users = UserDataLoader(self.directory).load_user_profiles()
+            self.assertEqual(mock_read_excel.call_count, 0)
+
+        users = {user.profile['unique-id']: user for user in users}
+        self.assertEqual(users[111].data_count, 3)
+        self.assertFalse(users[111].is_data_loaded)
+        self.assertEqual(users[111].profile['date-of-birth'], datetime.datetime(1990, 4, 15))
+
+        # Phase two still reads the data sheet on demand
+        self.assertEqual(users[222].physiological_data[0]['predicted-emotion'], 'Calm')
+
+    def test_stale_entries_detects_added_and_removed_files(self):
+        manifest_path = default_manifest_path(self.directory)
+        write_manifest(build_manifest(self.directory), manifest_path)
+        os.remove(os.path.join(self.directory, 'B2.xlsx'))
+        write_user_workbook(os.path.join(self.directory, 'C3.xlsx'), 333, ['Angry'])
+
+        self.assertEqual(stale_entries(read_manifest(manifest_path), self.directory), ['C3.xlsx', 'B2.xlsx'])
+
+    def test_loader_reads_workbooks_changed_since_the_manifest(self):
+        write_manifest(build_manifest(self.directory), default_manifest_path(self.directory))
+        os.remove(os.path.join(self.directory, 'B2.xlsx'))
+        write_user_workbook(os.path.join(self.directory, 'A1.xlsx'), 111, ['Happy'] * 5)
+        write_user_workbook(os.path.join(self.directory, 'C3.xlsx'), 333, ['Angry'])
+
+        users = {user.profile['unique-id']: user for user in UserDataLoader(self.directory).load_user_profiles()}
+        self.assertEqual(set(users), {111, 333})
+        self.assertEqual(users[111].data_count, 5)
+        self.assertEqual(users[333].data_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from profiling import RunProfiler, profile_stage
+
+
+class TestRunProfiler(unittest.TestCase):
+    def test_writes_cpu_profile_and_stage_memory_report(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            with RunProfiler('job-1', output_dir=output_dir, top_allocations=3) as profiler:
+                with profile_stage('load_users'):
+                    data = [list(range(100)) for _ in range(200)]
+                    with profile_stage('train'):
+                        more = [str(i) * 10 for i in range(1000)]
+                del data, more
+
+            self.assertTrue(os.path.exists(os.path.join(output_dir, 'job-1.prof')))
+            self.assertTrue(os.path.exists(os.path.join(output_dir, 'job-1-cpu.txt')))
+            with open(os.path.join(output_dir, 'job-1-memory.json')) as file:
+                report = json.load(file)
+
+        self.assertEqual(report['job_id'], 'job-1')
+        self.assertEqual(set(report['peak_by_stage']), {'load_users', 'train'})
+        # The outer stage's peak includes everything allocated by its nested stage
+        self.assertGreaterEqual(report['peak_by_stage']['load_users']['peak_bytes'],
+                                report['peak_by_stage']['train']['peak_bytes'])
+        self.assertEqual(profiler.paths['memory_report'], os.path.join(output_dir, 'job-1-memory.json'))
+
+    def test_rejects_job_ids_that_are_not_file_names(self):
+        for job_id in ('../../x', 'a/b', '', 'job.1'):
+            with self.assertRaises(ValueError):
+                RunProfiler(job_id)
+
+    def test_refuses_a_second_concurrent_run(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            with RunProfiler('job-1', output_dir=output_dir):
+                errors = []
+                thread = threading.Thread(target=lambda: errors.append(self.enter(output_dir)))
+                thread.start()
+                thread.join()
+                self.assertIsInstance(errors[0], RuntimeError)
+            # Released once the first run is done
+            with RunProfiler('job-3', output_dir=output_dir):
+                pass
+
+    @staticmethod
+    def enter(output_dir):
+        try:
+            with RunProfiler('job-2', output_dir=output_dir):
+                return None
+        except RuntimeError as e:
+            return e
+
+    def test_profile_stage_without_profiler_is_noop(self):
+        with profile_stage('predict'):
+            value = 1
+        self.assertEqual(value, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import unittest
+from main import main, to_columnar_result
+from result_encoding import decode_payload, encode_payload
+from fixtures import write_user_workbook
+from user_data_loader import clear_workbook_cache
+
+SAMPLES = [{"heart-rate-bpm": 60 + i, "breathing-rate-breaths-min": 15, "hrv-ms": 60, "skin-temp-c": 31,
+            "emg-mv": 0.2, "bvp-unit": 0.8} for i in range(20)]
+
+
+class TestColumnarResults(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        for i in range(3):
+            write_user_workbook(os.path.join(self.temp_dir.name, f'U{i}.xlsx'), 100 + i,
+                                ['Happy', 'Sad', 'Calm', 'Angry'] * 10, gender='Female', age=30)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_main(self, result_format):
+        return main(self.temp_dir.name, 30000, {'age': 30, 'gender': 'female'}, SAMPLES, display_results=True,
+                    emit_progress=lambda stage, details=None: None, result_format=result_format)
+
+    def test_columnar_matches_nested(self):
+        nested = self.run_main('nested')
+        clear_workbook_cache()
+        columnar = self.run_main('columnar')
+
+        self.assertEqual(columnar["Samples"], SAMPLES)
+        self.assertEqual([user["User ID"] for user in columnar["Users"]], [100, 101, 102])
+        self.assertTrue(all(len(user["Emotion Codes"]) == len(SAMPLES) for user in columnar["Users"]))
+        # Forests are not seeded, so compare the nested run with its own conversion
+        for result in nested:
+            user = to_columnar_result(result)
+            self.assertEqual(user["Matched Features"], result["Matched Features"])
+            for code, prediction in zip(user["Emotion Codes"], result["Predictions"]):
+                self.assertEqual(columnar["Emotions"][code], prediction["Predicted Emotion"])
+                self.assertEqual(columnar["Valence Ranges"][code], prediction["Valence Range"])
+        self.assertLess(len(json.dumps(columnar, default=str)), len(json.dumps(nested, default=str)) / 2)
+
+
+class TestResultEncoding(unittest.TestCase):
+    def test_gzip_round_trip_for_large_payloads(self):
+        payload = {'job_id': 'a', 'results': [SAMPLES] * 50}
+        encoded = encode_payload(payload, 'gzip', min_bytes=1024)
+        self.assertEqual(encoded['encoding'], 'gzip')
+        self.assertIsInstance(encoded['data'], bytes)
+        self.assertEqual(decode_payload(encoded), payload)
+
+    def test_small_payloads_stay_plain(self):
+        payload = {'job_id': 'a', 'results': []}
+        self.assertIs(encode_payload(payload, 'gzip'), payload)
+        self.assertIs(decode_payload(payload), payload)
+        with self.assertRaises(ValueError):
+            encode_payload(payload, 'brotli')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from main import find_most_suitable_user
+from sharding import local_coordinator
+from fixtures import write_user_workbook
+from user_data_loader import UserDataLoader, clear_workbook_cache
+
+NO_PROGRESS = lambda stage, details=None: None
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.temp_dir.name
+        profiles = [('Female', 'Indian', 30), ('Male', 'Indian', 30), ('Female', 'Canadian', 31),
+                    ('Female', 'Indian', 29), ('Male', 'Canadian', 45), ('Female', 'Indian', 32), ('Male', 'Indian', 28)]
+        for i, (gender, nationality, age) in enumerate(profiles):
+            emotions = ['Happy', 'Sad', 'Calm', 'Angry'] * (i + 1)
+            write_user_workbook(os.path.join(self.directory, f'U{i}.xlsx'), 100 + i, emotions,
+                                gender=gender, nationality=nationality, age=age)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_same_selection(self, provided, data_limit):
+        users = UserDataLoader(self.directory).load_user_profiles()
+        expected = [(user.profile['unique-id'], score, count)
+                    for user, score, count in find_most_suitable_user(provided, users, data_limit, NO_PROGRESS)]
+
+        coordinator = local_coordinator(self.directory, shard_count=3, page_size=1)
+        try:
+            selected = [(candidate['user_id'], score, count)
+                        for _, candidate, score, count in coordinator.find_most_suitable_users(provided, data_limit)]
+        finally:
+            coordinator.close()
+        self.assertEqual(selected, expected)
+        return selected
+
+    def test_sharded_selection_matches_single_process(self):
+        provided = {'age': 30, 'gender': 'female', 'nationality': 'indian'}
+        self.assertEqual(len(self.assert_same_selection(provided, data_limit=30)), 3)
+        self.assertEqual(len(self.assert_same_selection(provided, data_limit=10)), 2)
+
+    def test_closest_match_fallback(self):
+        self.assert_same_selection({'gender': 'other'}, data_limit=30000)
+
+    def test_analyze_returns_results_from_owning_shards(self):
+        coordinator = local_coordinator(self.directory, shard_count=2)
+        samples = [{"heart-rate-bpm": 70, "breathing-rate-breaths-min": 15, "hrv-ms": 60, "skin-temp-c": 31,
+                    "emg-mv": 0.2, "bvp-unit": 0.8}]
+        try:
+            results = coordinator.analyze({'age': 30, 'gender': 'female', 'nationality': 'indian'}, samples,
+                                          data_limit=30)
+        finally:
+            coordinator.close()
+
+        self.assertEqual([result['User ID'] for result in results], [100, 103, 105])
+        self.assertEqual(results[0]['Matched Features'], {'age': 30, 'gender': 'Female', 'nationality': 'Indian'})
+        self.assertIn(results[0]['Predictions'][0]['Predicted Emotion'], ['Happy', 'Sad', 'Calm', 'Angry'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import joblib
+import pandas as pd
+
+from model_registry import ModelRegistry
+from neighbor_index import data_sample_index
+from snapshot import restore_snapshot, save_snapshot
+from fixtures import write_user_workbook
+from training_coordinator import TrainingCoordinator
+from user_data_loader import UserDataLoader, clear_workbook_cache
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, 'users')
+        os.mkdir(self.directory)
+        write_user_workbook(os.path.join(self.directory, 'A1.xlsx'), 471, ['Happy', 'Sad'] * 10)
+        write_user_workbook(os.path.join(self.directory, 'A2.xlsx'), 472, ['Calm', 'Angry'] * 10)
+        self.snapshot_path = os.path.join(self.temp_dir.name, 'warm.snapshot')
+        self.quiet = lambda stage, details=None: None
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        clear_workbook_cache()
+
+    def warm_up(self, coordinator):
+        users = UserDataLoader(self.directory).load_users()
+        for user in users:
+            coordinator.train(user, 20, update_progress=self.quiet)
+            data_sample_index(user.physiological_data, 20)
+        return users
+
+    def test_restored_state_serves_without_reading_workbooks(self):
+        coordinator = TrainingCoordinator(ModelRegistry(max_bytes=10 ** 9))
+        self.warm_up(coordinator)
+        summary = save_snapshot(self.directory, self.snapshot_path, coordinator=coordinator)
+        self.assertEqual((summary['datasets'], summary['models']), (2, 2))
+
+        clear_workbook_cache()
+        restored_coordinator = TrainingCoordinator(ModelRegistry(max_bytes=10 ** 9))
+        restored = restore_snapshot(self.snapshot_path, self.directory, coordinator=restored_coordinator)
+        self.assertEqual(restored['restored_files'], ['A1.xlsx', 'A2.xlsx'])
+        self.assertEqual(restored['stale_files'], [])
+        self.assertEqual(restored['models'], 2)
+
+        with patch('pandas.read_excel', wraps=pd.read_excel) as read_excel:
+            users = UserDataLoader(self.directory).load_users()
+            self.assertEqual(read_excel.call_count, 0)
+            for user in users:
+                self.assertEqual(len(user.physiological_data), 20)
+                self.assertTrue(restored_coordinator.is_ready(user, 20))
+                model, trained_here = restored_coordinator.train(user, 20, update_progress=self.quiet)
+                self.assertFalse(trained_here)
+                self.assertEqual(len(model.emotion_model.predict(user.physiological_data.features)), 20)
+
+    def test_changed_workbook_is_not_restored(self):
+        coordinator = TrainingCoordinator(ModelRegistry(max_bytes=10 ** 9))
+        self.warm_up(coordinator)
+        save_snapshot(self.directory, self.snapshot_path, coordinator=coordinator)
+        write_user_workbook(os.path.join(self.directory, 'A2.xlsx'), 472, ['Calm', 'Angry'] * 12)
+
+        clear_workbook_cache()
+        restored_coordinator = TrainingCoordinator(ModelRegistry(max_bytes=10 ** 9))
+        restored = restore_snapshot(self.snapshot_path, self.directory, coordinator=restored_coordinator)
+        self.assertEqual(restored['restored_files'], ['A1.xlsx'])
+        self.assertEqual(restored['stale_files'], ['A2.xlsx'])
+        self.assertEqual(restored['models'], 1)
+
+        users = {user.profile.get('unique-id'): user for user in UserDataLoader(self.directory).load_users()}
+        self.assertEqual(len(users[472].physiological_data), 24)
+        self.assertFalse(restored_coordinator.is_ready(users[472], 20))
+
+    def test_models_of_another_sklearn_version_are_never_unpickled(self):
+        coordinator = TrainingCoordinator(ModelRegistry(max_bytes=10 ** 9))
+        self.warm_up(coordinator)
+        with patch('sklearn.__version__', '0.0'):
+            save_snapshot(self.directory, self.snapshot_path, coordinator=coordinator)
+        self.assertEqual([name for name in os.listdir(self.temp_dir.name) if name.endswith('.tmp')], [])
+
+        clear_workbook_cache()
+        restored_coordinator = TrainingCoordinator(ModelRegistry(max_bytes=10 ** 9))
+        with patch('snapshot.pickle.loads') as loads:
+            restored = restore_snapshot(self.snapshot_path, self.directory, coordinator=restored_coordinator)
+        loads.assert_not_called()
+        self.assertEqual(restored['restored_files'], ['A1.xlsx', 'A2.xlsx'])
+        self.assertEqual(restored['models'], 0)
+
+    def test_rejects_other_versions(self):
+        joblib.dump({'version': 0}, self.snapshot_path)
+        with self.assertRaises(ValueError):
+            restore_snapshot(self.snapshot_path, self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
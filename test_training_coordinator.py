@@ -0,0 +1,142 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import numpy as np
+from emotion_analysis import EmotionAnalysis
+from feature_engine import rolling_schema
+from fixtures import SAMPLES, write_user_workbook
+from main import main
+from model_registry import ModelRegistry
+from physiological_data import PhysiologicalData
+from training_coordinator import TRAINING_COORDINATOR, TrainingCoordinator
+from user import User
+from user_data_loader import UserDataLoader, clear_workbook_cache
+
+
+def make_data(rows=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return PhysiologicalData(rng.random((rows, 6)), rng.integers(1, 4, rows))
+
+
+class TestTrainingCoordinator(unittest.TestCase):
+    def setUp(self):
+        self.coordinator = TrainingCoordinator(ModelRegistry(max_bytes=10 ** 9))
+        self.data = make_data()
+        original_train = EmotionAnalysis.train_user_model
+        self.fits = []
+
+        def slow_train(user, limited_data=None, update_progress=None, feature_schema=None, time_budget=None,
+                       sample_weight=None, model=None):
+            self.fits.append(user.profile['unique-id'])
+            time.sleep(0.2)
+            original_train(user, limited_data, update_progress=lambda *args: None, feature_schema=feature_schema,
+                           time_budget=time_budget, sample_weight=sample_weight, model=model)
+
+        patcher = mock.patch.object(EmotionAnalysis, 'train_user_model', staticmethod(slow_train))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def user(self, data=None):
+        return User({'unique-id': 7}, data if data is not None else self.data)
+
+    def test_concurrent_requests_share_one_fit(self):
+        users = [self.user() for _ in range(6)]
+        results = [None] * len(users)
+
+        def train(i):
+            results[i] = self.coordinator.train(users[i], 150)
+
+        threads = [threading.Thread(target=train, args=(i,)) for i in range(len(users))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.fits), 1)
+        self.assertEqual(sum(trained for _, trained in results), 1)
+        model = results[0][0]
+        self.assertTrue(all(result[0] is model for result in results))
+        self.assertTrue(all(user.emotion_model is model for user in users))
+        self.assertEqual(len(model.y), 150)
+
+    def test_shared_user_trains_each_row_count_on_its_own_model(self):
+        user = self.user()
+        counts = [60, 90, 120, 150]
+        results = {}
+        errors = []
+
+        def train(data_count):
+            try:
+                model, _ = self.coordinator.train(user, data_count)
+                results[data_count] = (model, model.predict_emotions(self.data.features[:5]))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=train, args=(count,)) for count in counts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for count in counts:
+            model, predictions = results[count]
+            self.assertEqual(len(model.y), count)
+            self.assertEqual(len(predictions), 5)
+        self.assertTrue(user.emotion_model.is_trained)
+
+    def test_new_rows_or_new_data_train_again(self):
+        first, _ = self.coordinator.train(self.user(), 150)
+        self.assertIs(self.coordinator.train(self.user(), 150)[0], first)
+        self.assertTrue(self.coordinator.is_ready(self.user(), 150))
+
+        self.assertIsNot(self.coordinator.train(self.user(), 100)[0], first)
+        self.assertIsNot(self.coordinator.train(self.user(make_data(seed=1)), 150)[0], first)
+        self.assertEqual(len(self.fits), 3)
+
+    def test_truncated_fit_is_only_reused_by_budgeted_requests(self):
+        truncated, _ = self.coordinator.train(self.user(), 150, time_budget=1e-6)
+        self.assertEqual(truncated.stop_reason, 'budget')
+        self.assertIs(self.coordinator.train(self.user(), 150, time_budget=1e-6)[0], truncated)
+        self.assertFalse(self.coordinator.is_ready(self.user(), 150))
+
+        complete, trained_here = self.coordinator.train(self.user(), 150)
+        self.assertTrue(trained_here)
+        self.assertEqual(complete.stop_reason, 'complete')
+        self.assertIs(self.coordinator.train(self.user(), 150, time_budget=1e-6)[0], complete)
+        self.assertEqual(len(self.fits), 2)
+
+    def test_failed_fit_is_not_cached(self):
+        empty_user = self.user(PhysiologicalData.empty())
+        with self.assertRaises(ValueError):
+            self.coordinator.train(empty_user, 10)
+        with self.assertRaises(ValueError):
+            self.coordinator.train(empty_user, 10)
+        self.assertEqual(len(self.fits), 2)
+
+
+class TestMainUsesTheCoordinator(unittest.TestCase):
+    def test_users_kept_across_requests_are_trained_for_each_requests_plan(self):
+        clear_workbook_cache()
+        self.addCleanup(clear_workbook_cache)
+        with tempfile.TemporaryDirectory() as directory:
+            write_user_workbook(os.path.join(directory, 'U0.xlsx'), 490, ['Happy', 'Sad'] * 20, gender='Female', age=30)
+            users = UserDataLoader(directory).load_user_profiles()
+            quiet = lambda stage, details=None: None
+            main(directory, 30000, {'age': 30, 'gender': 'female'}, SAMPLES, emit_progress=quiet, users=users)
+            self.assertEqual(users[0].emotion_model.stop_reason, 'complete')
+
+            with mock.patch.object(TRAINING_COORDINATOR, 'train', wraps=TRAINING_COORDINATOR.train) as train:
+                main(directory, 20, {'age': 30, 'gender': 'female'}, SAMPLES, emit_progress=quiet, users=users)
+                main(directory, 30000, {'age': 30, 'gender': 'female'}, SAMPLES, emit_progress=quiet, users=users,
+                     feature_schema=rolling_schema(5))
+        self.assertEqual([(call.args[1], call.kwargs['feature_schema']) for call in train.call_args_list],
+                         [(20, None), (40, rolling_schema(5))])
+        self.assertEqual(users[0].emotion_model.feature_schema, rolling_schema(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
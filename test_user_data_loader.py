@@ -1,6 +1,10 @@
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
-from user_data_loader import UserDataLoader
+from fixtures import write_user_workbook
+from user_data_loader import SheetCache, UserDataLoader, clear_workbook_cache, estimate_sheet_bytes
+from physiological_data import PhysiologicalData
 import pandas as pd
 from datetime import datetime
 from io import BytesIO
@@ -44,9 +48,9 @@ class TestUserDataLoader(unittest.TestCase):
         data_loader = UserDataLoader(None)
         physiological_entries = data_loader._parse_physiological_data(self.physiological_df)
 
-        self.assertIsInstance(physiological_entries, list)
+        self.assertIsInstance(physiological_entries, PhysiologicalData)
         self.assertEqual(len(physiological_entries), 2)
-        self.assertEqual(physiological_entries[0]['heart-rate-bpm'], 85.3447)
+        self.assertAlmostEqual(physiological_entries[0]['heart-rate-bpm'], 85.3447, places=4)
         self.assertEqual(physiological_entries[1]['predicted-emotion'], 'Joyful')
 
     @patch('os.path.exists', return_value=True)
@@ -155,5 +159,98 @@ class TestUserDataLoader(unittest.TestCase):
         data_loader = UserDataLoader('some/directory')
         users = data_loader.load_users()
 
+    @patch('os.path.exists', return_value=True)
+    @patch('os.listdir', return_value=['user1.xlsx', 'user2.xlsx'])
+    @patch('pandas.read_excel')
+    def test_load_user_profiles_defers_data_sheet(self, mock_read_excel, mock_listdir, mock_exists):
+        # Phase one reads only the profile sheets; the data sheet is read when a user's data is first used
+        mock_read_excel.side_effect = lambda path, sheet_name, **kwargs: (
+            self.profile_df if sheet_name == 'user-profile' else self.physiological_df)
+
+        data_loader = UserDataLoader('some/directory')
+        users = data_loader.load_user_profiles()
+        self.assertEqual(len(users), 2)
+        self.assertFalse(users[0].is_data_loaded)
+        self.assertEqual([call.kwargs['sheet_name'] for call in mock_read_excel.call_args_list],
+                         ['user-profile', 'user-profile'])
+
+        self.assertEqual(users[0].data_count, 2)
+        self.assertTrue(users[0].is_data_loaded)
+        self.assertFalse(users[1].is_data_loaded)
+        self.assertEqual(mock_read_excel.call_args_list[-1].kwargs['sheet_name'], 'data')
+
+    @patch('os.path.exists', return_value=True)
+    @patch('os.listdir', return_value=['user1.xlsx'])
+    @patch('pandas.read_excel', side_effect=ValueError("Worksheet named 'user-profile' not found"))
+    def test_load_user_profiles_skips_missing_profile_sheet(self, mock_read_excel, mock_listdir, mock_exists):
+        data_loader = UserDataLoader('some/directory')
+        self.assertEqual(data_loader.load_user_profiles(), [])
+
+
+class TestRowLimitedReads(unittest.TestCase):
+    def setUp(self):
+        clear_workbook_cache()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'A1.xlsx')
+        write_user_workbook(self.path, 111, ['Happy', 'Sad'] * 5)
+        self.loader = UserDataLoader(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        clear_workbook_cache()
+
+    def test_row_limit_is_pushed_down_to_the_reader(self):
+        with patch('pandas.read_excel', wraps=pd.read_excel) as read_excel:
+            head = self.loader.load_physiological_data(self.path, nrows=4)
+            self.assertEqual(len(head), 4)
+            self.assertEqual(read_excel.call_args.kwargs['nrows'], 4)
+            self.assertEqual(head.features[:, 0].tolist(), [70.0, 71.0, 72.0, 73.0])
+
+            # A cached prefix serves smaller requests; larger ones read further
+            self.assertIs(self.loader.load_physiological_data(self.path, nrows=3), head)
+            self.assertEqual(read_excel.call_count, 1)
+            self.assertEqual(len(self.loader.load_physiological_data(self.path, nrows=6)), 6)
+            self.assertEqual(read_excel.call_count, 2)
+
+            # A complete read serves every request
+            full = self.loader.load_physiological_data(self.path)
+            self.assertEqual(len(full), 10)
+            self.assertIs(self.loader.load_physiological_data(self.path, nrows=8), full)
+            self.assertEqual(read_excel.call_count, 3)
+
+    def test_stub_reads_only_the_rows_it_needs(self):
+        user = self.loader.load_user_profiles()[0]
+        self.assertEqual(user.data_count_within(4), 4)
+        self.assertFalse(user.is_data_loaded)
+        self.assertEqual(len(user.data_prefix(4)[:4]), 4)
+
+        # A limit beyond the sheet's length reads all of it, so the count becomes known
+        self.assertEqual(user.data_count_within(50), 10)
+        self.assertTrue(user.is_data_loaded)
+        self.assertEqual(user.known_data_count, 10)
+
+
+class TestSheetCache(unittest.TestCase):
+    def test_least_recently_used_sheets_are_dropped_beyond_the_budget(self):
+        data = PhysiologicalData.from_samples([{'heart-rate-bpm': 70}] * 100)
+        cache = SheetCache(max_bytes=2 * estimate_sheet_bytes(data))
+        cache.put(('a', 'data'), (1, 1), data)
+        cache.put(('b', 'data'), (1, 1), data)
+        self.assertIsNotNone(cache.get(('a', 'data')))
+        cache.put(('c', 'data'), (1, 1), data)
+        self.assertEqual(sorted(key for key, _ in cache.items()), [('a', 'data'), ('c', 'data')])
+        self.assertEqual(cache.total_bytes, 2 * estimate_sheet_bytes(data))
+
+        cache.pop_file('a')
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        self.assertEqual((len(cache), cache.total_bytes), (0, 0))
+
+    def test_a_sheet_larger_than_the_budget_is_still_kept(self):
+        cache = SheetCache(max_bytes=1)
+        cache.put(('a', 'profile'), (1, 1), {'unique-id': 1})
+        self.assertEqual(cache.get(('a', 'profile')), ((1, 1), {'unique-id': 1}))
+
+
 if __name__ == '__main__':
     unittest.main()
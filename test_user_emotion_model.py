@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from emotion_analysis import EmotionAnalysis
+from main import main
+from model_registry import ModelRegistry
+from fixtures import write_user_workbook
+from user_data_loader import clear_workbook_cache
+from user_emotion_model import UserEmotionModel
+
+
+def make_training_data(rows=600, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(1, 4, rows)
+    # Separable classes, so out-of-bag accuracy rises quickly and then plateaus
+    features = rng.normal(0, 0.3, (rows, 6)) + labels[:, None]
+    return features, labels
+
+
+class TestAnytimeTraining(unittest.TestCase):
+    def test_stops_when_accuracy_plateaus(self):
+        model = UserEmotionModel(1, {})
+        progress = []
+        model.train_model_anytime(*make_training_data(), update_progress=lambda stage, details=None:
+                                  progress.append(details))
+        self.assertTrue(model.is_trained)
+        self.assertEqual(model.stop_reason, 'plateau')
+        self.assertLess(model.trees_built, 100)
+        self.assertEqual(progress[-1]['trees'], str(model.trees_built))
+        self.assertGreater(model.oob_accuracy, 0.9)
+
+    def test_stops_when_budget_is_spent(self):
+        model = UserEmotionModel(1, {})
+        model.train_model_anytime(*make_training_data(), time_budget=0, tolerance=-1)
+        self.assertEqual(model.stop_reason, 'budget')
+        self.assertEqual(model.trees_built, 10)
+
+    def test_grows_to_max_trees_and_refits_whole_forest_later(self):
+        model = UserEmotionModel(1, {})
+        X, y = make_training_data()
+        model.train_model_anytime(X, y, max_trees=30, tolerance=-1)
+        self.assertEqual((model.stop_reason, model.trees_built), ('complete', 30))
+        self.assertEqual(model.predict_emotion(X[0]), model.map_label_to_emotion(y[0]))
+
+        model.process_feedback(X[1], y[1])
+        self.assertEqual(model.trees_built, 30)
+        self.assertFalse(model.emotion_model.warm_start)
+
+
+class TestEmptySamples(unittest.TestCase):
+    def test_no_samples_predict_nothing(self):
+        model = UserEmotionModel(1, {})
+        model.train_model(*make_training_data(rows=40))
+        self.assertEqual(model.predict_emotions([]), [])
+
+    def test_main_without_samples_returns_empty_predictions(self):
+        clear_workbook_cache()
+        with tempfile.TemporaryDirectory() as directory:
+            write_user_workbook(os.path.join(directory, 'U0.xlsx'), 100, ['Happy', 'Sad'] * 10, gender='Male')
+            results = main(directory, 2000, {'gender': 'male'}, [], display_results=True,
+                           emit_progress=lambda stage, details=None: None)
+        clear_workbook_cache()
+        self.assertEqual([result['Predictions'] for result in results], [[]])
+
+
+class TestFeedback(unittest.TestCase):
+    def test_feedback_is_added_to_the_registered_model_with_its_multiplier_as_weight(self):
+        registry = ModelRegistry(max_bytes=10 ** 9)
+        model = UserEmotionModel(7, {})
+        X, y = make_training_data(rows=40)
+        model.train_model(X, y)
+        registry[7] = model
+        sample = {"heart-rate-bpm": 70, "breathing-rate-breaths-min": 16, "hrv-ms": 60, "skin-temp-c": 32,
+                  "emg-mv": 0.2, "bvp-unit": 0.8}
+        with patch('emotion_analysis.user_models', registry):
+            EmotionAnalysis.process_feedback(7, [(sample, 'Happy'), (sample, 'Sad', 3)])
+        self.assertEqual(len(model.y), 42)
+        self.assertEqual([model.map_label_to_emotion(label) for label in model.y[-2:]], ['Happy', 'Sad'])
+        self.assertEqual(model.sample_weight[-2:].tolist(), [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import threading
+import weakref
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from coreset import data_coreset
+from emotion_analysis import EmotionAnalysis
+from metrics import REGISTRY
+from model_registry import MODEL_REGISTRY
+from physiological_data import PhysiologicalData
+from user_emotion_model import UserEmotionModel
+
+MODEL_TRAININGS = REGISTRY.counter('edith_model_trainings_total',
+                                   'Model requests by outcome: trained, shared with a concurrent fit, or cached.',
+                                   ('outcome',))
+
+
+def training_key(user, data_count, feature_schema=None, coreset=None):
+    """
+    Identifies a trained model: the user, the number of rows it was fitted on, its feature schema
+    and the resolution of the coreset it was fitted on, if any.
+    """
+    schema_key = tuple(feature_schema) if feature_schema is not None else None
+    return ('trained', user.profile.get('unique-id'), data_count, schema_key, coreset)
+
+
+class TrainingCoordinator:
+    """
+    Single-flight model training shared by concurrent requests.
+
+    The first request for a (user, data_count, feature schema) fits a fresh UserEmotionModel. Requests
+    for the same key that arrive while it trains wait on its future instead of fitting their own.
+    Finished models are kept in the model registry, so later requests reuse them until they are
+    evicted or the user's data changes. Models are never trained in place after they are published,
+    so predicting with a shared model while another request trains is safe.
+
+    The registry entry remembers the PhysiologicalData object the model was fitted on; the loader
+    replaces that object when the workbook changes, which retires the stale model.
+    """
+    def __init__(self, registry=MODEL_REGISTRY):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._trained_on = {}
+
+    def _cached(self, key, data, complete_only=True):
+        reference = self._trained_on.get(key)
+        trained_on = reference() if reference is not None else None
+        if trained_on is None:
+            self._trained_on.pop(key, None)  # Never trained, or the data it was fitted on is gone
+            return None
+        if trained_on is not data:
+            return None
+        model = self.registry.get(key)
+        if model is None or not model.is_trained:
+            return None
+        # A forest cut short by a time budget only serves requests that have a budget themselves
+        return model if model.stop_reason == 'complete' or not complete_only else None
+
+    def train(self, user, data_count, feature_schema=None, update_progress=None, checkpoint=None, time_budget=None,
+              coreset=None):
+        """
+        Returns a trained model for the user's first `data_count` rows, fitting it only if no other
+        request has or is doing so, and makes it the user's emotion model.
+
+        Args:
+            checkpoint (callable, optional): Called while waiting on another request's fit, e.g. a
+                JobControl checkpoint, so a cancelled request stops waiting.
+            time_budget (float, optional): Seconds a fit may take; the forest is then grown anytime
+                (see UserEmotionModel.train_model_anytime). A forest cut short this way is cached for
+                other budgeted requests only; requests without a budget fit a complete one.
+            coreset (int, optional): Fit on the weighted coreset of the rows at this resolution (see
+                coreset.py) instead of the rows themselves; the coreset is cached with the data.
+
+        Returns:
+            tuple: The model and whether this call fitted it.
+        """
+        key = training_key(user, data_count, feature_schema, coreset)
+        # Lists of sample dicts are converted on every call, so only compact data is ever cached
+        data = PhysiologicalData.from_samples(user.data_prefix(data_count))
+        complete_only = time_budget is None
+        # Budgeted and unbudgeted fits are never shared, so an unbudgeted request never waits on a truncated one
+        flight_key = (key, complete_only)
+        with self._lock:
+            model = self._cached(key, data, complete_only)
+            future = self._in_flight.get(flight_key) if model is None else None
+            leader = model is None and future is None
+            if leader:
+                future = Future()
+                self._in_flight[flight_key] = future
+
+        if model is not None:
+            MODEL_TRAININGS.inc(outcome='cached')
+        elif not leader:
+            MODEL_TRAININGS.inc(outcome='shared')
+            model = self._wait(future, checkpoint)
+        else:
+            try:
+                # Trained privately and published only once fitted: the User is shared with other requests
+                trainee = UserEmotionModel(user.profile.get('unique-id'), user.profile)
+                training_data, sample_weight = data[:data_count], None
+                if coreset is not None:
+                    compressed = data_coreset(data, data_count, coreset)
+                    training_data, sample_weight = compressed.data, compressed.weights
+                    if update_progress is not None:
+                        update_progress("Coreset Built", {"file": "training_coordinator.py", "function": "train",
+                                                          "rows": f"{compressed.source_rows}",
+                                                          "coreset_rows": f"{len(compressed)}"})
+                EmotionAnalysis.train_user_model(user, training_data, update_progress=update_progress,
+                                                 feature_schema=feature_schema, time_budget=time_budget,
+                                                 sample_weight=sample_weight, model=trainee)
+                model = trainee
+                with self._lock:
+                    # Never replace a complete model with a truncated one fitted alongside it
+                    if model.stop_reason == 'complete' or self._cached(key, data) is None:
+                        self.registry[key] = model
+                        self._trained_on[key] = weakref.ref(data)
+                future.set_result(model)
+                MODEL_TRAININGS.inc(outcome='trained')
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight.pop(flight_key, None)
+
+        user.emotion_model = model
+        return model, leader
+
+    @staticmethod
+    def _wait(future, checkpoint, poll_interval=0.1):
+        while True:
+            if checkpoint is not None:
+                checkpoint()
+            try:
+                return future.result(timeout=poll_interval)
+            except FutureTimeoutError:
+                continue
+
+    def trained_models(self):
+        """
+        The cached models whose training data is still alive, as (key, model, data) tuples.
+        """
+        with self._lock:
+            entries = [(key, reference()) for key, reference in self._trained_on.items()]
+        trained = []
+        for key, data in entries:
+            model = self.registry.get(key) if data is not None else None
+            if model is not None and model.is_trained:
+                trained.append((key, model, data))
+        return trained
+
+    def restore(self, key, model, data):
+        """
+        Publishes a model fitted earlier on `data`, e.g. from a snapshot, as if it had been trained here.
+        """
+        with self._lock:
+            self.registry[key] = model
+            self._trained_on[key] = weakref.ref(data)
+
+    def is_ready(self, user, data_count, feature_schema=None, coreset=None):
+        """
+        Whether a trained model for the key is cached, without loading the user's data.
+        """
+        data = user.loaded_data_prefix(data_count)
+        if not isinstance(data, PhysiologicalData):
+            return False
+        key = training_key(user, data_count, feature_schema, coreset)
+        with self._lock:
+            return self._cached(key, data) is not None
+
+
+# The process-wide coordinator used by main() and the shards
+TRAINING_COORDINATOR = TrainingCoordinator()
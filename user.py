@@ -1,15 +1,117 @@
 from user_emotion_model import UserEmotionModel
-import numpy as np
-from collections import Counter
+from neighbor_index import data_sample_index
+from emotion_statistics import print_emotion_statistics
+import threading
 
 class User:
-    def __init__(self, user_profile, physiological_data):
+    __slots__ = ('profile', '_physiological_data', '_data_source', '_data_count', '_data_lock', 'emotion_model',
+                 '_sample_indexes', '_data_prefix')
+
+    def __init__(self, user_profile, physiological_data=None, data_source=None, data_count=None):
+        """
+        A user with a profile and physiological data. When `data_source` is given instead of the data,
+        the user is a stub whose data is loaded by calling `data_source()` on first access. A source
+        called as `data_source(nrows=n)` returns at least the first n rows, for `data_prefix`.
+        """
         self.profile = user_profile
-        self.physiological_data = physiological_data
+        self._physiological_data = physiological_data
+        self._data_source = data_source
+        self._data_count = data_count
+        self._data_lock = threading.Lock()
         self.emotion_model = UserEmotionModel(user_profile['unique-id'], user_profile)
+        self._sample_indexes = {}
+        self._data_prefix = None
+
+    @property
+    def physiological_data(self):
+        if self._physiological_data is None and self._data_source is not None:
+            with self._data_lock:
+                if self._physiological_data is None:
+                    self._physiological_data = self._data_source()
+                    self._data_prefix = None
+        return self._physiological_data
+
+    @physiological_data.setter
+    def physiological_data(self, physiological_data):
+        self._physiological_data = physiological_data
+        self._data_count = None
+        self._sample_indexes = {}
+        self._data_prefix = None
+
+    @property
+    def is_data_loaded(self):
+        return self._physiological_data is not None
+
+    @property
+    def data_count(self):
+        # Use the known row count of a stub so counting does not force its data to load
+        if self._physiological_data is None and self._data_count is not None:
+            return self._data_count
+        data = self.physiological_data
+        return len(data) if data is not None else 0
+
+    @property
+    def known_data_count(self):
+        """
+        The row count if it is known without loading data, otherwise None.
+        """
+        if self._physiological_data is not None:
+            return len(self._physiological_data)
+        return self._data_count
+
+    def data_prefix(self, rows):
+        """
+        Returns data holding at least the user's first `rows` rows, or all of them if there are fewer.
+        A stub reads only those rows from its source; slice the result to use exactly `rows`.
+        """
+        if self._physiological_data is not None or self._data_source is None:
+            return self._physiological_data
+        with self._data_lock:
+            if self._physiological_data is not None:
+                return self._physiological_data
+            if self._data_prefix is None or len(self._data_prefix) < rows:
+                data = self._data_source(nrows=rows)
+                if len(data) < rows:
+                    self._physiological_data = data  # The source has no more rows than these
+                    self._data_prefix = None
+                    return data
+                self._data_prefix = data
+            return self._data_prefix
+
+    def loaded_data_prefix(self, rows):
+        """
+        What `data_prefix(rows)` would return if it is already in memory, otherwise None.
+        """
+        if self._physiological_data is not None:
+            return self._physiological_data
+        data_prefix = self._data_prefix
+        return data_prefix if data_prefix is not None and len(data_prefix) >= rows else None
+
+    def data_count_within(self, limit):
+        """
+        The smaller of the row count and `limit`, reading at most `limit` rows of a stub whose count is unknown.
+        """
+        known_data_count = self.known_data_count
+        if known_data_count is not None or limit <= 0:
+            return max(0, min(known_data_count or 0, limit))
+        data = self.data_prefix(limit)
+        return min(len(data), limit) if data is not None else 0
+
+    def sample_index(self, data_count=None):
+        """
+        Returns a SampleIndex over the first `data_count` samples, built on first use. The index is
+        cached on the loaded data object, so the stubs built for each request share the one built by
+        the first; the user only keeps a reference to skip the lookup.
+        """
+        data_count = self.data_count if data_count is None else self.data_count_within(data_count)
+        index = self._sample_indexes.get(data_count)
+        if index is None:
+            index = data_sample_index(self.data_prefix(data_count), data_count)
+            self._sample_indexes[data_count] = index
+        return index
 
-    def train_emotion_model(self, X, y):
-        self.emotion_model.train_model(X, y)
+    def train_emotion_model(self, X, y, sample_weight=None):
+        self.emotion_model.train_model(X, y, sample_weight=sample_weight)
 
     def predict_emotion(self, physiological_data):
         return self.emotion_model.predict_emotion(physiological_data)
@@ -18,18 +120,5 @@ class User:
         return f"User: {self.profile}\nPhysiological Data: {self.physiological_data}"
 
     def print_statistics(self):
-        # Implement statistics calculation and printing here
-        # Example:
-        emotions_counter = Counter(self.emotion_model.y)
-        total = sum(emotions_counter.values())
-        print("\nEmotion Statistics:")
-        for emotion, count in emotions_counter.items():
-            print(f"{emotion}: {count / total * 100:.2f}%")
-
-        # Print average values for each emotion
-        print("\nAverage Values for Each Emotion:")
-        for label in set(self.emotion_model.y):
-            indices = [i for i, y in enumerate(self.emotion_model.y) if y == label]
-            if indices:
-                average_values = np.mean([self.emotion_model.X[i] for i in indices], axis=0)
-                print(f"Emotion {label}: {average_values}")
+        # Statistics of the data the model was trained on, computed in one vectorized pass
+        print_emotion_statistics(self.emotion_model.emotion_statistics())
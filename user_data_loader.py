@@ -1,14 +1,154 @@
 from user import User
+from physiological_data import PhysiologicalData
+from metrics import LOADER_CACHE_BYTES, LOADER_CACHE_HITS, LOADER_CACHE_MISSES
+from profile_manifest import decode_profile, default_manifest_path, read_manifest, stale_entries
+from utilities import FEATURE_COLUMNS
 import json
 import sqlite3
 import os
+import threading
+from collections import OrderedDict
 import pandas as pd
 
+# Byte budget of the parsed sheets kept across loader instances; the least recently used are dropped beyond it
+WORKBOOK_CACHE_MAX_BYTES = int(os.environ.get('WORKBOOK_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Rough footprint of a cached profile, or of a data sheet's Python objects beyond its arrays
+_SHEET_OVERHEAD_BYTES = 1024
+
+# The only columns parsed from each sheet; any others are dropped by the reader
+PROFILE_COLUMNS = frozenset(['User Profile Aspect', 'Details'])
+DATA_COLUMNS = frozenset(FEATURE_COLUMNS + ['predicted-emotion'])
+
+
+def _is_data_column(column):
+    return column in DATA_COLUMNS
+
+
+def _is_workbook_column(column):
+    return column in DATA_COLUMNS or column in PROFILE_COLUMNS
+
+
+def estimate_sheet_bytes(value):
+    """
+    Estimates the memory held by a cached sheet: the arrays of a data sheet, or a small constant for a profile.
+    """
+    if isinstance(value, PhysiologicalData):
+        return _SHEET_OVERHEAD_BYTES + value.features.nbytes + value.labels.nbytes
+    return _SHEET_OVERHEAD_BYTES
+
+
+class SheetCache:
+    """
+    Parsed workbook sheets keyed by (file path, sheet kind), each stored with the (mtime_ns, size)
+    of the workbook it was read from. When the sheets' estimated size exceeds `max_bytes`, the
+    least recently used are dropped; the sheet being stored is always kept.
+    """
+
+    def __init__(self, max_bytes=WORKBOOK_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._sheets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sheets)
+
+    def get(self, key):
+        """
+        Returns the (signature, value) stored under `key`, or None, and marks it recently used.
+        """
+        with self._lock:
+            entry = self._sheets.get(key)
+            if entry is None:
+                return None
+            self._sheets.move_to_end(key)
+            return entry[:2]
+
+    def put(self, key, signature, value):
+        size = estimate_sheet_bytes(value)
+        with self._lock:
+            self._remove(key)
+            self._sheets[key] = (signature, value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self._sheets) > 1:
+                self._remove(next(iter(self._sheets)))
+            LOADER_CACHE_BYTES.set(self.total_bytes)
+
+    def pop(self, key):
+        with self._lock:
+            self._remove(key)
+            LOADER_CACHE_BYTES.set(self.total_bytes)
+
+    def pop_file(self, path):
+        """
+        Drops every sheet of the workbook at `path`.
+        """
+        with self._lock:
+            for key in [key for key in self._sheets if key[0] == path]:
+                self._remove(key)
+            LOADER_CACHE_BYTES.set(self.total_bytes)
+
+    def items(self):
+        """
+        A snapshot of the cached sheets, as ((path, kind), (signature, value)) pairs.
+        """
+        with self._lock:
+            return [(key, entry[:2]) for key, entry in self._sheets.items()]
+
+    def clear(self):
+        with self._lock:
+            self._sheets.clear()
+            self.total_bytes = 0
+            LOADER_CACHE_BYTES.set(0)
+
+    def _remove(self, key):
+        entry = self._sheets.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+
+# Parsed workbook sheets shared across loader instances
+_workbook_cache = SheetCache()
+
+
+def clear_workbook_cache():
+    _workbook_cache.clear()
+
+
+def evict_workbook_cache(file_path):
+    """
+    Drops every cached sheet of one workbook, e.g. after it was modified or deleted.
+    """
+    _workbook_cache.pop_file(os.path.abspath(file_path))
+
+
+def cached_sheets(directory_path):
+    """
+    The cached sheets of a directory's workbooks, as (file name, kind, signature, value) tuples.
+    """
+    directory = os.path.abspath(directory_path)
+    return [(os.path.basename(path), kind, signature, value)
+            for (path, kind), (signature, value) in _workbook_cache.items() if os.path.dirname(path) == directory]
+
+
+def restore_sheet(file_path, kind, signature, value):
+    """
+    Seeds the cache with a sheet parsed earlier, e.g. from a snapshot. Readers ignore it once the
+    workbook's modification time or size no longer match `signature`.
+    """
+    _workbook_cache.put((os.path.abspath(file_path), kind), tuple(signature), value)
+
+
 class UserDataLoader:
-    def __init__(self, directory_path, update_progress=None, db_path=None):
+    def __init__(self, directory_path, update_progress=None, db_path=None, use_cache=True, manifest_path=None):
         self.directory_path = directory_path
-        self.update_progress = update_progress
+        self.update_progress = update_progress or (lambda stage, details=None: None)
         self.db_path = db_path
+        self.use_cache = use_cache
+        if manifest_path is None and directory_path is not None:
+            manifest_path = default_manifest_path(directory_path)
+        self.manifest_path = manifest_path
 
     def connect_db(self):
         return sqlite3.connect(self.db_path)
@@ -21,16 +161,12 @@ class UserDataLoader:
         self.update_progress("Loading User Data from Files", {"file": "user_data_loader.py", "function": "load_users"})
         for filename in os.listdir(self.directory_path):
             if filename.endswith('.xlsx'):
-                user_data = pd.read_excel(os.path.join(self.directory_path, filename), sheet_name=None)
-                user_profile_sheet = user_data.get('user-profile')
-                data_sheet = user_data.get('data')
-
-                if user_profile_sheet is None or data_sheet is None:
+                parsed = self._load_workbook(os.path.join(self.directory_path, filename))
+                if parsed is None:
                     self.update_progress(f"Skipping file due to missing data: {filename}")
                     continue  # Skip if required data is missing
 
-                user_profile = self._parse_user_profile(user_profile_sheet)
-                physiological_data = self._parse_physiological_data(data_sheet)
+                user_profile, physiological_data = parsed
                 users.append(User(user_profile, physiological_data))  # Create User instance
                 self.update_progress(f"Processing file: {filename}",
                                      {"file": "user_data_loader.py", "function": "load_users",
@@ -46,6 +182,220 @@ class UserDataLoader:
         self.update_progress("User Data Loaded Successfully", {"file": "user_data_loader.py", "function": "load_users", "users": f"{len(users)}"})
         return users
 
+    def load_user_profiles(self):
+        """
+        Phase one of lazy loading: reads only the `user-profile` sheet of every workbook and returns
+        User stubs. Each stub reads its `data` sheet the first time its physiological data is used,
+        so only the users selected by matching pay for loading their data.
+
+        If the directory has a profile manifest (see profile_manifest.py), the stubs are built from it
+        alone without opening any workbook. Files added, modified or removed since the manifest was
+        built, judged by the listing, size and modification time, are read from the workbooks instead.
+        """
+        if not os.path.exists(self.directory_path):
+            raise FileNotFoundError(f"Directory '{self.directory_path}' does not exist.")
+        manifest_entries = {}
+        if self.manifest_path and os.path.isfile(self.manifest_path):
+            manifest = read_manifest(self.manifest_path)
+            stale = set(stale_entries(manifest, self.directory_path))
+            if not stale:
+                return self.load_users_from_manifest(manifest)
+            self.update_progress("Profile Manifest Out of Date", {"file": "user_data_loader.py",
+                                                                  "function": "load_user_profiles",
+                                                                  "stale_files": f"{len(stale)}"})
+            manifest_entries = {entry['file']: entry for entry in manifest['users'] if entry['file'] not in stale}
+
+        users = []
+        self.update_progress("Loading User Profiles from Files", {"file": "user_data_loader.py", "function": "load_user_profiles"})
+        for filename in sorted(os.listdir(self.directory_path)):
+            if filename in manifest_entries:
+                users.append(self._manifest_stub(manifest_entries[filename]))
+            elif filename.endswith('.xlsx'):
+                file_path = os.path.join(self.directory_path, filename)
+                user_profile = self.load_user_profile(file_path)
+                if user_profile is None:
+                    self.update_progress(f"Skipping file due to missing data: {filename}")
+                    continue
+
+                users.append(User(user_profile, data_source=lambda nrows=None, path=file_path: self.load_physiological_data(path, nrows)))
+                self.update_progress(f"Processing profile: {filename}",
+                                     {"file": "user_data_loader.py", "function": "load_user_profiles",
+                                      "user": f"{user_profile.get('first-name')} {user_profile.get('last-name')}",
+                                      "nationality": f"{user_profile.get('nationality')}",
+                                      })
+
+        if not users:
+            self.update_progress(f"No user data files found in '{self.directory_path}'.")
+            return []
+
+        self.update_progress("User Profiles Loaded Successfully", {"file": "user_data_loader.py", "function": "load_user_profiles", "users": f"{len(users)}"})
+        return users
+
+    def load_users_from_manifest(self, manifest=None):
+        """
+        Builds User stubs from the profile manifest, with their row counts known up front.
+        """
+        if manifest is None:
+            manifest = read_manifest(self.manifest_path)
+
+        users = [self._manifest_stub(entry) for entry in manifest['users']]
+
+        self.update_progress("User Profiles Loaded from Manifest",
+                             {"file": "user_data_loader.py", "function": "load_users_from_manifest", "users": f"{len(users)}"})
+        return users
+
+    def _manifest_stub(self, entry):
+        file_path = os.path.join(self.directory_path, entry['file'])
+        return User(decode_profile(entry['profile']),
+                    data_source=lambda nrows=None, path=file_path: self.load_physiological_data(path, nrows),
+                    data_count=entry['row_count'])
+
+    def load_user_profile(self, file_path):
+        """
+        Reads and parses only the `user-profile` sheet of a workbook. Returns None if the sheet is missing.
+        """
+        return self._cached(file_path, 'profile',
+                            lambda: self._read_sheet(file_path, 'user-profile', self._parse_user_profile))
+
+    def load_physiological_data(self, file_path, nrows=None):
+        """
+        Phase two of lazy loading: reads and parses only the `data` sheet of a workbook.
+        Returns an empty list if the sheet is missing.
+
+        With `nrows`, only the sheet's first rows holding that many samples are read, and only the
+        signal and emotion columns are parsed, so I/O and memory scale with the rows a request uses.
+        """
+        try:
+            physiological_data = self._cached_data(file_path, nrows)
+        except FileNotFoundError:
+            physiological_data = None  # Removed since the manifest was built
+        if physiological_data is None:
+            self.update_progress(f"Skipping user data due to missing sheet: {os.path.basename(file_path)}")
+            return PhysiologicalData.empty()
+        self.update_progress(f"Loaded data: {os.path.basename(file_path)}",
+                             {"file": "user_data_loader.py", "function": "load_physiological_data",
+                              "data_points": f"{len(physiological_data)}",
+                              "row_limit": f"{nrows}"})
+        return physiological_data
+
+    def _cached_data(self, file_path, nrows=None):
+        """
+        Returns the parsed `data` sheet, or a prefix of it holding at least `nrows` samples.
+
+        A complete sheet is cached as 'data' and a prefix as 'data-head'; either serves any request
+        it covers, and a prefix is read again, further, only when a request needs more rows.
+        """
+        cache_key, signature = self._cache_key(file_path)
+        cached = self._cache_get(cache_key, signature, 'data')
+        if cached is None and nrows is not None:
+            cached = self._cache_get(cache_key, signature, 'data-head')
+            if cached is not None and len(cached[1]) < nrows:
+                cached = None
+        if cached is not None:
+            LOADER_CACHE_HITS.inc()
+            return cached[1]
+        LOADER_CACHE_MISSES.inc()
+        physiological_data, complete = self._read_data_sheet(file_path, nrows)
+        if physiological_data is not None:
+            self._cache_put(cache_key, signature, 'data' if complete else 'data-head', physiological_data)
+            if complete:
+                self._cache_pop(cache_key, 'data-head')
+        return physiological_data
+
+    def _read_data_sheet(self, file_path, nrows=None):
+        """
+        Reads the `data` sheet's columns, stopping after `nrows` samples when given.
+
+        Returns:
+            tuple: The parsed data, or None if the sheet is missing, and whether the whole sheet was read.
+        """
+        read_rows = nrows
+        while True:
+            try:
+                sheet = pd.read_excel(file_path, sheet_name='data', usecols=_is_data_column, nrows=read_rows)
+            except ValueError:
+                return None, True  # The workbook has no `data` sheet
+            physiological_data = self._parse_physiological_data(sheet)
+            complete = read_rows is None or len(sheet) < read_rows
+            if complete or len(physiological_data) >= nrows:
+                return physiological_data, complete
+            # Blank rows were dropped while parsing; read past them
+            read_rows += nrows - len(physiological_data)
+
+    @staticmethod
+    def _read_sheet(file_path, sheet_name, parse):
+        try:
+            sheet = pd.read_excel(file_path, sheet_name=sheet_name)
+        except ValueError:
+            return None  # The workbook has no sheet with this name
+        return parse(sheet)
+
+    def _cache_key(self, file_path):
+        if not self.use_cache:
+            return None, None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None, None
+        return os.path.abspath(file_path), (stat.st_mtime_ns, stat.st_size)
+
+    def _cache_get(self, cache_key, signature, kind):
+        if cache_key is None:
+            return None
+        cached = _workbook_cache.get((cache_key, kind))
+        if cached is not None and cached[0] == signature:
+            return cached
+        return None
+
+    def _cache_put(self, cache_key, signature, kind, value):
+        if cache_key is not None:
+            _workbook_cache.put((cache_key, kind), signature, value)
+
+    def _cache_pop(self, cache_key, kind):
+        if cache_key is not None:
+            _workbook_cache.pop((cache_key, kind))
+
+    def _cached(self, file_path, kind, read):
+        """
+        Returns the cached parse of one sheet kind ('profile' or 'data') of a workbook, calling `read` on a miss.
+        """
+        cache_key, signature = self._cache_key(file_path)
+        cached = self._cache_get(cache_key, signature, kind)
+        if cached is not None:
+            LOADER_CACHE_HITS.inc()
+            return cached[1]
+        LOADER_CACHE_MISSES.inc()
+        value = read()
+        if value is not None:
+            self._cache_put(cache_key, signature, kind, value)
+        return value
+
+    def _load_workbook(self, file_path):
+        """
+        Returns the parsed (profile, physiological data) of a workbook, or None if a sheet is missing.
+        Unchanged files are served from the shared cache.
+        """
+        cache_key, signature = self._cache_key(file_path)
+        cached_profile = self._cache_get(cache_key, signature, 'profile')
+        cached_data = self._cache_get(cache_key, signature, 'data')
+        if cached_profile is not None and cached_data is not None:
+            LOADER_CACHE_HITS.inc()
+            return cached_profile[1], cached_data[1]
+        LOADER_CACHE_MISSES.inc()
+
+        user_data = pd.read_excel(file_path, sheet_name=None, usecols=_is_workbook_column)
+        user_profile_sheet = user_data.get('user-profile')
+        data_sheet = user_data.get('data')
+        if user_profile_sheet is None or data_sheet is None:
+            return None
+
+        user_profile = self._parse_user_profile(user_profile_sheet)
+        physiological_data = self._parse_physiological_data(data_sheet)
+        self._cache_put(cache_key, signature, 'profile', user_profile)
+        self._cache_put(cache_key, signature, 'data', physiological_data)
+        self._cache_pop(cache_key, 'data-head')
+        return user_profile, physiological_data
+
     def _parse_user_profile(self, profile_df):
         profile_data = {}
         for _, row in profile_df.iterrows():
@@ -59,12 +409,7 @@ class UserDataLoader:
         return profile_data
 
     def _parse_physiological_data(self, data_df):
-        data_entries = []
-        for _, row in data_df.iterrows():
-            if row.notnull().any():
-                entry = {col: row[col] for col in data_df.columns if pd.notna(row[col])}
-                data_entries.append(entry)
-        return data_entries
+        return PhysiologicalData.from_dataframe(data_df)
 
     def save_feedback(self, user_id, feedback):
         conn = self.connect_db()
@@ -89,7 +434,7 @@ class UserDataLoader:
             user_id, user_profile_json, physiological_data_json = user_row
             # Assuming user_profile and physiological_data are stored as JSON strings
             user_profile = json.loads(user_profile_json)
-            physiological_data = json.loads(physiological_data_json)
+            physiological_data = PhysiologicalData.from_samples(json.loads(physiological_data_json))
             users.append(User(user_profile, physiological_data))
 
         conn.close()
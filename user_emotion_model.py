@@ -1,13 +1,30 @@
+import time
+import warnings
 import numpy as np
 from collections import Counter
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
-from utilities import format_label
+from physiological_data import FEATURE_DTYPE, LABEL_DTYPE
+from emotion_statistics import compute_emotion_statistics
+from prediction_log import log_predictions
+from utilities import format_label, EMOTION_TO_LABEL, LABEL_TO_EMOTION
+
+# Anytime training starts with this many trees and doubles them while time and accuracy gains allow
+ANYTIME_FIRST_TREES = 10
+
+# Smallest gain in out-of-bag accuracy between increments that keeps the forest growing
+PLATEAU_TOLERANCE = 0.005
 
 class UserEmotionModel:
     """
     This class represents a model for emotion prediction for a specific user.
     It uses a Random Forest classifier to predict emotions based on physiological data.
+    Training data is kept as float32 features and uint8 label codes; arrays passed in with
+    those dtypes are stored as-is rather than copied.
     """
+    __slots__ = ('user_id', 'emotion_model', 'is_trained', 'X', 'y', 'sample_weight', 'user_conditions',
+                 'feature_schema', 'stop_reason', 'oob_accuracy', 'version')
+
     def __init__(self, user_id, user_conditions):
         super().__init__()
         # Initialize the user model with ID and specific conditions like gender, age, etc.
@@ -16,43 +33,137 @@ class UserEmotionModel:
         self.is_trained = False
         self.X = None  # Training data features
         self.y = None  # Training data labels
-        self.user_conditions = user_conditions  # Conditions like gender, age
-        self.emotion_counter = Counter()
+        self.sample_weight = None  # Rows each training row stands for, e.g. in a coreset; None if one each
+        self.user_conditions = user_conditions  # Conditions like gender, age (shared with the user's profile)
+        self.feature_schema = None  # feature_engine schema the model was trained on; None for the raw signals
+        self.stop_reason = None  # Why training stopped: 'complete', 'budget' or 'plateau'
+        self.oob_accuracy = None  # Out-of-bag accuracy reached by anytime training
+        self.version = None  # Nanosecond time of the last fit, identifying the model in the prediction log
 
-    # Example of training model in UserEmotionModel
-    def train_model(self, X, y):
+    @staticmethod
+    def _as_label_codes(y):
+        # Integer arrays are already label codes; anything else holds emotion names
+        if isinstance(y, np.ndarray) and y.dtype.kind in 'ui':
+            return y.astype(LABEL_DTYPE, copy=False)
+        return np.fromiter((format_label(emo) for emo in y), dtype=LABEL_DTYPE)
+
+    def _append_training_data(self, X, y, sample_weight=None):
+        X = np.asarray(X, dtype=FEATURE_DTYPE)
+        y = self._as_label_codes(y)
+        if sample_weight is not None or self.sample_weight is not None:
+            existing = self.sample_weight if self.sample_weight is not None \
+                else np.ones(len(self.y) if self.y is not None else 0)
+            added = np.asarray(sample_weight, dtype=np.float64) if sample_weight is not None else np.ones(len(y))
+            self.sample_weight = np.append(existing, added)
         self.X = np.vstack([self.X, X]) if self.X is not None else X
-        self.y = np.append(self.y, [format_label(emo) for emo in y]) if self.y is not None else np.array(
-            [format_label(emo) for emo in y])
-        self.emotion_model.fit(self.X, self.y)
+        self.y = np.append(self.y, y) if self.y is not None else y
+
+    # Example of training model in UserEmotionModel
+    def train_model(self, X, y, sample_weight=None):
+        self._append_training_data(X, y, sample_weight)
+        self.emotion_model.fit(self.X, self.y, sample_weight=self.sample_weight)
+        self.is_trained = True
+        self.stop_reason = 'complete'
+        self.version = time.time_ns()
+
+    def train_model_anytime(self, X, y, time_budget=None, max_trees=None, tolerance=PLATEAU_TOLERANCE,
+                            update_progress=None, sample_weight=None):
+        """
+        Grows the forest in increments instead of one blocking fit, trading accuracy for latency.
+
+        Each increment doubles the trees, fitting only the new ones (warm_start), then checks the
+        out-of-bag accuracy and the clock. Training stops when the forest reaches `max_trees`
+        ('complete'), no further tree fits in `time_budget` seconds at the rate measured so far
+        ('budget') or the OOB accuracy gained less than `tolerance` ('plateau'). The last increment
+        is shrunk to what the budget still affords.
+
+        Args:
+            time_budget (float, optional): Seconds to train for; None stops only on a plateau or at `max_trees`.
+            max_trees (int, optional): Defaults to the configured forest's n_estimators.
+        """
+        update_progress = update_progress or (lambda stage, details=None: None)
+        self._append_training_data(X, y, sample_weight)
+        forest = clone(self.emotion_model).set_params(warm_start=True, oob_score=True)
+        max_trees = max_trees or self.emotion_model.n_estimators
+
+        started = time.perf_counter()
+        trees = min(ANYTIME_FIRST_TREES, max_trees)
+        accuracy = None
+        while True:
+            forest.set_params(n_estimators=trees)
+            with warnings.catch_warnings():
+                # The first few trees leave some samples without out-of-bag votes
+                warnings.simplefilter('ignore', UserWarning)
+                forest.fit(self.X, self.y, sample_weight=self.sample_weight)
+            elapsed = time.perf_counter() - started
+            previous, accuracy = accuracy, forest.oob_score_
+            update_progress("Growing Forest", {"file": "user_emotion_model.py", "function": "train_model_anytime",
+                                               "trees": f"{trees}", "oob_accuracy": f"{accuracy:.3f}",
+                                               "elapsed_seconds": f"{elapsed:.2f}"})
+            if trees >= max_trees:
+                stop_reason = 'complete'
+                break
+            if previous is not None and accuracy - previous < tolerance:
+                stop_reason = 'plateau'
+                break
+            affordable = int((time_budget - elapsed) / (elapsed / trees)) if time_budget is not None else max_trees
+            if affordable < 1:
+                stop_reason = 'budget'
+                break
+            trees = min(max_trees, trees * 2, trees + affordable)
+
+        forest.set_params(warm_start=False)  # Later refits, e.g. process_feedback, rebuild the whole forest
+        self.emotion_model = forest
         self.is_trained = True
+        self.stop_reason = stop_reason
+        self.oob_accuracy = accuracy
+        self.version = time.time_ns()
+
+    @property
+    def trees_built(self):
+        return len(getattr(self.emotion_model, 'estimators_', ()))
+
+    @property
+    def emotion_counter(self):
+        if self.y is None:
+            return Counter()
+        counts = np.bincount(self.y, weights=self.sample_weight)
+        return Counter({LABEL_TO_EMOTION.get(label, 'Undefined'): int(round(count))
+                        for label, count in enumerate(counts) if count})
 
     def predict_emotion(self, physiological_data):
+        return self.predict_emotions([physiological_data])[0]
+
+    def predict_emotions(self, samples):
+        """
+        Predicts the emotions of formatted samples in one call and queues them on the prediction log.
+        """
         if not self.is_trained:
             raise Exception("Model not trained")
-        predicted_label = self.emotion_model.predict([physiological_data])[0]
-        emotion = self.map_label_to_emotion(predicted_label)
-        print(f"Predicted label: {predicted_label}, Emotion: {emotion}")
-        return emotion
+        if not len(samples):
+            return []
+        features = np.asarray(samples, dtype=FEATURE_DTYPE).reshape(len(samples), -1)
+        predicted_labels = self.emotion_model.predict(features)
+        log_predictions(self.user_id, self.version, features, predicted_labels)
+        return [self.map_label_to_emotion(predicted_label) for predicted_label in predicted_labels]
 
-    def process_feedback(self, physiological_data, actual_emotion_label):
+    def process_feedback(self, physiological_data, actual_emotion_label, weight=1):
         # Assuming that actual_emotion_label is already in the correct format
         # If not, convert it using format_label or a similar method
-        # Update the training data (self.X and self.y) with the new feedback data
-        self.X = np.vstack([self.X, physiological_data])
-        self.y = np.append(self.y, actual_emotion_label)
+        # Update the training data (self.X and self.y) with the new feedback data; `weight` counts the
+        # sample as that many training rows
+        self._append_training_data(np.atleast_2d(physiological_data), np.atleast_1d(actual_emotion_label),
+                                   sample_weight=[weight] if weight != 1 else None)
         # Retrain the model with the updated data
-        self.emotion_model.fit(self.X, self.y)
+        self.emotion_model.fit(self.X, self.y, sample_weight=self.sample_weight)
         self.is_trained = True
+        self.version = time.time_ns()
         print("Feedback processed and model updated.")
 
     @staticmethod
     def map_label_to_emotion(label):
         # Map the numerical label to the corresponding emotion
-        label_to_emotion = {1: 'Happy', 2: 'Sad', 3: 'Anxious', 4: 'Relaxed', 5: 'Stressed',
-                            6: 'Calm', 7: 'Fearful', 8: 'Confused', 9: 'Content', 10: 'Exhausted',
-                            11: 'Surprised', 12: 'Angry', 13: 'Joyful', 0: 'Undefined'}  # truncated for brevity
-        return label_to_emotion.get(label, 'Undefined')
+        return LABEL_TO_EMOTION.get(label, 'Undefined')
 
     @staticmethod
     def format_label(emotion_name):
@@ -67,16 +178,23 @@ class UserEmotionModel:
         # Example: Check if gender is the same
         return self.user_conditions.get('gender') == other_user_conditions.get('gender')
 
+    def emotion_statistics(self, percentiles=()):
+        """
+        Per-emotion counts, means, variances and percentiles of the training data, in one vectorized pass.
+        """
+        if self.y is None:
+            return compute_emotion_statistics(np.empty((0, 0)), np.empty(0, dtype=LABEL_DTYPE), percentiles)
+        return compute_emotion_statistics(self.X, self.y, percentiles, weights=self.sample_weight)
+
     def calculate_emotion_statistics(self):
-        total_samples = sum(self.emotion_counter.values())
-        if total_samples == 0:
+        statistics = self.emotion_statistics()
+        if statistics["samples"] == 0:
             print("No data available for statistics.")
             return
 
         print("Emotion Statistics:")
-        for emotion, count in self.emotion_counter.items():
-            percentage = (count / total_samples) * 100
-            print(f"{emotion}: {percentage:.2f}%")
+        for emotion, emotion_statistics in statistics["emotions"].items():
+            print(f"{emotion}: {emotion_statistics['share'] * 100:.2f}%")
 
     def print_average_emotion_values(self):
         # Check if the model is trained
@@ -84,14 +202,6 @@ class UserEmotionModel:
             print("Model not trained. No data available for statistics.")
             return
 
-        # Calculate and print average values for each emotion
-        emotion_labels = self.y  # Assuming self.y contains emotion labels
-        unique_labels = set(emotion_labels)
-
-        for label in unique_labels:
-            indices = [i for i, x in enumerate(emotion_labels) if x == label]
-            if indices:
-                average_values = np.mean([self.X[i] for i in indices], axis=0)
-                print(f"Emotion Label {label}: Average Values: {average_values}")
-            else:
-                print(f"Emotion Label {label}: No data available")
\ No newline at end of file
+        # Print average values for each emotion
+        for emotion, emotion_statistics in self.emotion_statistics()["emotions"].items():
+            print(f"Emotion Label {EMOTION_TO_LABEL.get(emotion, 0)}: Average Values: {list(emotion_statistics['mean'].values())}")
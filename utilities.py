@@ -1,3 +1,26 @@
+# Physiological signal columns, in the order format_data returns them
+FEATURE_COLUMNS = ['heart-rate-bpm', 'breathing-rate-breaths-min', 'hrv-ms', 'skin-temp-c', 'emg-mv', 'bvp-unit']
+
+# Mapping of emotion names to numerical labels, shared by every component that stores label codes
+EMOTION_TO_LABEL = {
+    'Happy': 1,
+    'Sad': 2,
+    'Anxious': 3,
+    'Relaxed': 4,
+    'Stressed': 5,
+    'Calm': 6,
+    'Fearful': 7,
+    'Confused': 8,
+    'Content': 9,
+    'Exhausted': 10,
+    'Surprised': 11,
+    'Angry': 12,
+    'Joyful': 13,
+    'Undefined': 0  # Use 0 or another specific number for undefined or other emotions
+}
+LABEL_TO_EMOTION = {label: emotion for emotion, label in EMOTION_TO_LABEL.items()}
+
+
 def format_data(physiological_sample):
     """
     Format the physiological data to be used by the model.
@@ -28,23 +51,4 @@ def format_label(emotion_name):
     Returns:
     int: Numerical label corresponding to the emotion.
     """
-    # Mapping of emotion names to numerical labels
-    emotion_to_label = {
-        'Happy': 1,
-        'Sad': 2,
-        'Anxious': 3,
-        'Relaxed': 4,
-        'Stressed': 5,
-        'Calm': 6,
-        'Fearful': 7,
-        'Confused': 8,
-        'Content': 9,
-        'Exhausted': 10,
-        'Surprised': 11,
-        'Angry': 12,
-        'Joyful': 13,
-        'Undefined': 0  # Use 0 or another specific number for undefined or other emotions
-    }
-
-    return emotion_to_label.get(emotion_name, 0)  # Default to 0 if emotion_name is not in the dictionary
-
+    return EMOTION_TO_LABEL.get(emotion_name, 0)  # Default to 0 if emotion_name is not in the dictionary